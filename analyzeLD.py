@@ -9,6 +9,11 @@
 This module is called with one argument: the path to a configuration file.
 e.g.
 python analyzeLD.py /path/to/config.txt
+Optionally, the per-chromosome part of the analyses (assigning candidates,
+finding their top SNPs, and building and looking up the LD stores) can be
+spread over several processes by adding --workers and a number of processes:
+python analyzeLD.py /path/to/config.txt --workers 8
+The output files are the same whatever the number of workers.
 
 Here is an example configuration file:
 
@@ -28,6 +33,8 @@ Here is an example configuration file:
    | GWAS: GLGC_TC: /path/to/GLGC_TC_clean.txt         |
    | GWAS: DIAGRAM_T2D: /path/to/DIAGRAM_T2D_clean.txt |
    | LDfiles: /path/to/LDchr#.txt                      |
+   | LDmatch: NAME                                     |
+   | LDmode: STORE                                     |
    | Keyword: mykeyword                                |
    | OutputDir: /where/output/will/go/                 |
    | ExtBases: 500000                                  |
@@ -168,6 +175,22 @@ example of the plink command that was used:
     /home/raba/European_LD/chr22rs.id --ld-window-kb 1000 --ld-window 99999
     --ld-window-r2 0.3 --out chr22_Jan15
 
+<LDmatch> is optional, and can be NAME or POSITION. It determines how the top
+GWAS SNPs are found in the LD files. If it is NAME (the default when the field
+is left out of the config file) SNPs are matched on the SNP_A and SNP_B
+identifiers, which must then be the same identifiers used in the GWAS files
+("rs" followed by the identifier in the GWAS file). If it is POSITION, SNPs
+are matched on the BP_A and BP_B coordinates instead, so the identifiers do not
+need to agree but the coordinate systems of the GWAS and LD files must.
+
+<LDmode> is optional, and can be STORE or FILTERED. If it is STORE (the default
+when the field is left out of the config file) a binary LD store is built next
+to each LD file the first time it is needed and is reused by later runs. If
+it is FILTERED, no store is built; instead each LD file is read once and only
+the rows between the top SNPs that the analyses will actually look up are kept
+in memory. FILTERED is faster for a one-off run on a new set of LD files;
+STORE is faster if the same LD files will be used again.
+
 <Keyword> is a phrase without spaces that will be included in the file names
 of module output files.
 
@@ -179,9 +202,11 @@ the region around a FocusFeature will be used. ExtBases will be used to
 extend the FocusFeature by the specified number of bases in both directions
 (i.e. if ExtBases is 500 then for a FocusFeature located at coordinates
 1200-1800, the region for this FocusFeature will include 700-2300.)
-Warning: if ExtBases is chosen to be too large, this module may take a very
-long time to run, because there will be many PeripheralFeatures in the region
-of each FocusFeature.
+Note: if ExtBases is chosen to be very large, there will be many
+PeripheralFeatures in the region of each FocusFeature, and the output files
+will be correspondingly large. The PeripheralFeatures in each region are found
+using an interval index (see CandidateIndex Class), so the search itself stays
+fast.
 
 #===============================================================================
                              OUTPUT FILE FORMATS:
@@ -274,10 +299,16 @@ pairing. Columns:
     > distance (between top SNP in FocusFeature and top SNP in other feat)
     > LD (between top SNP in FocusFeature and top SNP in other feat)"""
 
+import array
+import bisect
+import collections
 import copy
 import cPickle
+import mmap
+import multiprocessing
+import os
 import os.path
-import shelve
+import struct
 import sys
 import time
 
@@ -300,9 +331,10 @@ def returnCandidates(candidatespath):
         [],[],[],[],[]]
     for line in candidatesfile:
         lineaslist=line.rsplit()
-        allcandidates[int(lineaslist[2])-1].append({"name":lineaslist[0],
-                    "GWAS":lineaslist[1],"chrom":int(lineaslist[2]),
-                    "start":int(lineaslist[3]),"stop":int(lineaslist[4])})
+        allcandidates[int(lineaslist[2])-1].append(sharedcandidate(
+                    {"name":lineaslist[0],"GWAS":lineaslist[1],
+                     "chrom":int(lineaslist[2]),"start":int(lineaslist[3]),
+                     "stop":int(lineaslist[4])}))
     print "Done initializing PeripheralFeatures"
     return allcandidates
 
@@ -325,13 +357,14 @@ def initializeRegionobjects(whichanalyses,gwaspathsdict):
     print "Initializing FocusFeatures"
     regobjects=[[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],
         [],[],[],[],[],[]]
+    existing={} #keys are focusfeatkey() tuples; values are Region objects
     for analysistype in whichanalyses: #analysistypes=keys in {whichanalyses}
         featsfile=open(whichanalyses[analysistype],'r')
         for line in featsfile:
             #Read what FocusFeature is being described
             lineaslist=line.rsplit()
-            featname=lineaslist[0]
-            featgwas=lineaslist[1]
+            featname=intern(lineaslist[0])
+            featgwas=intern(lineaslist[1])
             featchrom=int(lineaslist[2])
             featstart=int(lineaslist[3])
             featstop=int(lineaslist[4])
@@ -344,47 +377,34 @@ def initializeRegionobjects(whichanalyses,gwaspathsdict):
             #so that if needed you can change what the variable 'newobject'
             #is pointing to
             alreadyexists=False
-            for existingob in regobjects[featchrom-1]:
-                if newobject.focusfeat==existingob.focusfeat:
-                    newobject=existingob
-                    alreadyexists=True
-                    break
+            key=focusfeatkey(newobject.focusfeat)
+            if key in existing:
+                newobject=existing[key]
+                alreadyexists=True
             #Update the trackanalysis property of the Region object
-            if "self" not in newobject.trackanalyses:
-                newobject.trackanalyses["self"]=[analysistype]
-            else:
-                if analysistype not in newobject.trackanalyses["self"]:
-                    newobject.trackanalyses["self"].append(analysistype)
+            newobject.addanalysis("self",analysistype)
             #Add it if it doesn't already exist
             if (not(alreadyexists)):
                 regobjects[featchrom-1].append(newobject)
+                existing[key]=newobject
             #If applicable, now parse the additional lines of SpecPairA files:
             if analysistype=="SpecPairA":
-                newcnd={"name":lineaslist[5],"chrom":int(lineaslist[7]),
-                        "start":int(lineaslist[8]),"stop":int(lineaslist[9]),
-                        "GWAS":lineaslist[6]}
-                if newcnd not in newobject.candidates:
-                    newobject.candidates.append(newcnd)
-                else:
-                    for c in newobject.candidates:
-                        if c==newcnd:
-                            newcnd=c #make the variable 'newcnd' refer to the
-                            #already-existing object
-                            break
+                newcnd=sharedcandidate({"name":lineaslist[5],
+                        "chrom":int(lineaslist[7]),"start":int(lineaslist[8]),
+                        "stop":int(lineaslist[9]),"GWAS":lineaslist[6]})
+                newcnd=newobject.addcandidate(newcnd) #if it was already
+                #there, 'newcnd' now refers to the already-existing object
                 nc=newcnd["name"]
                 if nc not in newobject.candidateGWASpvals:
                     newobject.candidateGWASpvals[nc]=getTopSNP(newcnd["chrom"],
                         newcnd["start"],newcnd["stop"],gwaspathsdict[featgwas])
-                if nc not in newobject.trackanalyses:
-                    newobject.trackanalyses[nc]=(["SpecPairA"])
-                else: 
-                    if ("SpecPairA" not in newobject.trackanalyses[nc]):
-                        newobject.trackanalyses[nc].append("SpecPairA")
+                newobject.addanalysis(nc,"SpecPairA")
         featsfile.close()
     return regobjects
 
 def addCandidatestoRegionobjects(extbases,regobjects,gwaspathsdict,
-                                 whichanalysis,candidatespath=""):
+                                 whichanalysis,candidatespath="",
+                                 allcandidates_bychrom=None):
     """Assign 'Candidates' to each FocusFeature for the FocusPeriphA or
     TopRegSNPA analyses.
     PARAMETERS:
@@ -401,6 +421,9 @@ def addCandidatestoRegionobjects(extbases,regobjects,gwaspathsdict,
     <candidatespath> is the path to the file for PeripheralFeatures. This
         argument is only required if <whichanalysis> is 'FocusPeriphA'. See
         description of PeripheralFeatures file in module docstring.
+    <allcandidates_bychrom> is optional, and is the output of
+        returnCandidates(). If it is given, it is used instead of reading
+        the file at <candidatespath>.
     OUTPUT: This function modifies <regobjects> in places. It does not have an
     explcit return value.
     If <whichanalysis> is 'FocusPeriphA':
@@ -415,125 +438,346 @@ def addCandidatestoRegionobjects(extbases,regobjects,gwaspathsdict,
         Region. If the top SNP in the Region is outside of the FocusFeature,
         then this SNP is added to the 'candidates' property."""
     if whichanalysis=="FocusPeriphA":
-        allcandidates_bychrom=returnCandidates(candidatespath)
+        if allcandidates_bychrom is None:
+            allcandidates_bychrom=returnCandidates(candidatespath)
         #for each tblobject, determine if there are any candidates in its region
         print "Finding the PeripheralFeatures in the region of each FocusFeat"
         for index in xrange(22):
+            candidx=CandidateIndex(allcandidates_bychrom[index])
             for ob in regobjects[index]:
                 regionstart=ob.focusfeat["start"]-extbases
                 regionstop=ob.focusfeat["stop"]+extbases
-                for can in allcandidates_bychrom[index]:
-                    if ((regionstart <= can["start"] <= regionstop)
-                        and (regionstart <= can["stop"] <= regionstop)):
-                        if can not in ob.candidates: #only add it if it's
-                            #not already there
-                            ob.candidates.append(can)
-                        #Now update trackanalysis property of the Region
-                        cn=can["name"]
-                        if cn not in ob.trackanalyses:
-                            ob.trackanalyses[cn]=["FocusPeriphA"]
-                        else:
-                            if "FocusPeriphA" not in ob.trackanalyses[cn]:
-                                ob.trackanalyses[cn].append("FocusPeriphA")
+                for can in candidx.contained(regionstart,regionstop):
+                    ob.addcandidate(can) #only adds it if it's not already there
+                    #Now update trackanalysis property of the Region
+                    ob.addanalysis(can["name"],"FocusPeriphA")
         #Now update the candidateGWASpvals property
         #you CANNOT update the 'trackanalyses' property here because you're
         #iterating over ALL candidates currently existing, which may include
         #some SpecPairA candidates that you do NOT want to also classify as
         #FocusPeriphA
         print "Finding the GWAS p-values for each PeripheralFeature"
+        queries=[] #(chrom,start,stop,GWAS) for every lookup needed
+        needed=[] #(Region object, candidate name) for every lookup needed
         for index2 in xrange(22):
             for ob in regobjects[index2]:
+                queued=set()
                 for candi in ob.candidates:
                     cn=candi["name"]
-                    if cn not in ob.candidateGWASpvals:
-                        ob.candidateGWASpvals[cn]=getTopSNP(
-                            candi["chrom"],candi["start"],candi["stop"],
-                            gwaspathsdict[ob.focusfeat["GWAS"]])
+                    if cn not in ob.candidateGWASpvals and cn not in queued:
+                        queued.add(cn)
+                        queries.append((candi["chrom"],candi["start"],
+                                        candi["stop"],ob.focusfeat["GWAS"]))
+                        needed.append((ob,cn))
+        answers=_getTopSNPs_batched(queries,gwaspathsdict)
+        for which in xrange(len(needed)):
+            ob,cn=needed[which]
+            ob.candidateGWASpvals[cn]=answers[which]
     if whichanalysis=="TopRegSNPA":
         print "Finding the top SNP in each Region"
+        queries=[]
         for index in xrange(22):
             for ob in regobjects[index]:
-                topregSNP=getTopSNP(ob.focusfeat["chrom"],
-                                    ob.focusfeat["start"]-extbases,
-                                    ob.focusfeat["stop"]+extbases,
-                                    gwaspathsdict[ob.focusfeat["GWAS"]])[0]
+                queries.append((ob.focusfeat["chrom"],
+                                ob.focusfeat["start"]-extbases,
+                                ob.focusfeat["stop"]+extbases,
+                                ob.focusfeat["GWAS"]))
+        answers=_getTopSNPs_batched(queries,gwaspathsdict)
+        which=0
+        for index in xrange(22):
+            for ob in regobjects[index]:
+                topregSNP=answers[which][0]
+                which+=1
                 if ob.focusfeat["SNPs"][0]!=topregSNP and topregSNP[0]!="rsNA":
-                    newcnd={"name":topregSNP[0],"chrom":index+1,
-                            "start":topregSNP[2],"stop":topregSNP[2],
-                            "GWAS":ob.focusfeat["GWAS"]}
-                    if newcnd not in ob.candidates:
-                        ob.candidates.append(newcnd)
-                    else: #newcnd is already there
-                        for c in ob.candidates:
-                            if c==newcnd:
-                                newcnd=c #make the variable 'newcnd'
-                                #refer to the already-existing object
-                                break
+                    newcnd=sharedcandidate({"name":topregSNP[0],
+                            "chrom":index+1,"start":topregSNP[2],
+                            "stop":topregSNP[2],"GWAS":ob.focusfeat["GWAS"]})
+                    newcnd=ob.addcandidate(newcnd) #if newcnd was already
+                    #there, 'newcnd' now refers to the already-existing object
                     cn=newcnd["name"]
                     if cn not in ob.candidateGWASpvals:
                         ob.candidateGWASpvals[cn]=[topregSNP]
-                    if cn not in ob.trackanalyses:
-                        ob.trackanalyses[cn]=["TopRegSNPA"]
-                    else:
-                        if "TopRegSNPA" not in ob.trackanalyses[cn]:
-                            ob.trackanalyses[cn].append("TopRegSNPA")
-
-def shelve_LD_files(myregions,LDlocation,chrom):
-    """Create a shelve file for <chrom> containing LD info from <LDlocation>.
+                    ob.addanalysis(cn,"TopRegSNPA")
+
+def _getTopSNPs_batched(queries,gwaspathsdict):
+    """Return the output of getTopSNP() for every query in <queries>.
+    <queries> is a list of (chrom,start,stop,GWAS name) tuples and
+    <gwaspathsdict> is the dictionary described in addCandidatestoRegionobjects().
+    The queries are grouped by chromosome and GWAS so that each group is
+    answered by one call to getTopSNPs(). The results are returned as a list
+    in the same order as <queries>."""
+    results=[None]*len(queries)
+    groups={} #keys are (chrom,GWAS name); values are lists of query indices
+    for q in xrange(len(queries)):
+        groupkey=(queries[q][0],queries[q][3])
+        if groupkey not in groups:
+            groups[groupkey]=[]
+        groups[groupkey].append(q)
+    for groupkey in groups:
+        qdexes=groups[groupkey]
+        answers=getTopSNPs(groupkey[0],
+                           [(queries[q][1],queries[q][2]) for q in qdexes],
+                           gwaspathsdict[groupkey[1]])
+        for which in xrange(len(qdexes)):
+            results[qdexes[which]]=answers[which]
+    return results
+
+def store_LD_files(myregions,LDlocation,chrom):
+    """Create a binary LD store for <chrom> containing LD info from <LDlocation>.
     PARAMETERS:
     <myregions> is a list of region objects that will require LD lookup.
     <LDlocation> is the path to an LD file, with the specific chromosome
         number replaced by #. See LDfiles description in module docstring.
     <chromnum> is an int for chromosome (chr1 = 1)
-    NOTES: Shelve keys are SNP_A rs number and values are lists of strings
-    where each string has the format "SNP_B_name R2" for every SNP_B that
-    SNP_A is in LD with. The usefulness of this function's output relies
-    entirely on having consistent SNP identifiers between the GWAS files and
-    the PLINK LD output files, because the output will be searched for
-    GWAS SNPs on the basis of rs number.
+    NOTES: The store is saved next to the LD file, at the path returned by
+    _LDstorepath(), in the format described in the LDstore Class. It is
+    opened with LDstore() and searched by SNP identifier, so the usefulness
+    of this function's output relies entirely on having consistent SNP
+    identifiers between the GWAS files and the PLINK LD output files.
+    The LD file is read twice: first to collect every SNP identifier, then
+    to write the rows for each SNP_A to temporary files, which are finally
+    copied into the store in SNP_A order. Memory use therefore depends on the
+    number of distinct SNPs, not on the number of rows in the LD file.
+    As with the shelve files this function used to create, if the rows for a
+    SNP_A appear in more than one group, the last group is kept, and if the
+    same SNP_A/SNP_B pair appears more than once within a group, the last
+    R2 is kept.
+    The header line written by PLINK, and any other line without a numeric
+    R2 column, is skipped in both passes.
     WARNING: the LD files at <LDlocation> must have their entries grouped by
     SNP_A name (not necessarily alphanumerically sorted, but every entry
     related to SNP_A should appear consecutively). Producing output grouped
     by SNP_A name is the default behavior of PLINK, but if different software
     was used to acquire LD information, you must specifically make sure it is
     grouped by SNP_A name."""
-    print "Creating LDshelve for LD lookup, chr"+`chrom+1`
-    oldLDfile=open(LDlocation.replace("#",`chrom+1`),'r')
-    LDshelve=shelve.open(LDlocation.replace("#",`chrom+1`)+"shelved.db",
-                  protocol=2,writeback=False)
-    previousrsnum=""
-    previousval=[]
+    print "Creating LDstore for LD lookup, chr"+`chrom+1`
+    LDpath=LDlocation.replace("#",`chrom+1`)
+    storepath=_LDstorepath(LDlocation,chrom)
+    #First pass: SNP identifiers
+    names=set()
+    oldLDfile=open(LDpath,'r')
+    for line in oldLDfile:
+        lineaslist=line.rsplit()
+        if not _isLDrow(lineaslist): #the header line
+            continue
+        names.add(lineaslist[2])
+        names.add(lineaslist[5])
+    oldLDfile.close()
+    names=sorted(names)
+    nameids={}
+    for nameid in xrange(len(names)):
+        nameids[names[nameid]]=nameid
+    #Second pass: write each SNP_A group (sorted by SNP_B) to temporary files
+    blocks={} #keys are SNP_A ids; values are (first row, number of rows)
+    tmpBids=open(storepath+".Bids.tmp",'wb')
+    tmpR2s=open(storepath+".R2s.tmp",'wb')
+    rowcount=[0]
+    def writeblock(SNPAid,group):
+        if SNPAid is None:
+            return
+        Bids=sorted(group)
+        _writevalues(tmpBids,"I",Bids)
+        _writevalues(tmpR2s,"d",[group[Bid] for Bid in Bids])
+        blocks[SNPAid]=(rowcount[0],len(Bids))
+        rowcount[0]+=len(Bids)
+    previousid=None
+    group={} #keys are SNP_B ids; values are R2s
+    oldLDfile=open(LDpath,'r')
+    for line in oldLDfile:
+        lineaslist=line.rsplit()
+        if not _isLDrow(lineaslist):
+            continue
+        SNPAid=nameids[lineaslist[2]]
+        if SNPAid!=previousid:
+            writeblock(previousid,group)
+            previousid=SNPAid
+            group={}
+        group[nameids[lineaslist[5]]]=float(lineaslist[6])
+    writeblock(previousid,group) #the very last SNP_A in the file
+    oldLDfile.close()
+    tmpBids.close()
+    tmpR2s.close()
+    #Assemble the store
+    Aids=sorted(blocks)
+    offsets=[0]
+    for Aid in Aids:
+        offsets.append(offsets[-1]+blocks[Aid][1])
+    nameoffsets=[0]
+    for name in names:
+        nameoffsets.append(nameoffsets[-1]+len(name))
+    nameblob="".join(names)
+    nameblob=nameblob+"\0"*(-len(nameblob)%8)
+    store=open(storepath+".tmp",'wb')
+    store.write(struct.pack(LDstore.HEADER,LDstore.MAGIC,len(names),len(Aids),
+                            offsets[-1]))
+    _writevalues(store,"Q",nameoffsets)
+    store.write(nameblob)
+    _writevalues(store,"I",Aids)
+    if len(Aids)%2:
+        store.write("\0"*4) #keep the offsets 8-byte aligned
+    _writevalues(store,"Q",offsets)
+    for tmppath,width in [(storepath+".Bids.tmp",4),(storepath+".R2s.tmp",8)]:
+        tmpfile=open(tmppath,'rb')
+        for Aid in Aids:
+            tmpfile.seek(width*blocks[Aid][0])
+            store.write(tmpfile.read(width*blocks[Aid][1]))
+        tmpfile.close()
+        os.remove(tmppath)
+        if width==4 and offsets[-1]%2:
+            store.write("\0"*4) #keep the R2s 8-byte aligned
+    store.close()
+    os.rename(storepath+".tmp",storepath)
+
+def store_LD_positions(LDlocation,chrom):
+    """Create a position-keyed binary LD store for <chrom> containing LD info
+    from <LDlocation>.
+    PARAMETERS:
+    <LDlocation> is the path to an LD file, with the specific chromosome
+        number replaced by #. See LDfiles description in module docstring.
+    <chrom> is an int for chromosome index (chr1 = 0)
+    NOTES: The store is saved next to the LD file, at the path returned by
+    _LDpositionstorepath(), in the format described in the LDpositionstore
+    Class. Only the BP_A, BP_B and R2 columns of the LD file are used, so
+    no SNP identifiers are kept. Like store_LD_files(), the rows for each
+    BP_A are written to temporary files as they are read and only copied
+    into the store, in BP_A order, at the end. If the same BP_A/BP_B pair
+    appears more than once in the LD file, the last R2 is kept. The rows do
+    not have to be grouped by BP_A, but building is fastest if they are.
+    The header line written by PLINK is skipped, as in store_LD_files()."""
+    print "Creating LDpositionstore for LD lookup, chr"+`chrom+1`
+    LDpath=LDlocation.replace("#",`chrom+1`)
+    storepath=_LDpositionstorepath(LDlocation,chrom)
+    blocks={} #keys are BP_A; values are lists of (first row, number of rows)
+    tmpBPBs=open(storepath+".BPBs.tmp",'wb')
+    tmpR2s=open(storepath+".R2s.tmp",'wb')
+    rowcount=[0]
+    def writeblock(BPA,group):
+        if BPA is None:
+            return
+        BPBs=sorted(group)
+        _writevalues(tmpBPBs,"I",BPBs)
+        _writevalues(tmpR2s,"d",[group[BPB] for BPB in BPBs])
+        if BPA not in blocks:
+            blocks[BPA]=[]
+        blocks[BPA].append((rowcount[0],len(BPBs)))
+        rowcount[0]+=len(BPBs)
+    previousBPA=None
+    group={} #keys are BP_B; values are R2s
+    oldLDfile=open(LDpath,'r')
     for line in oldLDfile:
         lineaslist=line.rsplit()
-        SNPAname=lineaslist[2]
-        info=lineaslist[5]+" "+lineaslist[6] #SNP_B name, R2
-        if SNPAname==previousrsnum:
-            previousval.append(info)
-        else: #new rs num
-            LDshelve[previousrsnum]=previousval
-            previousrsnum=SNPAname
-            previousval=[info]
-    #once done looping over file, need to write out the info for the very last
-    #SNP_A recorded in the file: (otherwise it will never be written out)
-    LDshelve[previousrsnum]=previousval
+        if not _isLDrow(lineaslist): #the header line
+            continue
+        BPA=int(lineaslist[1])
+        if BPA!=previousBPA:
+            writeblock(previousBPA,group)
+            previousBPA=BPA
+            group={}
+        group[int(lineaslist[4])]=float(lineaslist[6])
+    writeblock(previousBPA,group) #the very last BP_A in the file
     oldLDfile.close()
-    LDshelve.close()
+    tmpBPBs.close()
+    tmpR2s.close()
+    #Assemble the store: one sorted array of BP_A<<32|BP_B keys, then R2s
+    tmpBPBs=open(storepath+".BPBs.tmp",'rb')
+    tmpR2s=open(storepath+".R2s.tmp",'rb')
+    store=open(storepath+".tmp",'wb')
+    store.write(struct.pack(LDpositionstore.HEADER,LDpositionstore.MAGIC,0))
+    R2sorted=open(storepath+".R2sorted.tmp",'wb')
+    nrows=0
+    for BPA in sorted(blocks):
+        merged={}
+        for first,count in blocks[BPA]: #later blocks replace earlier R2s
+            tmpBPBs.seek(4*first)
+            tmpR2s.seek(8*first)
+            BPBs=struct.unpack("<"+`count`+"I",tmpBPBs.read(4*count))
+            R2s=struct.unpack("<"+`count`+"d",tmpR2s.read(8*count))
+            for which in xrange(count):
+                merged[BPBs[which]]=R2s[which]
+        BPBs=sorted(merged)
+        _writevalues(store,"Q",[(BPA<<32)|BPB for BPB in BPBs])
+        _writevalues(R2sorted,"d",[merged[BPB] for BPB in BPBs])
+        nrows+=len(BPBs)
+    tmpBPBs.close()
+    tmpR2s.close()
+    R2sorted.close()
+    R2sorted=open(storepath+".R2sorted.tmp",'rb')
+    chunk=R2sorted.read(1<<24)
+    while chunk:
+        store.write(chunk)
+        chunk=R2sorted.read(1<<24)
+    R2sorted.close()
+    store.seek(0)
+    store.write(struct.pack(LDpositionstore.HEADER,LDpositionstore.MAGIC,nrows))
+    store.close()
+    for tmppath in [".BPBs.tmp",".R2s.tmp",".R2sorted.tmp"]:
+        os.remove(storepath+tmppath)
+    os.rename(storepath+".tmp",storepath)
+
+def _LDpositionstorepath(LDlocation,chrom):
+    """Return the path of the position-keyed LD store for chromosome index
+    <chrom> (chr1 = 0) built from the LD files at <LDlocation>."""
+    return LDlocation.replace("#",`chrom+1`)+"_LDpositionstore.bin"
 
-def editRegions_re_LD(myregions,LDlocation):
+def _LDstorepath(LDlocation,chrom):
+    """Return the path of the LD store for chromosome index <chrom> (chr1 = 0)
+    built from the LD files at <LDlocation>."""
+    return LDlocation.replace("#",`chrom+1`)+"_LDstore.bin"
+
+def _writevalues(fileobj,typecode,values):
+    """Write the list <values> to <fileobj> as little-endian values of struct
+    type <typecode> ("I" or "Q" for unsigned ints, "d" for floats)."""
+    for chunk in xrange(0,len(values),1000000):
+        part=values[chunk:chunk+1000000]
+        fileobj.write(struct.pack("<"+`len(part)`+typecode,*part))
+
+def _isstore(storepath,magic):
+    """Return True if there is a file at <storepath> that starts with the
+    string <magic>, i.e. an LD store in the current format. A store made by
+    an earlier version of this module, with a different magic string, has to
+    be built again."""
+    if not os.path.exists(storepath):
+        return False
+    storefile=open(storepath,'rb')
+    start=storefile.read(len(magic))
+    storefile.close()
+    return start==magic
+
+def _isLDrow(lineaslist):
+    """Return True if <lineaslist>, a line of an LD file split on whitespace,
+    is a row of LD information, i.e. it has an R2 column that is a number.
+    This is False for the header line that PLINK writes at the top of each
+    LD file (CHR_A BP_A SNP_A CHR_B BP_B SNP_B R2) and for blank lines."""
+    if len(lineaslist)<7:
+        return False
+    try:
+        float(lineaslist[6])
+    except ValueError:
+        return False
+    return True
+
+def editRegions_re_LD(myregions,LDlocation,matchby="NAME",mode="STORE"):
     """Add LD information to Region objects.
     PARAMETERS:
     <myregions> is the list of Region objects that will have LD info added.
     <LDlocation> is the path to an LD file, with the specific chromosome
         number replaced by #. See LDfiles description in module docstring.
-    NOTES: This function looks for SNPs in the LD files on the basis of
-    location, NOT SNP identifier. It is thus extra important to make sure that
+    <matchby> is "NAME" or "POSITION". See LDmatch description in module
+        docstring.
+    <mode> is "STORE" or "FILTERED". See LDmode description in module
+        docstring, and the LDfiltered Class.
+    NOTES: If <matchby> is "NAME", this function looks for SNPs in the LD files
+    on the basis of SNP identifier, using an LDstore (see store_LD_files()).
+    If <matchby> is "POSITION", it looks for SNPs on the basis of location,
+    NOT SNP identifier, using an LDpositionstore (see store_LD_positions()).
+    In that case it is extra important to make sure that
     all of your input files have a consistent coordinate system, especially
     the LD files and GWAS files, otherwise it will be impossible to properly
     match SNPs across files in the manner necessary to complete these analyses.
     OUTPUT: This function modifies <myregions> in place, to add LD information.
     There is no explicit return value."""
     #Figure out which chromosomes are relevant (don't want to go thru work
-    #of making a shelve file for a chromosome unless there is at least one
+    #of making an LD store for a chromosome unless there is at least one
     #Region object on that chromosome)
     relevant=[]
     for index in xrange(22):
@@ -542,63 +786,171 @@ def editRegions_re_LD(myregions,LDlocation):
     pairnotfound=0
     LDnotfound=0
     for index in relevant:
-        chrm=myregions[index]
-        if not os.path.exists(LDlocation.replace("#",`index+1`)+"shelved.db"):
-            shelve_LD_files(myregions,LDlocation,index)
-        LDshelve=shelve.open(LDlocation.replace("#",`index+1`)+"shelved.db",
-                  protocol=2,writeback=False)
-        print "Looking up LD for chr"+`index+1`
-        for ob in chrm:
-            assert len(ob.focusfeat["SNPs"])==1 #Note that the only SNP stored
-            #in focusfeat["SNPs"] will be the SNP in the focusfeat with the
-            #smallest GWAS p-value. See getTopSNP() which is the function used
-            #to populate the "SNPs" value.
-            focusfeatSNPname=ob.focusfeat["SNPs"][0][0]
-            try:
-                excerptfromfile=LDshelve[focusfeatSNPname]
-                #excerptfromfile is a list of strings describing all the rows in
-                #the LD file where SNP_A is the top SNP in the FocusFeat.
-                #Format of strings: "SNP_B_name R2"
-            except KeyError:
-                #it's possible that PLINK didn't find any LD between the top
-                #SNP in the linc and any other SNPs, in which case the
-                #LDshelve will not contain a key of SNP_A coordinate
-                excerptfromfile=[]
-            #Now, look for the instances where SNP_B is the top SNP in one
-            #of the candidates
-            for candidate in ob.candidates:
-                candidateSNPname=ob.candidateGWASpvals[candidate["name"]][0][0]
-                for row in excerptfromfile:
-                    rowaslist=row.rsplit()
-                    if candidateSNPname==rowaslist[0]:
-                        ob.candidateLD[candidate["name"]]=[(focusfeatSNPname,
-                                candidateSNPname,float(rowaslist[1]))]
-                    #tuple format (SNP_A rs, SNP_B rs, R-squared)
-                if candidate["name"] not in ob.candidateLD:
-                    ob.candidateLD[candidate["name"]]=[("rsNA","rsNA",2)]
-                    if len(excerptfromfile)!=0:
-                        #LD was found between focusfeatSNP and some other SNPs,
-                        #but not with this candidate's top SNP in particular
-                        pairnotfound+=1
-                    else: #LD was not found for focusfeatSNP with any SNPs
-                        LDnotfound+=1
-            assert (len(set([c["name"] for c in ob.candidates]))
-                    ==len(set(ob.candidateLD.keys()))), ("Error:"
-                    +" names of ob.candidates were "
-                    +`set([c["name"] for c in ob.candidates])`
-                    +" but keys in ob.candidateLD were "
-                    +`ob.candidateLD.keys()`)
-                #use 'set' rather than comparing lengths directly because you
-                #could have two candidates with the same name but different
-                #internal properties, e.g. GENE1 in GWASA and GENE1 in GWASB,
-                #in which case you would have two entries in ob.candidates
-                #but only one entry in ob.candidateLD
+        counts=_editRegions_re_LD_chrom(myregions[index],LDlocation,index,
+                                        matchby,mode)
+        LDnotfound+=counts[0]
+        pairnotfound+=counts[1]
     print ("Count: LD for top FocusFeature SNP was not found with "
             +"any SNPs: "+`LDnotfound`)
     print ("Count: LD for top FocusFeature SNP was found with some SNPs, "
             +"but not with a particular candidate gene's top SNP: "
             +`pairnotfound`)
 
+def _editRegions_re_LD_chrom(chrm,LDlocation,index,matchby,mode="STORE"):
+    """Add LD information to the Region objects in <chrm>, which are all on
+    chromosome index <index> (chr1 = 0). This does the work of
+    editRegions_re_LD() for one chromosome and returns the counts
+    (LDnotfound, pairnotfound) described by the messages it prints."""
+    assert matchby in ["NAME","POSITION"], ("Error: matchby must be NAME or"
+                                            +" POSITION, not "+`matchby`)
+    assert mode in ["STORE","FILTERED"], ("Error: mode must be STORE or"
+                                          +" FILTERED, not "+`mode`)
+    pairnotfound=0
+    LDnotfound=0
+    if mode=="FILTERED":
+        if matchby=="NAME":
+            keyfield=0
+        else:
+            keyfield=2
+        neededA=set()
+        neededB=set()
+        for ob in chrm:
+            neededA.add(ob.focusfeat["SNPs"][0][keyfield])
+            for candidate in ob.candidates:
+                neededB.add(
+                    ob.candidateGWASpvals[candidate["name"]][0][keyfield])
+        LDlookup=LDfiltered(LDlocation.replace("#",`index+1`),neededA,
+                            neededB,matchby)
+    elif matchby=="NAME":
+        keyfield=0 #look SNPs up by name; see format of SNP tuples in Region
+        if not _isstore(_LDstorepath(LDlocation,index),LDstore.MAGIC):
+            store_LD_files(None,LDlocation,index)
+        LDlookup=LDstore(_LDstorepath(LDlocation,index))
+    else:
+        keyfield=2 #look SNPs up by coordinate
+        if not _isstore(_LDpositionstorepath(LDlocation,index),
+                        LDpositionstore.MAGIC):
+            store_LD_positions(LDlocation,index)
+        LDlookup=LDpositionstore(_LDpositionstorepath(LDlocation,index))
+    print "Looking up LD for chr"+`index+1`
+    for ob in chrm:
+        assert len(ob.focusfeat["SNPs"])==1 #Note that the only SNP stored
+        #in focusfeat["SNPs"] will be the SNP in the focusfeat with the
+        #smallest GWAS p-value. See getTopSNP() which is the function used
+        #to populate the "SNPs" value.
+        focusfeatSNPname=ob.focusfeat["SNPs"][0][0]
+        focusfeatSNPkey=ob.focusfeat["SNPs"][0][keyfield]
+        #it's possible that PLINK didn't find any LD between the top
+        #SNP in the linc and any other SNPs, in which case the
+        #LDstore will not contain any rows with that SNP_A
+        focusfeatfound=LDlookup.hasSNP(focusfeatSNPkey)
+        #Now, look for the row where SNP_B is the top SNP in each of the
+        #candidates
+        for candidate in ob.candidates:
+            candidateSNP=ob.candidateGWASpvals[candidate["name"]][0]
+            candidateSNPname=candidateSNP[0]
+            if focusfeatfound:
+                r2=LDlookup.r2(focusfeatSNPkey,candidateSNP[keyfield])
+                if r2 is not None:
+                    ob.candidateLD[candidate["name"]]=[(focusfeatSNPname,
+                            candidateSNPname,r2)]
+                #tuple format (SNP_A rs, SNP_B rs, R-squared)
+            if candidate["name"] not in ob.candidateLD:
+                ob.candidateLD[candidate["name"]]=[("rsNA","rsNA",2)]
+                if focusfeatfound:
+                    #LD was found between focusfeatSNP and some other SNPs,
+                    #but not with this candidate's top SNP in particular
+                    pairnotfound+=1
+                else: #LD was not found for focusfeatSNP with any SNPs
+                    LDnotfound+=1
+        assert (len(set([c["name"] for c in ob.candidates]))
+                ==len(set(ob.candidateLD.keys()))), ("Error:"
+                +" names of ob.candidates were "
+                +`set([c["name"] for c in ob.candidates])`
+                +" but keys in ob.candidateLD were "
+                +`ob.candidateLD.keys()`)
+            #use 'set' rather than comparing lengths directly because you
+            #could have two candidates with the same name but different
+            #internal properties, e.g. GENE1 in GWASA and GENE1 in GWASB,
+            #in which case you would have two entries in ob.candidates
+            #but only one entry in ob.candidateLD
+    return (LDnotfound,pairnotfound)
+
+def runbychromosome(task,regobjects,settings,workers):
+    """Run <task> separately for every chromosome that has Region objects,
+    using a pool of <workers> processes, and put the results back into
+    <regobjects>.
+    PARAMETERS:
+    <task> is "FocusPeriphA", "TopRegSNPA" or "LD". See _runchromosometask().
+    <regobjects> is the output of initializeRegionobjects()
+    <settings> is a dictionary with the keys "extbases", "gwaspathsdict",
+        "candidates" (the output of returnCandidates(), or None if the
+        FocusPeriphA task will not be run), "LDlocation", "matchby" and
+        "LDmode".
+        See addCandidatestoRegionobjects() and editRegions_re_LD().
+    <workers> is an int >= 1. If it is 1, everything is run in this process.
+    NOTES: The Regions on different chromosomes never affect each other, so
+    each chromosome is sent to a worker process together with the settings
+    it needs, and the worker sends back its modified Region objects. The
+    Region objects for each chromosome are then put back in chromosome
+    order, so the output files are the same as if everything had been run
+    in one process. GWAS files that were already indexed in this process
+    (see getGWASindex()) are inherited by the worker processes.
+    OUTPUT: This function modifies <regobjects> in place, and returns a list
+    with the value returned by the task for every chromosome it was run on."""
+    jobs=[]
+    for index in xrange(22):
+        if len(regobjects[index])>0:
+            if task=="FocusPeriphA":
+                candidates=settings["candidates"][index]
+            else:
+                candidates=[]
+            jobs.append((task,index,regobjects[index],candidates,
+                         settings["extbases"],settings["gwaspathsdict"],
+                         settings["LDlocation"],settings["matchby"],
+                         settings["LDmode"]))
+    if workers>1:
+        pool=multiprocessing.Pool(workers)
+        results=pool.map(_runchromosometask,jobs,1)
+        pool.close()
+        pool.join()
+    else:
+        results=map(_runchromosometask,jobs)
+    returnvalues=[]
+    for which in xrange(len(jobs)):
+        regobjects[jobs[which][1]]=results[which][0]
+        returnvalues.append(results[which][1])
+    return returnvalues
+
+def _runchromosometask(job):
+    """Run one job made by runbychromosome() and return the tuple
+    (modified Region objects, value returned by the task).
+    For the "FocusPeriphA" and "TopRegSNPA" tasks the Regions are given to
+    addCandidatestoRegionobjects() and the value returned is None; for the
+    "LD" task they are given to _editRegions_re_LD_chrom() and the value
+    returned is the tuple of counts (LDnotfound, pairnotfound)."""
+    (task,index,regions,candidates,extbases,gwaspathsdict,LDlocation,
+     matchby,LDmode)=job
+    singlechrom=[[] for chromo in xrange(24)]
+    singlechrom[index]=regions
+    if task=="FocusPeriphA":
+        candidatesbychrom=[[] for chromo in xrange(22)]
+        candidatesbychrom[index]=candidates
+        addCandidatestoRegionobjects(extbases,singlechrom,gwaspathsdict,
+                                     "FocusPeriphA",
+                                     allcandidates_bychrom=candidatesbychrom)
+        return (regions,None)
+    elif task=="TopRegSNPA":
+        addCandidatestoRegionobjects(extbases,singlechrom,gwaspathsdict,
+                                     "TopRegSNPA")
+        return (regions,None)
+    elif task=="LD":
+        return (regions,_editRegions_re_LD_chrom(regions,LDlocation,index,
+                                                 matchby,LDmode))
+    else:
+        raise StandardError, ("Error: task must be FocusPeriphA, TopRegSNPA"
+                              +" or LD, not "+`task`)
+
 def summarizeFocusPeriphAnalysis(regobjects):
     """Print summary stats about the number of candidates for Region objects."""
     cand0=0;cand1=0; cand2=0; cand3=0; cand4=0; candgt5=0
@@ -631,13 +983,16 @@ def writeCompactOutputFile(regobjects,keyword,dirforoutput,analysisname):
     print "Writing compact output file for "+analysisname
     if analysisname=="FocusPeriphA":
         outputfile=open(os.path.join(dirforoutput,
-                "analyzeLD_C_FocusPeriphA_"+keyword+"_"+datestring+".txt"),'w')
+                "analyzeLD_C_FocusPeriphA_"+keyword+"_"+datestring+".txt"),'w',
+                _OUTPUTBUFFER)
     elif analysisname=="TopRegSNPA":
         outputfile=open(os.path.join(dirforoutput,
-                "analyzeLD_C_TopRegSNPA_"+keyword+"_"+datestring+".txt"),'w')
+                "analyzeLD_C_TopRegSNPA_"+keyword+"_"+datestring+".txt"),'w',
+                _OUTPUTBUFFER)
     elif analysisname=="SpecPairA":
         outputfile=open(os.path.join(dirforoutput,
-                "analyzeLD_C_SpecPairA_"+keyword+"_"+datestring+".txt"),'w')
+                "analyzeLD_C_SpecPairA_"+keyword+"_"+datestring+".txt"),'w',
+                _OUTPUTBUFFER)
     else:
         assert StandardError, ("Error:"
             +" analysisname must be either focusperiph, topregionsnp,"
@@ -650,30 +1005,48 @@ def writeCompactOutputFile(regobjects,keyword,dirforoutput,analysisname):
                      +"Distance\tLD\tGWAScategory\tLDcategory\n")
     for chrm in regobjects:
         for ob in chrm:
-            ct=0; nms=[]; gwss=[]; pozs=[]; tsnp=[]; tpval=[]; dist=[]; ld=[]
-            keepcands=[]
-            for candi in ob.candidates:
-                if analysisname in ob.trackanalyses[candi["name"]]:
-                    keepcands.append(candi["name"])
-                    ct+=1
-                    nms.append(candi["name"])
-                    gwss.append(candi["name"]+"="+candi["GWAS"])
-                    pozs.append(candi["name"]+"="+"chr"
-                                    +`candi["chrom"]`+":"+`candi["start"]`
-                                    +"-"+`candi["stop"]`)
-            for name in keepcands:
-                if name in ob.candidateGWASpvals:
-                    tsnp.append(name+"="
-                                            +ob.candidateGWASpvals[name][0][0])
-                    tpval.append(name+"="
-                                        +`ob.candidateGWASpvals[name][0][1]`)
-                    dist.append(name+"="
-                        +`1+abs(ob.candidateGWASpvals[name][0][2]
-                              -ob.focusfeat["SNPs"][0][2])`)
+            keepcands=[candi for candi in ob.candidates
+                       if ob.hasanalysis(candi["name"],analysisname)]
+            #write out only if it has at least one relevant candidate or no
+            #candidates at all and yet the focusfeature is supposed to be
+            #included in the relevant analysis(this is to avoid writing out a
+            #feature that only has irrelevant candidates that are part of a
+            #different analysis)
+            if (len(keepcands)==0
+                and not ob.hasanalysis("self",analysisname)):
+                continue
+            nms=[]; gwss=[]; pozs=[]; tsnp=[]; tpval=[]; dist=[]; ld=[]
+            focusSNP=ob.focusfeat["SNPs"][0]
+            minp=2.0 #for GWAScategory
+            maxLD=-1 #for LDcategory
+            for candi in keepcands:
+                name=candi["name"]
+                nms.append(name)
+                gwss.append(name+"="+candi["GWAS"])
+                pozs.append(name+"=chr"+`candi["chrom"]`+":"+`candi["start"]`
+                            +"-"+`candi["stop"]`)
+                #realistically, every candidate should have SOMETHING in
+                #ob.candidateGWASpvals, but in one of my tests I didn't want
+                #to write up fake GWAS or LD info so the check is kept here.
+                #GWAScategory and LDcategory are calculated only based on the
+                #candidates for this particular analysis, NOT based on all
+                #candidates for any analysis
+                candSNPs=ob.candidateGWASpvals.get(name)
+                if candSNPs is not None:
+                    candSNP=candSNPs[0]
+                    tsnp.append(name+"="+candSNP[0])
+                    tpval.append(name+"="+`candSNP[1]`)
+                    dist.append(name+"="+`1+abs(candSNP[2]-focusSNP[2])`)
                         #add 1 to distance because these are one-based
                         #inclusive coordinates
-                if name in ob.candidateLD:
-                    ld.append(name+"="+`ob.candidateLD[name][0][2]`)
+                    if candSNP[1] < minp:
+                        minp=candSNP[1]
+                candLD=ob.candidateLD.get(name)
+                if candLD is not None:
+                    r2=candLD[0][2]
+                    ld.append(name+"="+`r2`)
+                    if maxLD < r2 < 2:
+                        maxLD=r2
             #add dummy values
             if nms==[]: nms=["none"]
             if gwss==[]: gwss=["none=none"]
@@ -683,72 +1056,26 @@ def writeCompactOutputFile(regobjects,keyword,dirforoutput,analysisname):
             if dist==[]: dist=["none=0"]
             if ld==[]: ld=["none=2"]
             #sort alphabetically (applicable when non-dummy values)
-            nms.sort();gwss.sort();pozs.sort();tsnp.sort();tpval.sort()
-            dist.sort();ld.sort()
-            #write out only if it has at least one relevant candidate or no
-            #candidates at all and yet the focusfeature is supposed to be
-            #included in the relevant analysis(this is to avoid writing out a
-            #feature that only has irrelevant candidates that are part of a
-            #different analysis)
-            if (len(keepcands)>0
-                or ((len(keepcands)==0)
-                    and analysisname in ob.trackanalyses["self"])):
-                outputfile.write(ob.focusfeat["name"]+"\t"
-                    +ob.focusfeat["GWAS"]+"\t"
-                    +"chr"+`ob.focusfeat["chrom"]`+":"+`ob.focusfeat["start"]`
-                        +"-"+`ob.focusfeat["stop"]`+"\t"
-                    +ob.focusfeat["SNPs"][0][0]+"\t"
-                    +`ob.focusfeat["SNPs"][0][1]`+"\t"
-                    +`ct`+"\t")
-                for lyst in ([nms,gwss,pozs,
-                              tsnp,tpval,dist]):
-                    outputfile.write("*".join(lyst)+"\t")
-                outputfile.write("*".join(ld)+"\t")
-                #calculate GWAScategory
-                focusfeatSNPpval=ob.focusfeat["SNPs"][0][1]
-                minp=2.0
-                keepcands_withGWASinfo=[]
-                for candname in keepcands:
-                    if candname in ob.candidateGWASpvals.keys():
-                        keepcands_withGWASinfo.append(candname)
-                        #realistically, every candidate should have
-                        #SOMETHING in ob.candidateGWASpvals, but in one of my
-                        #tests I didn't want to write up fake GWAS or LD info
-                        #so I'm doing this extra step here instead of just
-                        #iterating directly over keepcands :)
-                for nombre in keepcands_withGWASinfo: #do not directly use
-                    #the names in ob.candidateGWASpvals because you want to
-                    #calculate GWAScategory only based on the candidates for
-                    #that particular analysis, NOT based on all candidates
-                    #for any analysis
-                    p=ob.candidateGWASpvals[nombre][0][1]
-                    if p < minp:
-                        minp=p
-                if focusfeatSNPpval < minp:
-                    GWAScategory=1
-                else:
-                    GWAScategory=2
-                outputfile.write(`GWAScategory`+"\t")
-                #calculate LDcategory
-                maxLD=-1
-                keepcands_withLDinfo=[]
-                for candname2 in keepcands:
-                    if candname2 in ob.candidateLD.keys():
-                        keepcands_withLDinfo.append(candname2)
-                for nombre2 in keepcands_withLDinfo:
-                    ld=ob.candidateLD[nombre2][0][2]
-                    if maxLD < ld < 2:
-                        maxLD=ld
-                if 0 <= maxLD <= 0.3:
-                    LDcategory=1
-                elif 0.3 < maxLD < 0.8:
-                    LDcategory=2
-                elif maxLD >= 0.8:
-                    LDcategory=3
-                else: #if only LD present is dummy LD of 2.0 or if no LD was
-                    #assigned at all and the maxLD is still set to -1
-                    LDcategory=9
-                outputfile.write(`LDcategory`+"\n")
+            fields=[_focusfeatfields(ob)+`len(keepcands)`]
+            for lyst in [nms,gwss,pozs,tsnp,tpval,dist,ld]:
+                lyst.sort()
+                fields.append("*".join(lyst))
+            #calculate GWAScategory
+            if focusSNP[1] < minp:
+                fields.append("1")
+            else:
+                fields.append("2")
+            #calculate LDcategory
+            if 0 <= maxLD <= 0.3:
+                fields.append("1")
+            elif 0.3 < maxLD < 0.8:
+                fields.append("2")
+            elif maxLD >= 0.8:
+                fields.append("3")
+            else: #if only LD present is dummy LD of 2.0 or if no LD was
+                #assigned at all and the maxLD is still set to -1
+                fields.append("9")
+            outputfile.write("\t".join(fields)+"\n")
     outputfile.close()
 
 def writeNonCompactOutputFile(regobjects,keyword,dirforoutput,analysisname):
@@ -759,11 +1086,11 @@ def writeNonCompactOutputFile(regobjects,keyword,dirforoutput,analysisname):
     if analysisname=="FocusPeriphA":
         outputfile=open(os.path.join(dirforoutput,
                         "analyzeLD_NC_FocusPeriphA_"+keyword+"_"+datestring
-                        +".txt"),'w')
+                        +".txt"),'w',_OUTPUTBUFFER)
     elif analysisname=="SpecPairA":
         outputfile=open(os.path.join(dirforoutput,
                         "analyzeLD_NC_SpecPairA_"+keyword+"_"+datestring
-                        +".txt"),'w')
+                        +".txt"),'w',_OUTPUTBUFFER)
     else:
         assert StandardError, ("Error:"
             +" analysisname must be either focusperiph or specificpairing,"
@@ -777,56 +1104,51 @@ def writeNonCompactOutputFile(regobjects,keyword,dirforoutput,analysisname):
     #file they will go in to
     for chrm in regobjects:
         for ob in chrm:
-            if analysisname in ob.trackanalyses["self"]:
-                onecandwritten=False
-                redundantwrite=(ob.focusfeat["name"]+"\t"
-                            +ob.focusfeat["GWAS"]+"\t" 
-                            +"chr"+`ob.focusfeat["chrom"]`+":"
-                                +`ob.focusfeat["start"]`
-                                +"-"+`ob.focusfeat["stop"]`+"\t"
-                            +ob.focusfeat["SNPs"][0][0]+"\t"
-                            +`ob.focusfeat["SNPs"][0][1]`+"\t")
-                towrite=[]
-                for cand in ob.candidates:
-                    if analysisname in ob.trackanalyses[cand["name"]]:
-                        x=(redundantwrite+cand["name"]+"\t"
-                            +cand["GWAS"]+"\t"+"chr"+`cand["chrom"]`+":"
-                            +`cand["start"]`+"-"+`cand["stop"]`+"\t")
-                        written2=False
-                        for c2 in ob.candidateGWASpvals:
-                            if c2==cand["name"]:
-                                x=x+(ob.candidateGWASpvals[c2][0][0]
-                                    +"\t"+`ob.candidateGWASpvals[c2][0][1]`+"\t"
-                                    +`1+abs(ob.focusfeat["SNPs"][0][2]
-                                        -ob.candidateGWASpvals[c2][0][2])`+"\t")
-                                        #distance has +1 because these are
-                                        #one-based inclusive coordinates
-                                written2=True
-                                break
-                        if not written2:
-                            raise StandardError,("Error: was writing NonCompact"
-                                +" output file and could not find the "
-                                +"information for the top SNP in candidate "
-                                +cand)
-                        written3=False
-                        LDwrite="2.0"
-                        for c3 in ob.candidateLD:
-                            if c3==cand["name"]:
-                                LDwrite=`ob.candidateLD[c3][0][2]`
-                        x=x+(LDwrite+"\n")
-                        onecandwritten=True
-                        towrite.append(x)
-                towrite.sort()
-                for l in towrite:
-                    outputfile.write(l)
-                if (not onecandwritten
-                    and analysisname in ob.trackanalyses["self"]):
-                    #if there were no candidates, but this FocusFeature was part
-                    #of the specified analysis, then write dummy values
-                    outputfile.write(redundantwrite+"none\tnone\tchr0:0-0\t"
-                                     +"rsNA\t2.0\t0\t2.0\n")
+            if not ob.hasanalysis("self",analysisname):
+                continue
+            redundantwrite=_focusfeatfields(ob)
+            focusSNPcoord=ob.focusfeat["SNPs"][0][2]
+            towrite=[]
+            for cand in ob.candidates:
+                name=cand["name"]
+                if not ob.hasanalysis(name,analysisname):
+                    continue
+                if name not in ob.candidateGWASpvals:
+                    raise StandardError,("Error: was writing NonCompact"
+                        +" output file and could not find the "
+                        +"information for the top SNP in candidate "+name)
+                candSNP=ob.candidateGWASpvals[name][0]
+                if name in ob.candidateLD:
+                    LDwrite=`ob.candidateLD[name][0][2]`
+                else:
+                    LDwrite="2.0"
+                towrite.append(redundantwrite+name+"\t"+cand["GWAS"]
+                    +"\tchr"+`cand["chrom"]`+":"+`cand["start"]`+"-"
+                    +`cand["stop"]`+"\t"+candSNP[0]+"\t"+`candSNP[1]`+"\t"
+                    +`1+abs(focusSNPcoord-candSNP[2])`+"\t"+LDwrite+"\n")
+                    #distance has +1 because these are
+                    #one-based inclusive coordinates
+            if len(towrite)==0:
+                #if there were no candidates, but this FocusFeature was part
+                #of the specified analysis, then write dummy values
+                towrite.append(redundantwrite+"none\tnone\tchr0:0-0\t"
+                               +"rsNA\t2.0\t0\t2.0\n")
+            towrite.sort()
+            outputfile.write("".join(towrite))
     outputfile.close()
 
+def _focusfeatfields(ob):
+    """Return the first five tab-separated fields of an output file line for
+    the Region <ob> (focusfeat name, GWAS, position, top SNP name and top SNP
+    p-value), followed by a tab."""
+    return (ob.focusfeat["name"]+"\t"+ob.focusfeat["GWAS"]+"\t"
+            +"chr"+`ob.focusfeat["chrom"]`+":"+`ob.focusfeat["start"]`
+            +"-"+`ob.focusfeat["stop"]`+"\t"
+            +ob.focusfeat["SNPs"][0][0]+"\t"
+            +`ob.focusfeat["SNPs"][0][1]`+"\t")
+
+_OUTPUTBUFFER=1<<20 #buffer size in bytes for the output files
+
 def getTopSNP(chrom,start,stop,gwaspath):
     """Return the SNP with the lowest GWAS p-val within the specified interval.
     
@@ -837,30 +1159,150 @@ def getTopSNP(chrom,start,stop,gwaspath):
     <stop> is an int indicating the endpoint of the interval.
     <gwaspath> is the path to the GWAS file that will be searched for SNPs.
     
-    NOTES: First this function pulls out all of the SNPs within the specified
-    interval, including SNPs on the exact endpoints of the interval.
-    Then it selects whichever has the lowest p-value, and returns it
-    as a tuple inside a list: [("SNPidentifier",p-value,coordinate)]"""
-    myfile=open(gwaspath,'r')
-    outputlist=[]
-    counter=0
-    for line in myfile:
-        lineaslist=line.rsplit()
-        if int(lineaslist[0])==chrom:
-            if start <= int(lineaslist[1]) <= stop:
-                outputlist.append(("rs"+lineaslist[5],float(lineaslist[6]),
-                                   int(lineaslist[1])))
-                counter+=1
-    assert len(outputlist)==counter, "Error: THIS WAS A STOOPID PHAIL"
-    if len(outputlist)==0:
-        return [("rsNA",2.0,0)] #dummy default
-    else:
-        outputlist.sort(key=lambda x: x[1])
-        return [outputlist[0]] #return SNP with smallest p-val
+    NOTES: The SNPs within the specified interval are considered, including
+    SNPs on the exact endpoints of the interval, and whichever has the lowest
+    p-value is returned as a tuple inside a list:
+    [("SNPidentifier",p-value,coordinate)]
+    If several SNPs share the lowest p-value, the one that appears first in
+    the GWAS file is returned. The GWAS file is only read the first time it
+    is needed; after that the lookup is done in the GWASindex for <gwaspath>
+    (see getGWASindex() and the GWASindex Class)."""
+    return getGWASindex(gwaspath).topSNP(chrom,start,stop)
+
+def getTopSNPs(chrom,intervals,gwaspath):
+    """Return the SNP with the lowest GWAS p-val within each interval.
+    
+    PARAMETERS:
+    <chrom> is an int indicating which chromosome to search on.
+    <intervals> is a list of [start, stop] pairs (or tuples) of ints.
+    <gwaspath> is the path to the GWAS file that will be searched for SNPs.
+    
+    OUTPUT: a list with one element per interval in <intervals>, in the same
+    order. Each element is exactly what getTopSNP() would return for that
+    interval, including the dummy default [("rsNA",2.0,0)]. Use this instead
+    of calling getTopSNP() many times for the same chromosome and GWAS; the
+    intervals are all answered in a single sweep over the SNPs of <chrom>
+    (see GWASindex.topSNPs())."""
+    return getGWASindex(gwaspath).topSNPs(chrom,intervals)
+
+def getGWASindex(gwaspath):
+    """Return the GWASindex for the GWAS file at <gwaspath>.
+    The GWASindex is created the first time it is requested for <gwaspath>
+    and is kept in _GWASINDEXES so that every later request for the same
+    path reuses it instead of re-reading the GWAS file."""
+    if gwaspath not in _GWASINDEXES:
+        print "Indexing GWAS file at "+gwaspath
+        _GWASINDEXES[gwaspath]=GWASindex(gwaspath)
+    return _GWASINDEXES[gwaspath]
+
+_GWASINDEXES={} #keys are GWAS paths, values are GWASindex objects
+
+def sharedcandidate(candidate):
+    """Return the one shared candidate dictionary equal to <candidate>,
+    registering <candidate> as that dictionary if there is none yet.
+    Its name and GWAS strings are interned, so that the same names used as
+    keys in the Region properties are not stored more than once. Candidate
+    dictionaries must be treated as read-only once they are shared."""
+    key=candidatekey(candidate)
+    if key not in _CANDIDATES:
+        candidate["name"]=intern(candidate["name"])
+        candidate["GWAS"]=intern(candidate["GWAS"])
+        _CANDIDATES[key]=candidate
+    return _CANDIDATES[key]
+
+_CANDIDATES={} #keys are candidatekey() tuples; values are candidate dicts
+
+#The analyses that can be recorded in the trackanalyses property of a Region.
+#Each one is stored as one bit of an integer; see Region Class.
+ANALYSES=("SpecPairA","FocusPeriphA","TopRegSNPA")
+_ANALYSISBITS=dict((ANALYSES[i],1<<i) for i in xrange(len(ANALYSES)))
+
+def _analysismask(analysisnames):
+    """Return the bitmask for the list of analysis names <analysisnames>.
+    Every name is checked before the mask is made, so a Region is never left
+    half-changed by a list with a name that is not in ANALYSES."""
+    mask=0
+    for analysisname in analysisnames:
+        assert analysisname in _ANALYSISBITS, ("Error: "+`analysisname`
+                                 +" is not one of "+`ANALYSES`)
+        mask|=_ANALYSISBITS[analysisname]
+    return mask
+
+class _TrackAnalyses(collections.MutableMapping):
+    """The value of the trackanalyses property of a Region: a dictionary-like
+    view of the Region's bitmasks, with keys that are candidate names or
+    "self" and values that are _AnalysisLists. Changes made through the view
+    (e.g. region.trackanalyses["self"]=["SpecPairA"]) change the Region."""
+    def __init__(self,region):
+        self._region=region
+    def __getitem__(self,key):
+        if key not in self._region._trackmasks:
+            raise KeyError(key)
+        return _AnalysisList(self._region,key)
+    def __setitem__(self,key,value):
+        self._region._trackmasks[key]=_analysismask(value)
+    def __delitem__(self,key):
+        del self._region._trackmasks[key]
+    def __iter__(self):
+        return iter(self._region._trackmasks)
+    def __len__(self):
+        return len(self._region._trackmasks)
+    def __repr__(self):
+        return repr(dict((key,list(self[key])) for key in self))
+
+class _AnalysisList(collections.MutableSequence):
+    """A list-like view of the analysis names recorded for one key of a
+    Region's trackanalyses, in the order of ANALYSES. append(), remove() and
+    the other list methods change the Region's bitmask for that key. Since
+    the names are stored as bits, each name appears at most once."""
+    def __init__(self,region,key):
+        self._region=region
+        self._key=key
+    def _names(self):
+        mask=self._region._trackmasks.get(self._key,0)
+        return [name for name in ANALYSES if mask&_ANALYSISBITS[name]]
+    def __getitem__(self,index):
+        return self._names()[index]
+    def __setitem__(self,index,value):
+        names=self._names()
+        names[index]=value
+        _TrackAnalyses(self._region)[self._key]=names
+    def __delitem__(self,index):
+        names=self._names()
+        del names[index]
+        _TrackAnalyses(self._region)[self._key]=names
+    def __len__(self):
+        return len(self._names())
+    def insert(self,index,value):
+        self._region.addanalysis(self._key,value)
+    def __eq__(self,other):
+        try:
+            return self._names()==list(other)
+        except TypeError:
+            return False
+    def __ne__(self,other):
+        return not self==other
+    def __repr__(self):
+        return repr(self._names())
 
 #===============================================================================
 #----------Helper functions for __eq___() in Region CLASS--------------------
 #===============================================================================
+def focusfeatkey(focusfeat):
+    """Return a tuple that identifies the focusfeat dictionary <focusfeat>:
+    (name, chrom, start, stop, GWAS, SNPs). Two focusfeat dictionaries are
+    equal exactly when their focusfeatkeys are equal, so the key can be used
+    to look up an existing Region in a dictionary."""
+    return (focusfeat["name"],focusfeat["chrom"],focusfeat["start"],
+            focusfeat["stop"],focusfeat["GWAS"],tuple(focusfeat["SNPs"]))
+
+def candidatekey(candidate):
+    """Return a tuple that identifies the candidate dictionary <candidate>:
+    (name, GWAS, chrom, start, stop). Two candidate dictionaries are equal
+    exactly when their candidatekeys are equal."""
+    return (candidate["name"],candidate["GWAS"],candidate["chrom"],
+            candidate["start"],candidate["stop"])
+
 def featuredictsequal(dict1,dict2):
     """Return True if dict1 is equal to dict2, else return False.
     Each dict must have the following keys: name, chrom, start, stop, GWAS.
@@ -913,9 +1355,480 @@ def LDlistsequal(LDlist1,LDlist2):
     else:
         return True
 
+#===============================================================================
+#----------CandidateIndex CLASS-------------------------------------------------
+#===============================================================================
+class CandidateIndex(object):
+    """A CandidateIndex is an interval index over the candidate dictionaries
+    (PeripheralFeatures) of one chromosome, as returned by returnCandidates().
+    It is used to find the candidates that lie completely inside a region
+    without comparing the region against every candidate.
+    
+    The candidates are stored sorted by start position, together with an
+    array of their start positions, an array of their stop positions and an
+    array of their order in the original list. contained() uses bisect on the
+    start positions to narrow the search to the candidates that start inside
+    the region, and only those are checked for their stop position."""
+    
+    def __init__(self,candidates):
+        order=sorted(xrange(len(candidates)),
+                     key=lambda i: candidates[i]["start"])
+        self.candidates=[candidates[i] for i in order]
+        self.starts=array.array('l',[can["start"] for can in self.candidates])
+        self.stops=array.array('l',[can["stop"] for can in self.candidates])
+        self.fileorder=array.array('l',order)
+    
+    def contained(self,regionstart,regionstop):
+        """Return a list of the candidates that are completely within
+        [<regionstart>, <regionstop>] (both start and stop inside the region),
+        in the same order as in the list the CandidateIndex was made from."""
+        left=bisect.bisect_left(self.starts,regionstart)
+        right=bisect.bisect_right(self.starts,regionstop)
+        hits=[i for i in xrange(left,right)
+              if regionstart <= self.stops[i] <= regionstop]
+        hits.sort(key=lambda i: self.fileorder[i])
+        return [self.candidates[i] for i in hits]
+
+#===============================================================================
+#----------LDstore CLASS--------------------------------------------------------
+#===============================================================================
+class LDstore(object):
+    """An LDstore gives read-only access to the binary LD file created by
+    store_LD_files() for one chromosome. The file is opened with mmap, so a
+    lookup only reads the few pages it needs and nothing is unpickled.
+    
+    File layout (all numbers little-endian):
+        header: magic string, number of SNP names (N), number of SNP_As (A),
+            number of rows (R). See HEADER for the struct format.
+        name offsets: N+1 unsigned 64-bit ints. Name i is the bytes from
+            offset i to offset i+1 of the name blob.
+        name blob: every SNP identifier in the LD file, sorted, concatenated,
+            and padded with zero bytes to a multiple of 8 bytes. A SNP's id is
+            its position in this sorted list.
+        SNP_A ids: A unsigned 32-bit ints in increasing order (padded with
+            4 zero bytes if A is odd)
+        row offsets: A+1 unsigned 64-bit ints (CSR format). The rows for the
+            k-th SNP_A are rows offset k to offset k+1.
+        SNP_B ids: R unsigned 32-bit ints, in increasing order within the rows
+            of each SNP_A (padded with 4 zero bytes if R is odd)
+        R2s: R 64-bit floats, the R2 of each row exactly as float() reads it
+            from the LD file.
+    Looking up a pair of SNPs is three binary searches: SNP_A name to id,
+    SNP_A id to its rows, and SNP_B id within those rows."""
+    
+    MAGIC="LDSTORE2"
+    HEADER="<8sQQQ"
+    
+    def __init__(self,storepath):
+        storefile=open(storepath,'rb')
+        self.mm=mmap.mmap(storefile.fileno(),0,access=mmap.ACCESS_READ)
+        storefile.close()
+        magic,self.nnames,self.nA,self.nrows=struct.unpack_from(self.HEADER,
+                                                                self.mm,0)
+        assert magic==self.MAGIC, ("Error: "+storepath
+                                   +" is not an LD store file")
+        self.nameoffsets=struct.calcsize(self.HEADER)
+        self.nameblob=self.nameoffsets+8*(self.nnames+1)
+        bloblength=struct.unpack_from("<Q",self.mm,
+                                      self.nameoffsets+8*self.nnames)[0]
+        self.Aids=self.nameblob+bloblength+(-bloblength%8)
+        self.rowoffsets=self.Aids+4*(self.nA+self.nA%2)
+        self.Bids=self.rowoffsets+8*(self.nA+1)
+        self.R2s=self.Bids+4*(self.nrows+self.nrows%2)
+    
+    def _name(self,nameid):
+        """Return the SNP name with id <nameid>."""
+        start,stop=struct.unpack_from("<QQ",self.mm,
+                                      self.nameoffsets+8*nameid)
+        return self.mm[self.nameblob+start:self.nameblob+stop]
+    
+    def _nameid(self,name):
+        """Return the id of the SNP called <name>, or None if it is not in
+        the store."""
+        low=0; high=self.nnames
+        while low<high:
+            mid=(low+high)//2
+            if self._name(mid)<name:
+                low=mid+1
+            else:
+                high=mid
+        if low<self.nnames and self._name(low)==name:
+            return low
+        return None
+    
+    def _bisect(self,base,low,high,value):
+        """Return the leftmost index i, low <= i <= high, at which <value>
+        could be inserted among the sorted unsigned 32-bit ints at indices
+        low <= i < high of the array starting at byte <base>."""
+        while low<high:
+            mid=(low+high)//2
+            if struct.unpack_from("<I",self.mm,base+4*mid)[0]<value:
+                low=mid+1
+            else:
+                high=mid
+        return low
+    
+    def _rows(self,SNPAname):
+        """Return (first row, last row + 1) for <SNPAname>, or None if there
+        are no rows for that SNP_A."""
+        Aid=self._nameid(SNPAname)
+        if Aid is None:
+            return None
+        k=self._bisect(self.Aids,0,self.nA,Aid)
+        if k>=self.nA or struct.unpack_from("<I",self.mm,self.Aids+4*k)[0]!=Aid:
+            return None
+        return struct.unpack_from("<QQ",self.mm,self.rowoffsets+8*k)
+    
+    def hasSNP(self,SNPAname):
+        """Return True if there is at least one row with <SNPAname> as SNP_A."""
+        return self._rows(SNPAname) is not None
+    
+    def r2(self,SNPAname,SNPBname):
+        """Return the R2 between <SNPAname> and <SNPBname> as a float, or None
+        if there is no row with that SNP_A and SNP_B."""
+        rows=self._rows(SNPAname)
+        if rows is None:
+            return None
+        Bid=self._nameid(SNPBname)
+        if Bid is None:
+            return None
+        row=self._bisect(self.Bids,rows[0],rows[1],Bid)
+        if (row>=rows[1]
+            or struct.unpack_from("<I",self.mm,self.Bids+4*row)[0]!=Bid):
+            return None
+        return struct.unpack_from("<d",self.mm,self.R2s+8*row)[0]
+
+class LDpositionstore(object):
+    """An LDpositionstore gives read-only access to the binary LD file created
+    by store_LD_positions() for one chromosome. It is the position-keyed
+    counterpart of an LDstore and has the same hasSNP() and r2() methods, but
+    SNPs are given as coordinates (ints) instead of names.
+    
+    File layout (all numbers little-endian):
+        header: magic string, number of rows (R). See HEADER for the struct
+            format.
+        keys: R unsigned 64-bit ints, BP_A*2**32 + BP_B, in increasing order.
+        R2s: R 64-bit floats, the R2 of each row exactly as float() reads it
+            from the LD file.
+    Looking up a pair of SNPs is one binary search on the keys, with no
+    string comparisons or hashing."""
+    
+    MAGIC="LDPOSST2"
+    HEADER="<8sQ"
+    
+    def __init__(self,storepath):
+        storefile=open(storepath,'rb')
+        self.mm=mmap.mmap(storefile.fileno(),0,access=mmap.ACCESS_READ)
+        storefile.close()
+        magic,self.nrows=struct.unpack_from(self.HEADER,self.mm,0)
+        assert magic==self.MAGIC, ("Error: "+storepath
+                                   +" is not an LD position store file")
+        self.keys=struct.calcsize(self.HEADER)
+        self.R2s=self.keys+8*self.nrows
+    
+    def _key(self,row):
+        """Return the key at index <row>."""
+        return struct.unpack_from("<Q",self.mm,self.keys+8*row)[0]
+    
+    def _bisect(self,key):
+        """Return the leftmost row at which <key> could be inserted."""
+        low=0; high=self.nrows
+        while low<high:
+            mid=(low+high)//2
+            if self._key(mid)<key:
+                low=mid+1
+            else:
+                high=mid
+        return low
+    
+    def hasSNP(self,BPA):
+        """Return True if there is at least one row with <BPA> as BP_A."""
+        if not 0<BPA<2**32:
+            return False
+        row=self._bisect(BPA<<32)
+        return row<self.nrows and self._key(row)>>32==BPA
+    
+    def r2(self,BPA,BPB):
+        """Return the R2 between the SNPs at <BPA> and <BPB> as a float, or
+        None if there is no row with that BP_A and BP_B."""
+        if not (0<BPA<2**32 and 0<BPB<2**32):
+            return None
+        key=(BPA<<32)|BPB
+        row=self._bisect(key)
+        if row>=self.nrows or self._key(row)!=key:
+            return None
+        return struct.unpack_from("<d",self.mm,self.R2s+8*row)[0]
+
+class LDfiltered(object):
+    """An LDfiltered holds in memory only the rows of one LD file that are
+    needed for a particular set of Regions. It has the same hasSNP() and r2()
+    methods as an LDstore (if <matchby> is "NAME") or an LDpositionstore (if
+    <matchby> is "POSITION"), and gives the same answers for the SNPs it was
+    made for, but it is made by reading the LD file once instead of building
+    a store on disk.
+    PARAMETERS:
+    <LDpath> is the path to the LD file for one chromosome.
+    <neededA> is a set of the SNP_A names (or BP_A coordinates) that will be
+        looked up, i.e. the top SNPs of the FocusFeatures.
+    <neededB> is a set of the SNP_B names (or BP_B coordinates) that will be
+        looked up, i.e. the top SNPs of the candidates, or None to keep the
+        rows for every SNP_B.
+    <matchby> is "NAME" or "POSITION".
+    NOTES: Rows are kept only if their SNP_A is in <neededA> and their SNP_B
+    is in <neededB>. Every SNP_A in <neededA> that appears in the file at all
+    is remembered, so that hasSNP() is still True for a SNP_A whose rows
+    were all dropped. When <matchby> is "NAME", a later group of rows for
+    the same SNP_A replaces an earlier one, as in store_LD_files(). The
+    header line written by PLINK is skipped."""
+    
+    def __init__(self,LDpath,neededA,neededB=None,matchby="NAME"):
+        print "Reading the needed rows of "+LDpath
+        self.rows={} #keys are SNP_A; values are dicts of SNP_B:R2
+        if matchby=="NAME":
+            Afield=2; Bfield=5
+        else:
+            Afield=1; Bfield=4
+        previousA=None
+        LDfile=open(LDpath,'r')
+        for line in LDfile:
+            lineaslist=line.rsplit()
+            if not _isLDrow(lineaslist): #the header line
+                continue
+            SNPA=lineaslist[Afield]
+            if matchby=="POSITION":
+                SNPA=int(SNPA)
+            if SNPA!=previousA:
+                previousA=SNPA
+                if SNPA in neededA and (matchby=="NAME"
+                                        or SNPA not in self.rows):
+                    self.rows[SNPA]={}
+            if SNPA in neededA:
+                SNPB=lineaslist[Bfield]
+                if matchby=="POSITION":
+                    SNPB=int(SNPB)
+                if neededB is None or SNPB in neededB:
+                    self.rows[SNPA][SNPB]=float(lineaslist[6])
+        LDfile.close()
+    
+    def hasSNP(self,SNPA):
+        """Return True if there is at least one row with <SNPA> as SNP_A."""
+        return SNPA in self.rows
+    
+    def r2(self,SNPA,SNPB):
+        """Return the R2 between <SNPA> and <SNPB> as a float, or None if
+        there is no row with that SNP_A and SNP_B."""
+        if SNPA not in self.rows:
+            return None
+        return self.rows[SNPA].get(SNPB)
+
+#===============================================================================
+#----------GWASindex CLASS------------------------------------------------------
+#===============================================================================
+class GWASindex(object):
+    """A GWASindex holds the SNPs of one GWAS file in memory so that the SNP
+    with the lowest p-value in any interval can be found without re-reading
+    the file. See description of GWAS files in the module docstring.
+    
+    For every chromosome in the GWAS file, the GWASindex stores:
+    positions: an array of SNP coordinates, sorted in increasing order
+    pvals: an array of the SNP p-values, in the same order as positions
+    names: a list of SNP identifiers ("rs" + the identifier in the file), in
+        the same order as positions
+    byrank: an array of indices into positions/pvals/names, sorted by
+        p-value. SNPs with equal p-values keep the order in which they appear
+        in the GWAS file, so that ties are broken exactly as they were when
+        getTopSNP() sorted the SNPs of an interval it had read from the file.
+    tree: a segment tree over the ranks (positions in byrank) of the SNPs.
+        tree[n+i] is the rank of the SNP at index i and every tree[k] with
+        k<n is the smallest rank below it, where n is the number of SNPs on
+        the chromosome. The smallest rank in any range of indices can then be
+        found by visiting O(log n) nodes.
+    Finding the top SNP in [start, stop] is therefore two binary searches
+    (bisect) on positions followed by one range-minimum query on the tree."""
+    
+    def __init__(self,gwaspath):
+        self.gwaspath=gwaspath
+        self.positions={}
+        self.pvals={}
+        self.names={}
+        self.byrank={}
+        self.tree={}
+        gwasfile=open(gwaspath,'r')
+        bychrom={} #keys are chromosomes; values are lists of SNP tuples
+        for line in gwasfile:
+            lineaslist=line.rsplit()
+            chrom=int(lineaslist[0])
+            if chrom not in bychrom:
+                bychrom[chrom]=[]
+            #tuple format (coordinate, p-value, SNP name, order in file)
+            bychrom[chrom].append((int(lineaslist[1]),float(lineaslist[6]),
+                                   "rs"+lineaslist[5],len(bychrom[chrom])))
+        gwasfile.close()
+        for chrom in bychrom:
+            snps=bychrom[chrom]
+            snps.sort(key=lambda x: x[0])
+            self.positions[chrom]=array.array('l',[snp[0] for snp in snps])
+            self.pvals[chrom]=array.array('d',[snp[1] for snp in snps])
+            self.names[chrom]=[snp[2] for snp in snps]
+            self._buildtree(chrom,snps)
+    
+    def _buildtree(self,chrom,snps):
+        """Fill in self.byrank[chrom] and self.tree[chrom] for <snps>, the
+        position-sorted list of SNP tuples read from the GWAS file."""
+        n=len(snps)
+        order=sorted(xrange(n),key=lambda i: (snps[i][1],snps[i][3]))
+        self.byrank[chrom]=array.array('l',order)
+        tree=array.array('l',[0])*(2*n)
+        for rank in xrange(n):
+            tree[n+order[rank]]=rank
+        for k in xrange(n-1,0,-1):
+            tree[k]=min(tree[2*k],tree[2*k+1])
+        self.tree[chrom]=tree
+    
+    def topSNP(self,chrom,start,stop):
+        """Return the SNP with the lowest p-value in [<start>, <stop>] on
+        <chrom> as a tuple inside a list, [("SNPidentifier",p-value,coordinate)],
+        or [("rsNA",2.0,0)] if there are no SNPs in the interval."""
+        if chrom not in self.positions:
+            return [("rsNA",2.0,0)] #dummy default
+        positions=self.positions[chrom]
+        left=bisect.bisect_left(positions,start)
+        right=bisect.bisect_right(positions,stop)
+        if left>=right:
+            return [("rsNA",2.0,0)] #dummy default
+        index=self.byrank[chrom][self._minrank(chrom,left,right)]
+        return [(self.names[chrom][index],self.pvals[chrom][index],
+                 positions[index])]
+    
+    def topSNPs(self,chrom,intervals):
+        """Return the top SNP for each of the [start, stop] pairs in
+        <intervals> on <chrom>, as a list in the same order as <intervals>.
+        Each element has the same format as the output of topSNP().
+        
+        NOTES: All of the intervals are answered in one sweep over the
+        position-sorted SNPs. The intervals are visited in order of their stop
+        coordinate. While sweeping, a stack of SNP indices is kept where every
+        SNP has a lower rank (p-value) than the SNP below it; each new SNP
+        removes the SNPs above it with a higher rank before being added, since
+        those SNPs can never again be the top SNP of an interval that also
+        contains the new SNP. The top SNP for an interval is then the first
+        SNP in the stack whose coordinate is >= the interval's start, found by
+        bisect."""
+        results=[[("rsNA",2.0,0)] for interval in intervals] #dummy default
+        if chrom not in self.positions:
+            return results
+        positions=self.positions[chrom]
+        tree=self.tree[chrom]
+        n=len(positions)
+        bystop=sorted(xrange(len(intervals)),key=lambda q: intervals[q][1])
+        stackdexes=[]
+        stackranks=[]
+        stackpositions=[]
+        i=0
+        for q in bystop:
+            start,stop=intervals[q]
+            while i<n and positions[i]<=stop:
+                rank=tree[n+i] #the leaves of the tree are the ranks
+                while stackranks and stackranks[-1]>rank:
+                    stackdexes.pop(); stackranks.pop(); stackpositions.pop()
+                stackdexes.append(i)
+                stackranks.append(rank)
+                stackpositions.append(positions[i])
+                i+=1
+            stackdex=bisect.bisect_left(stackpositions,start)
+            if stackdex<len(stackdexes):
+                index=stackdexes[stackdex]
+                results[q]=[(self.names[chrom][index],self.pvals[chrom][index],
+                             positions[index])]
+        return results
+    
+    def _minrank(self,chrom,left,right):
+        """Return the smallest rank of the SNPs at indices left <= i < right
+        on <chrom>."""
+        tree=self.tree[chrom]
+        n=len(tree)/2
+        best=n
+        left+=n; right+=n
+        while left<right:
+            if left&1:
+                if tree[left]<best:
+                    best=tree[left]
+                left+=1
+            if right&1:
+                right-=1
+                if tree[right]<best:
+                    best=tree[right]
+            left>>=1; right>>=1
+        return best
+
 #===============================================================================
 #----------Region CLASS------------------------------------------------------
 #===============================================================================
+class _CandidateList(list):
+    """The list in the candidates property of a Region. It is an ordinary list
+    of candidate dictionaries, but it also keeps the dictionary, keyed by
+    candidatekey(), that add() uses to find an equal candidate without
+    scanning the list. Every method that changes the list discards that
+    dictionary, so it is rebuilt by the next add() and never goes stale."""
+    __slots__=("_keys",)
+    
+    def __init__(self,candidates=()):
+        list.__init__(self,candidates)
+        self._keys=None
+    
+    def __reduce__(self):
+        return (_CandidateList,(list(self),))
+    
+    def add(self,candidate):
+        """Append the candidate dictionary <candidate> unless an equal
+        candidate is already in the list. Return whichever candidate
+        dictionary is in the list afterwards."""
+        if self._keys is None:
+            self._keys={}
+            for existing in self:
+                if candidatekey(existing) not in self._keys:
+                    self._keys[candidatekey(existing)]=existing
+        key=candidatekey(candidate)
+        if key in self._keys:
+            return self._keys[key]
+        list.append(self,candidate)
+        self._keys[key]=candidate
+        return candidate
+    
+    def __setitem__(self,index,value):
+        self._keys=None
+        list.__setitem__(self,index,value)
+    def __delitem__(self,index):
+        self._keys=None
+        list.__delitem__(self,index)
+    def __setslice__(self,low,high,values):
+        self._keys=None
+        list.__setslice__(self,low,high,values)
+    def __delslice__(self,low,high):
+        self._keys=None
+        list.__delslice__(self,low,high)
+    def __iadd__(self,values):
+        self._keys=None
+        return list.__iadd__(self,values)
+    def __imul__(self,times):
+        self._keys=None
+        return list.__imul__(self,times)
+    def append(self,value):
+        self._keys=None
+        list.append(self,value)
+    def extend(self,values):
+        self._keys=None
+        list.extend(self,values)
+    def insert(self,index,value):
+        self._keys=None
+        list.insert(self,index,value)
+    def pop(self,*index):
+        self._keys=None
+        return list.pop(self,*index)
+    def remove(self,value):
+        self._keys=None
+        list.remove(self,value)
+
 class Region(object):
     """A Region is centered on a focus feature, and contains information about
     other genomic features nearby (called 'candidates'), including their
@@ -967,11 +1880,8 @@ class Region(object):
         in which case the GWAS SNPs for that candidate are different depending
         on which FocusFeature it's paired with."""
     
-    _focusfeat=None
-    _candidates=None
-    _candidateGWASpvals=None
-    _candidateLD=None
-    _trackanalyses=None
+    __slots__=("_focusfeat","_candidates","_candidateGWASpvals",
+               "_candidateLD","_trackmasks")
     
     #Note that the way this module is currently written, there is no need for
     #any of the "SNPs" keys to have lists as values, since I only record one
@@ -980,6 +1890,12 @@ class Region(object):
     #the number of SNPs I record as associated with each feature, I can do that
     #easily without having to change syntax everywhere.
     
+    #Region uses __slots__ and stores trackanalyses as one integer bitmask per
+    #key (see ANALYSES) rather than a list of strings, since there can be a
+    #very large number of Regions. The trackanalyses property still behaves
+    #like a dictionary of lists, and changes made through it are kept (see
+    #_TrackAnalyses), but addanalysis() and hasanalysis() are faster.
+    
     @property
     def focusfeat(self):
         return self._focusfeat
@@ -987,8 +1903,8 @@ class Region(object):
     def focusfeat(self,value):
         if value is None:
             self._focusfeat={}
-            #initialize to empty dictionary instead of field default.
-            #You cannot have {} as the field default otherwise the same empty
+            #initialize to empty dictionary instead of a shared default.
+            #You cannot use {} as a default otherwise the same empty
             #dictionary object will be used for EVERY Region object.
             #Likewise for the other properties.
         else:
@@ -1000,12 +1916,12 @@ class Region(object):
     @candidates.setter
     def candidates(self,value):
         if value is None:
-            self._candidates=[]
+            self._candidates=_CandidateList()
         else:
-            assert type(value) is list, ("Error:"
+            assert isinstance(value,list), ("Error:"
                                     +" cannot set candidates to "+`value`
                                     +". Candidates must be a list.")
-            self._candidates=value
+            self._candidates=_CandidateList(value) #see addcandidate()
     
     @property
     def candidateGWASpvals(self):
@@ -1033,15 +1949,16 @@ class Region(object):
     
     @property
     def trackanalyses(self):
-        return self._trackanalyses
+        return _TrackAnalyses(self)
     @trackanalyses.setter
     def trackanalyses(self,value):
-        if value is None:
-            self._trackanalyses={}
-        else:
+        trackmasks={}
+        if value is not None:
             assert type(value) is dict, ("Error: cannot set trackanalyses to "
                                     +`value`+". Trackanalyses must be a dict.")
-            self._trackanalyses=value
+            for key in value:
+                trackmasks[key]=_analysismask(value[key])
+        self._trackmasks=trackmasks
     
     def __init__(self,focusfeat,candidates,candidateGWASpvals,candidateLD,
                  trackanalyses):
@@ -1051,6 +1968,52 @@ class Region(object):
         self.candidateLD=candidateLD
         self.trackanalyses=trackanalyses
     
+    def __getstate__(self):
+        return (self._focusfeat,self._candidates,self._candidateGWASpvals,
+                self._candidateLD,self._trackmasks)
+    
+    def __setstate__(self,state):
+        if type(state) is dict:
+            #a Region pickled before Region used __slots__: its state is its
+            #__dict__, with trackanalyses as a dictionary of lists
+            self.focusfeat=state.get("_focusfeat")
+            self.candidates=state.get("_candidates")
+            self.candidateGWASpvals=state.get("_candidateGWASpvals")
+            self.candidateLD=state.get("_candidateLD")
+            self.trackanalyses=state.get("_trackanalyses")
+            return
+        (self._focusfeat,candidates,self._candidateGWASpvals,
+         self._candidateLD,self._trackmasks)=state
+        self._candidates=_CandidateList(candidates)
+    
+    def addanalysis(self,key,analysisname):
+        """Record that the candidate named <key> (or the FocusFeat, if <key>
+        is "self") is relevant to the analysis <analysisname> in this
+        Region."""
+        assert analysisname in _ANALYSISBITS, ("Error: "+`analysisname`
+                                 +" is not one of "+`ANALYSES`)
+        self._trackmasks[key]=(self._trackmasks.get(key,0)
+                               |_ANALYSISBITS[analysisname])
+    
+    def hasanalysis(self,key,analysisname):
+        """Return True if the candidate named <key> (or the FocusFeat, if
+        <key> is "self") is relevant to the analysis <analysisname> in this
+        Region, else return False."""
+        return bool(self._trackmasks.get(key,0)&_ANALYSISBITS[analysisname])
+    
+    def addcandidate(self,candidate):
+        """Add the candidate dictionary <candidate> to the candidates property
+        unless an equal candidate is already there. Return whichever candidate
+        dictionary is in the candidates property afterwards (i.e. <candidate>
+        or the already-existing equal one).
+        The candidates property is a _CandidateList, which also keeps the
+        candidates in a dictionary keyed by candidatekey() so that checking
+        for an existing candidate does not scan the list. Setting the
+        candidates property copies the given list into a new _CandidateList,
+        and any change made to the list afterwards discards the dictionary,
+        so it is rebuilt on the next call."""
+        return self._candidates.add(candidate)
+    
     def __str__(self):
         """Return a string representation of the Region object"""
         def returnchromstring(dictionary):
@@ -1073,8 +2036,9 @@ class Region(object):
         for key in self.candidateLD:
             s=s+"\n"+key+": "+str(self.candidateLD[key])
         s=s+"\nTRACKANALYSES: "
-        for key in self.trackanalyses:
-            s=s+"\n"+key+": "+str(self.trackanalyses[key])
+        trackanalyses=self.trackanalyses
+        for key in trackanalyses:
+            s=s+"\n"+key+": "+str(trackanalyses[key])
         return s+"\n--------------------------------------"
     
     def __eq__(self,other):
@@ -1115,18 +2079,140 @@ class Region(object):
              for LDtuple in other.candidateLD[key]]):
             return False
         #compare trackanalyses property
-        elif (set([x for x in self.trackanalyses])
-                       !=set([y for y in other.trackanalyses])):
+        elif (set([x for x in self._trackmasks])
+                       !=set([y for y in other._trackmasks])):
             return False
-        elif (set(a for key in self.trackanalyses
-                  for a in self.trackanalyses[key])!=
-            set(b for kiy in other.trackanalyses
-                for b in other.trackanalyses[kiy])):
+        elif (reduce(lambda a,b:a|b,self._trackmasks.values(),0)!=
+              reduce(lambda a,b:a|b,other._trackmasks.values(),0)):
             return False
         #if all properties were the same, the objects are the same; return True
         else:
             return True
 
+#===============================================================================
+#----------TESTING--------------------------------------------------------------
+#===============================================================================
+def _write_test_LD_file(LDpath):
+    """Write a small LD file in the PLINK --r2 format, with its header line,
+    to <LDpath> for _test_store_LD_files() and _test_store_LD_positions()."""
+    LDfile=open(LDpath,'w')
+    LDfile.write(" CHR_A         BP_A           SNP_A  CHR_B         BP_B"
+                 +"           SNP_B           R2 \n")
+    LDfile.write("     1        10583     rs58108140      1        10611"
+                 +"    rs189107123     0.404146 \n")
+    LDfile.write("     1        10583     rs58108140      1        13302"
+                 +"    rs180734498         0.35 \n")
+    LDfile.write("     1        10583     rs58108140      1        15211"
+                 +"     rs78601809  1.23457e-05 \n")
+    LDfile.write("     1        10611    rs189107123      1        10583"
+                 +"     rs58108140     0.404146 \n")
+    LDfile.write("     1        10611    rs189107123      1        15211"
+                 +"     rs78601809 0.123456789012 \n")
+    LDfile.close()
+
+def _test_store_LD_files():
+    """Test that store_LD_files() skips the PLINK header line and that the
+    LDstore it builds gives the exact R2 of each pair in the LD file, also
+    when the R2 is in scientific notation or has many decimal places."""
+    LDlocation="_test_chr#.ld"
+    _write_test_LD_file(LDlocation.replace("#","1"))
+    oldstore=open(_LDstorepath(LDlocation,0),'wb')
+    oldstore.write("LDSTORE1"+"\0"*32) #a store in an earlier format
+    oldstore.close()
+    assert not _isstore(_LDstorepath(LDlocation,0),LDstore.MAGIC), ("Error:"
+        +" a store in an earlier format was not rebuilt")
+    store_LD_files([],LDlocation,0)
+    assert _isstore(_LDstorepath(LDlocation,0),LDstore.MAGIC)
+    store=LDstore(_LDstorepath(LDlocation,0))
+    assert store.hasSNP("rs58108140"), "Error: rs58108140 is not in the store"
+    assert not store.hasSNP("SNP_A"), "Error: the header is in the store"
+    for SNPA,SNPB,expected in [("rs58108140","rs180734498",0.35),
+                               ("rs58108140","rs78601809",1.23457e-05),
+                               ("rs189107123","rs58108140",0.404146),
+                               ("rs189107123","rs78601809",0.123456789012),
+                               ("rs189107123","rs180734498",None)]:
+        assert store.r2(SNPA,SNPB)==expected, ("Error: R2 of "+SNPA+" and "
+            +SNPB+" was "+`store.r2(SNPA,SNPB)`+" instead of "+`expected`)
+    store.mm.close()
+    os.remove(_LDstorepath(LDlocation,0))
+    os.remove(LDlocation.replace("#","1"))
+    print "Testing complete: store_LD_files() works properly"
+
+def _test_store_LD_positions():
+    """Test that store_LD_positions() skips the PLINK header line and that
+    the LDpositionstore it builds gives the exact R2 of each pair in the LD
+    file."""
+    LDlocation="_test_chr#.ld"
+    _write_test_LD_file(LDlocation.replace("#","1"))
+    store_LD_positions(LDlocation,0)
+    store=LDpositionstore(_LDpositionstorepath(LDlocation,0))
+    assert store.hasSNP(10583), "Error: 10583 is not in the store"
+    assert not store.hasSNP(15211), "Error: 15211 is a BP_A in the store"
+    for BPA,BPB,expected in [(10583,13302,0.35),(10583,15211,1.23457e-05),
+                             (10611,10583,0.404146),
+                             (10611,15211,0.123456789012),
+                             (10611,13302,None)]:
+        assert store.r2(BPA,BPB)==expected, ("Error: R2 of "+`BPA`+" and "
+            +`BPB`+" was "+`store.r2(BPA,BPB)`+" instead of "+`expected`)
+    store.mm.close()
+    os.remove(_LDpositionstorepath(LDlocation,0))
+    os.remove(LDlocation.replace("#","1"))
+    print "Testing complete: store_LD_positions() works properly"
+
+def _test_addcandidate():
+    """Test that Region.addcandidate() finds an equal candidate, and that it
+    still works after the candidates list has been changed directly."""
+    def makecandidate(name,start):
+        return {"name":name,"GWAS":"G1","chrom":1,"start":start,
+                "stop":start+100}
+    first=makecandidate("P1",1000)
+    second=makecandidate("P2",2000)
+    region=Region({"name":"F1","chrom":1,"start":500,"stop":600,"SNPs":[],
+                   "GWAS":"G1"},[first],{},{},{})
+    assert region.addcandidate(makecandidate("P1",1000)) is first, ("Error:"
+        +" an equal candidate was added again")
+    region.candidates[0]=second #same length, different candidate
+    assert region.addcandidate(first) is first
+    assert region.candidates==[second,first], ("Error: candidates were "
+        +`region.candidates`)
+    del region.candidates[1]
+    assert region.addcandidate(makecandidate("P1",1000)) is not first
+    assert len(region.candidates)==2, ("Error: candidates were "
+        +`region.candidates`)
+    region.candidates.append(first)
+    region=cPickle.loads(cPickle.dumps(region,2))
+    assert region.addcandidate(makecandidate("P2",2000)) is region.candidates[0]
+    assert len(region.candidates)==3, ("Error: candidates were "
+        +`region.candidates`)
+    print "Testing complete: addcandidate() works properly"
+
+def _test_trackanalyses():
+    """Test that changes made through Region.trackanalyses are kept, and that
+    a name that is not in ANALYSES raises an AssertionError without changing
+    the Region."""
+    region=Region({"name":"F1","chrom":1,"start":500,"stop":600,"SNPs":[],
+                   "GWAS":"G1"},[],{},{},{"self":["SpecPairA"]})
+    region.trackanalyses["self"].append("TopRegSNPA")
+    region.trackanalyses["P1"]=["FocusPeriphA"]
+    assert region.trackanalyses=={"self":["SpecPairA","TopRegSNPA"],
+                                  "P1":["FocusPeriphA"]}, ("Error:"
+        +" trackanalyses were "+`region.trackanalyses`)
+    for change in [lambda: region.trackanalyses.__setitem__("x",["Foo"]),
+                   lambda: region.trackanalyses["P1"].append("Foo"),
+                   lambda: setattr(region,"trackanalyses",
+                                   {"y":["SpecPairA"],"z":["Foo"]})]:
+        try:
+            change()
+        except AssertionError:
+            pass
+        else:
+            raise StandardError, ("Error: an analysis name that is not in"
+                                  +" ANALYSES was accepted")
+        assert region.trackanalyses=={"self":["SpecPairA","TopRegSNPA"],
+                                      "P1":["FocusPeriphA"]}, ("Error:"
+            +" trackanalyses were changed to "+`region.trackanalyses`)
+    print "Testing complete: trackanalyses works properly"
+
 #===============================================================================
 #----------EXECUTION------------------------------------------------------------
 #===============================================================================
@@ -1140,10 +2226,19 @@ if __name__ == '__main__':
     specificpairingpath=""
     GWASes={}
     LDfilepattern=""
+    LDmatch="NAME"
+    LDmode="STORE"
     keyword=""
     outputdir=""
     extbas=0
     grepavailable=False
+    workers=1
+    if len(sys.argv)==4 and sys.argv[2]=="--workers":
+        workers=int(sys.argv[3])
+    elif len(sys.argv)!=2:
+        raise StandardError, ("Error: usage is python analyzeLD.py"
+                              +" /path/to/config.txt [--workers N]")
+    assert workers>=1, "Error: --workers must be at least 1"
     #read the config file
     configfile=open(sys.argv[1],'r')
     for line in configfile:
@@ -1193,6 +2288,20 @@ if __name__ == '__main__':
                     GWASes[lineaslist[1].replace(":","")]=lineaslist[2]
             elif lineaslist[0]=="LDfiles:":
                 LDfilepattern=lineaslist[1]
+            elif lineaslist[0]=="LDmatch:":
+                if lineaslist[1].upper() in ["NAME","POSITION"]:
+                    LDmatch=lineaslist[1].upper()
+                else:
+                    raise StandardError, ("Error:"
+                        +" LDmatch must be NAME or POSITION, not "
+                        +lineaslist[1])
+            elif lineaslist[0]=="LDmode:":
+                if lineaslist[1].upper() in ["STORE","FILTERED"]:
+                    LDmode=lineaslist[1].upper()
+                else:
+                    raise StandardError, ("Error:"
+                        +" LDmode must be STORE or FILTERED, not "
+                        +lineaslist[1])
             elif lineaslist[0]=="Keyword:":
                 keyword=lineaslist[1]
             elif lineaslist[0]=="OutputDir:":
@@ -1228,15 +2337,36 @@ if __name__ == '__main__':
     if runspecificpairinganalysis:
         whattorun["SpecPairA"]=specificpairingpath
     myregionobjs=initializeRegionobjects(whattorun,GWASes)
-    if runfocusperiphanalysis:
-        print "Starting the FocusPeriphAnalysis"
-        addCandidatestoRegionobjects(extbas,myregionobjs,GWASes,"FocusPeriphA",
-                        peripheralfeaturespath)
-        print summarizeFocusPeriphAnalysis(myregionobjs)
-    if runtopregionsnpanalysis:
-        print "Starting the TopRegionSNPAnalysis"
-        addCandidatestoRegionobjects(extbas,myregionobjs,GWASes,"TopRegSNPA")
-    editRegions_re_LD(myregionobjs,LDfilepattern)
+    if workers==1:
+        if runfocusperiphanalysis:
+            print "Starting the FocusPeriphAnalysis"
+            addCandidatestoRegionobjects(extbas,myregionobjs,GWASes,
+                            "FocusPeriphA",peripheralfeaturespath)
+            print summarizeFocusPeriphAnalysis(myregionobjs)
+        if runtopregionsnpanalysis:
+            print "Starting the TopRegionSNPAnalysis"
+            addCandidatestoRegionobjects(extbas,myregionobjs,GWASes,
+                                         "TopRegSNPA")
+        editRegions_re_LD(myregionobjs,LDfilepattern,LDmatch,LDmode)
+    else:
+        print "Running the analyses for each chromosome on "+`workers`+" workers"
+        chromsettings={"extbases":extbas,"gwaspathsdict":GWASes,
+                       "candidates":None,"LDlocation":LDfilepattern,
+                       "matchby":LDmatch,"LDmode":LDmode}
+        if runfocusperiphanalysis:
+            print "Starting the FocusPeriphAnalysis"
+            chromsettings["candidates"]=returnCandidates(peripheralfeaturespath)
+            runbychromosome("FocusPeriphA",myregionobjs,chromsettings,workers)
+            print summarizeFocusPeriphAnalysis(myregionobjs)
+        if runtopregionsnpanalysis:
+            print "Starting the TopRegionSNPAnalysis"
+            runbychromosome("TopRegSNPA",myregionobjs,chromsettings,workers)
+        LDcounts=runbychromosome("LD",myregionobjs,chromsettings,workers)
+        print ("Count: LD for top FocusFeature SNP was not found with "
+                +"any SNPs: "+`sum(counts[0] for counts in LDcounts)`)
+        print ("Count: LD for top FocusFeature SNP was found with some SNPs, "
+                +"but not with a particular candidate gene's top SNP: "
+                +`sum(counts[1] for counts in LDcounts)`)
     #Write to output files:
     if runfocusperiphanalysis:
         writeCompactOutputFile(myregionobjs,keyword,outputdir,"FocusPeriphA")
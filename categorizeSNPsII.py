@@ -7,8 +7,10 @@
 
 ----------Module Input----------------------------------------------------------
 This is an executable python module, called as follows:
-    python categorizeSNPs.py <path to configuration file>
+    python categorizeSNPs.py <path to configuration file> [--build]
     e.g. python categorizeSNPs.py /home/raba/GWASready/categorizeSNPs_config.txt
+With --build, the module only creates the chromosome arrays (or tracks) that
+are missing, and does not analyze the GWASs.
 
 Example config file:
 #======================================#
@@ -51,6 +53,28 @@ bases: 0
 #True or False, to determine whether actual chromosome sizes are used
 userealsizes: True
 
+#optional: array, track or intervals, to determine how SNPs are classified
+backend: array
+
+#optional: settings for creating missing chromosome arrays
+workers: 4
+workermemory: 2000
+packed: False
+
+#optional: True to classify the SNPs of every GWAS in one pass
+batch: False
+
+#optional: count the SNPs in each category for several bases values instead
+#sweep: 0,500,5000,20000
+
+#optional: test each category for enrichment with this many permutations
+permutations: 0
+seed: 0
+
+#optional: True to save a summary of each category instead of its p-values
+summary: False
+summarythresholds: 5e-8,1e-5,1e-3,0.05
+
 #=================================================#
 # Specify where the module's output will be saved #
 #=================================================#
@@ -93,6 +117,49 @@ Notes about config file format: the config file must include
         actual sizes of human chromosomes) or using a fake, 'testing' size of
         100 bases. (Because in testing, I don't want to be dealing with
         chromosomes that are way bigger than they need to be.)
+    -->>optionally, one line beginning with "backend: " followed by array,
+        track or intervals. With array (the default) the SNPs are classified
+        using the chromosome arrays described above. With track, a
+        run-length-encoded chromoarray.CategoryTrack file is used for each
+        chromosome instead of an array; it is created (from the existing
+        array if there is one) the same way as the arrays, in the same dir.
+        With intervals, nothing is read from or saved to the dir of the
+        config file: the mRNA, lincRNA and nonintergenic locations are
+        compiled into one CategoryTrack per chromosome. All three put every
+        SNP in the same category.
+    -->>optionally, lines beginning with "workers: ", "workermemory: " and
+        "packed: ". These are used when chromosome arrays (or tracks) have to
+        be created; see buildchromarrays(). workers is the number of
+        chromosomes created at the same time (default 1), workermemory is
+        the most memory in megabytes each of those processes may use (default
+        0, meaning no limit), and packed is True to save the arrays with three
+        bits per base (default False).
+    -->>optionally, one line beginning with "batch: " followed by True or
+        False (default False). If True, each chromosome's array is loaded
+        only once and used for all of the GWASs (see outputpvals_batch());
+        all of the GWASs are then held in memory at the same time.
+    -->>optionally, one line beginning with "sweep: " followed by a
+        comma-separated list of bases values (each 0 <= bases <= 20000). If
+        it is given, no p-value files are made; instead the number of SNPs in
+        each category is counted for every one of those bases values, using
+        the distance from each SNP to the nearest mRNA and lincRNA, and saved
+        in a "sweep" file for each GWAS (see sweepbases()). No chromosome
+        arrays are needed for this.
+    -->>optionally, lines beginning with "permutations: " and "seed: "
+        followed by ints (default 0 for both). If permutations is more than
+        0, each category of each GWAS is tested for enrichment of small
+        p-values with that many permutations of the category labels, using
+        the p-values held in memory (see enrichment.permutationtest()); seed
+        determines the random numbers, and the permutations are split across
+        the number of processes given by workers.
+    -->>optionally, one line beginning with "summary: " followed by True or
+        False (default False), and one line beginning with
+        "summarythresholds: " followed by a comma-separated list of p-value
+        thresholds (default 5e-8,1e-5,1e-3,0.05). If summary is True, the
+        five p-value files are not made; instead the count, a histogram of
+        -log10(p), the number of p-values at or below each threshold and a
+        quantile sketch of each category are saved in one JSON file (see
+        pvalsummary.py).
 -->>The final line will determine where the module's output will be saved.
 Any lines in the configfile beginning with # are ignored.
 
@@ -103,22 +170,33 @@ docstring for outputpvals(). These files are saved in a dir called
 "outputlocation" line of the config file. Each of these files contains
 p-values (separated by newlines) for GWAS SNPs that fall within the
 specified location (lincRNA, mRNA, both lincRNA and mRNA, nonintergenic, or
-intergenic.) Using the files created by this module, the comparisons of
-p-value distributions can be made in R, or using permutation testing with
-the module enrichment.py"""
+intergenic.) If permutations is more than 0, a sixth file
+<GWAS>_<date>_ext<bases>_enrichment.txt with the results of permutation testing
+is also saved (see enrichment.writeenrichment()). If summary is True the five
+files are replaced by <GWAS>_<date>_ext<bases>_summary.json (see
+pvalsummary.savesummaries()). Using the files created by this module, the
+comparisons of p-value distributions can be made in R, or using permutation
+testing with the module enrichment.py"""
 
+import array
 import cPickle
+import hashlib
 import sys
 import copy
 import time
 import os
 import os.path
 
+import numpy
+
 import GTFparser_general
 import FeatureClass_Small
 import RefGene_parserII
 import PseudogeneParser
 import chromoarray
+import enrichment
+import intervalset
+import pvalsummary
 
 def do_snipification(theGWASpath):
     #Tested. I examined the original file of AcuteVSChronic_clean.txt and the
@@ -157,6 +235,74 @@ def do_snipification(theGWASpath):
             +`linecount`+" but number of SNPs in PyList is "+`len(snpslist)`)
     return snpslist
 
+#Size in bytes of the chunks of lines that loadGWAScolumns() reads at a time
+_GWASCHUNK=1<<22
+
+def loadGWAScolumns(theGWASpath):
+    """Return the SNPs of the GWAS at <theGWASpath> as a dictionary of numpy
+    columns, sorted by chromosome.
+    ----------Input---------
+    <theGWASpath> is the full filename and path to the annovar input file, in
+    the format described in the docstring for do_snipification().
+    
+    ----------Output----------
+    A dictionary with the keys:
+        "rs": numpy int32 array of the rs numbers
+        "chrom": numpy int8 array of the chromosome numbers
+        "pos": numpy int32 array of the (one-based) positions
+        "pval": numpy float64 array of the p-values
+        "offsets": numpy int64 array of length 26. The SNPs on chromosome c
+            (1 to 24, where 23 is X and 24 is Y) are rows
+            offsets[c]:offsets[c+1] of the other columns.
+    The SNPs of each chromosome stay in the order they are in the file, so
+    row i of chromosome c is the same SNP as do_snipification() puts at index
+    i of that chromosome.
+    NOTES: the file is read _GWASCHUNK bytes of lines at a time into compact
+    arrays, so the memory used is close to the size of the final columns
+    rather than one Python list per SNP (see chromosomecolumns())."""
+    rs=array.array('i')
+    chrom=array.array('b')
+    pos=array.array('i')
+    pval=array.array('d')
+    anvfile=open(theGWASpath,'r')
+    linecount=0
+    while True:
+        lines=anvfile.readlines(_GWASCHUNK)
+        if not lines:
+            break
+        linecount+=len(lines)
+        for line in lines:
+            lineaslist=line.rsplit("\t")
+            chrm=int(lineaslist[0])
+            assert 1<=chrm<=24, ("Error: chromosome must be 1 to 24, not "
+                                 +`chrm`+" in line "+`line`)
+            chrom.append(chrm)
+            pos.append(int(lineaslist[1]))
+            rs.append(int(lineaslist[5]))
+            pval.append(float(lineaslist[6]))
+    anvfile.close()
+    assert linecount==len(pval), ("Error: "
+            +"number of lines in annovarfile is "
+            +`linecount`+" but number of SNPs in columns is "+`len(pval)`)
+    chrom=numpy.frombuffer(chrom,dtype=numpy.int8)
+    #a stable sort keeps the SNPs of each chromosome in file order
+    order=numpy.argsort(chrom,kind='mergesort')
+    offsets=numpy.zeros(26,dtype=numpy.int64)
+    offsets[1:]=numpy.cumsum(numpy.bincount(chrom,minlength=25))
+    return {"rs":numpy.frombuffer(rs,dtype=numpy.int32)[order],
+            "chrom":chrom[order],
+            "pos":numpy.frombuffer(pos,dtype=numpy.int32)[order],
+            "pval":numpy.frombuffer(pval,dtype=numpy.float64)[order],
+            "offsets":offsets}
+
+def chromosomecolumns(columns,chromnumber):
+    """Return (positions,pvals) of the SNPs on chromosome <chromnumber> (1 to
+    24) in <columns> (the output of loadGWAScolumns()). These are numpy views,
+    not copies."""
+    start=columns["offsets"][chromnumber]
+    stop=columns["offsets"][chromnumber+1]
+    return columns["pos"][start:stop],columns["pval"][start:stop]
+
 def _collectlocations(rnalist):
     """Return a list of RNA locations.
     ----------Function Input----------
@@ -186,7 +332,9 @@ def _collectlocations(rnalist):
 
 
 def outputpvals(GWASpath,lincpath,mrnapath,nonintpath,bases,configpath,
-                whether_to_use_real_sizes,outputloc):
+                whether_to_use_real_sizes,outputloc,backend="array",
+                permutations=0,seed=0,workers=1,summary=False,
+                thresholds=pvalsummary.SUMMARY_THRESHOLDS):
     #See file "11-25-13_testing_the_module_categorizeSNPsII" for description
     #of how this function was tested
     """Create five files containing p-values.
@@ -200,6 +348,11 @@ def outputpvals(GWASpath,lincpath,mrnapath,nonintpath,bases,configpath,
     they will be created. One array is created per autosome. Also, a chromosome
     can have multiple arrays, if this function is called with different
     <bases> parameters. (see NOTE_8213)
+    If <backend> is "track" instead of "array", a saved CategoryTrack is used
+    for each autosome instead of an array (see _loadchrtrack()). If it is
+    "intervals", a chromoarray.CategoryTrack is compiled for each autosome
+    from the locations instead. All backends put every SNP in the same
+    category.
     
     ----------Function Output----------
     This function creates five text files of p-values for the GWAS specified:
@@ -218,21 +371,82 @@ def outputpvals(GWASpath,lincpath,mrnapath,nonintpath,bases,configpath,
                                            "nonintergenic" regions)
     The ext<bases> in the output file names indicates by how many bases the
     size of the RNA was extended in either direction. A custom array must be
-    created for each bases parameter."""
+    created for each bases parameter.
+    If <permutations> is more than 0, the p-values of each category are also
+    kept in memory and tested with enrichment.permutationtest() using <seed>
+    and <workers>, and the results are saved in <prefix>_enrichment.txt.
+    If <summary> is True, the five files are not made. Instead a
+    pvalsummary.CategorySummary of each category, with the p-value
+    <thresholds>, is built as the SNPs are classified and they are saved in
+    <prefix>_summary.json."""
+    outputpvals_batch([GWASpath],lincpath,mrnapath,nonintpath,bases,
+                      configpath,whether_to_use_real_sizes,outputloc,backend,
+                      permutations,seed,workers,summary,thresholds)
+
+def outputpvals_batch(GWASpaths,lincpath,mrnapath,nonintpath,bases,configpath,
+                      whether_to_use_real_sizes,outputloc,backend="array",
+                      permutations=0,seed=0,workers=1,summary=False,
+                      thresholds=pvalsummary.SUMMARY_THRESHOLDS):
+    """Do what outputpvals() does for every GWAS in the list <GWASpaths>, but
+    load each chromosome's array (or track) only once: each chromosome's SNPs
+    are classified for every GWAS before moving on to the next chromosome.
+    Each GWAS gets its own output dir and files, exactly as if outputpvals()
+    had been called for it. The other arguments are as for outputpvals().
+    All of the GWASs are read into memory at the start."""
+    assert backend in ["array","track","intervals"], ("Error: backend must"
+                        +" be array, track or intervals, not "+`backend`)
+    runs=[_startpvalsrun(GWASpath,bases,outputloc,permutations>0,summary,
+                         thresholds) for GWASpath in GWASpaths]
+    if backend=="intervals":
+        mrnaLocations,linkLocations,nonintLocations=_loadlocations(
+                                lincpath,mrnapath,nonintpath,configpath)
+        chrsizedict=chromoarray.chromsizes(whether_to_use_real_sizes)
+    print "assigning SNPs to categories and writing to files"
+    for chrmdex in range(22): #ignore X and Y which have been removed anyway
+        print "chromosome "+`chrmdex+1`+" is being worked on"
+        if backend=="array":
+            chrarray=_loadchrarray(chrmdex,bases,lincpath,mrnapath,nonintpath,
+                                   configpath,whether_to_use_real_sizes)
+        elif backend=="track":
+            chrarray=_loadchrtrack(chrmdex,bases,lincpath,mrnapath,nonintpath,
+                                   configpath,whether_to_use_real_sizes)
+        else:
+            chrarray=chromoarray.makecategorytrack(
+                chrsizedict["chr"+`chrmdex+1`],mrnaLocations[chrmdex],
+                linkLocations[chrmdex],nonintLocations[chrmdex],bases)
+        for run in runs:
+            positions,pvals=chromosomecolumns(run["columns"],chrmdex+1)
+            _classifySNPs(chrarray,positions,pvals,run)
+        if backend=="array":
+            chrarray.close()
+    for run in runs:
+        _finishpvalsrun(run)
+        if permutations>0:
+            print ("running "+`permutations`+" permutations per category for "
+                   +run["prefix"])
+            pvalsbycategory=dict((category,numpy.concatenate(
+                                  run["categorypvals"][category]))
+                                 for category in run["categorypvals"])
+            results=enrichment.permutationtest(pvalsbycategory,permutations,
+                                               seed,workers)
+            enrichment.writeenrichment(results,run["prefix"]+"_enrichment.txt",
+                                       permutations,seed)
+
+def _startpvalsrun(GWASpath,bases,outputloc,keeppvals=False,summary=False,
+                   thresholds=pvalsummary.SUMMARY_THRESHOLDS):
+    """Read the GWAS at <GWASpath>, make its output dir in <outputloc>, and
+    open its five p-value files. Return a dictionary describing this GWAS's
+    part of outputpvals_batch() with the keys "prefix" (the start of the
+    output file paths), "columns" (the SNPs as numpy columns, see
+    loadGWAScolumns()), "files" and "counts" (dictionaries keyed by category
+    char), and "overallcount". If <keeppvals> is True it also has the key
+    "categorypvals", a dictionary of lists of numpy arrays of the p-values
+    put in each category. If <summary> is True no p-value files are opened
+    ("files" is empty) and it has the key "summaries", a dictionary of
+    pvalsummary.CategorySummary objects with <thresholds>."""
     #Extract simple GWAS name from path, and open the files that will have
     #pvals stored in them
-    pathaslist=GWASpath.rsplit("/") #should the separator ever be "\\"
-    GWASfilename=pathaslist[-1] 
-    GWAS=GWASfilename[:-10] #WARNING: THIS ASSUMES THE FORMAT OF THE FILENAME
-    #IS <GWAS>_clean.txt
-    print "sorting GWAS SNPs by chrom"
-    SNPs=do_snipification(GWASpath)
-    SNPsbychrom=[[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],
-        [],[],[],[]]
-    for SNP in SNPs:
-        SNPsbychrom[(SNP[1])-1].append(SNP)
-    SNPsbychrom=SNPsbychrom[:22] #Remove X and Y chromosomes so that list
-    #index isn't out of range for nonintplaces in while loop below
+    GWAS,columns=_readGWAScolumns(GWASpath)
     #Assign every SNP to a category and write to results files, which are all
     #saved into subdir of the GWAS dir
     prettydate=(`time.localtime().tm_mon`+"-"+`time.localtime().tm_mday`
@@ -241,66 +455,181 @@ def outputpvals(GWASpath,lincpath,mrnapath,nonintpath,bases,configpath,
     _ensure_dir(outputloc+"/categorizeSNPsII_outputpvals_"+prettydate+"_"+GWAS)
     prefix=(outputloc+"/categorizeSNPsII_outputpvals_"+prettydate+"_"
             +GWAS+"/"+GWAS+"_"+prettydate+"_ext"+`bases`)
-    fmrnas=open(prefix+"_mRNAonly.txt",'w')
-    fintergenic=open(prefix+"_intergenic.txt",'w')
-    flincs=open(prefix+"_linconly.txt",'w')
-    fnonint=open(prefix+"_noninter.txt",'w')
-    fboth=open(prefix+"_both_linc+mRNA.txt",'w')
-    print "assigning SNPs to categories and writing to files"
-    overallcount=0; lccount=0; mRcount=0
-    bothcount=0; intcount=0; nonintcount=0
-    for chrmdex in range(22): #ignore X and Y which have been removed anyway
-        print "chromosome "+`chrmdex+1`+" is being worked on"
-        chrarray=_loadchrarray(chrmdex,bases,lincpath,mrnapath,nonintpath,
-                               configpath,whether_to_use_real_sizes)
-        snpstoclassify=SNPsbychrom[chrmdex]
-        for snip in snpstoclassify:
-            overallcount+=1
-            category=chrarray[snip[2]-1]#snip[2] is the snip's coordinate;
-            #look up classification of the relevant base
-            #have to subtract one because the snip's coordinate is one-based but
-            #Python arrays have a "zeroth" index
-            if category=="i":#Write to file based on category
-                fintergenic.write(`snip[3]`+"\n")#snip[3] is pvalue
-                intcount+=1
-            elif category=="m":
-                fmrnas.write(`snip[3]`+"\n")
-                mRcount+=1
-            elif category=="l":
-                flincs.write(`snip[3]`+"\n")
-                lccount+=1
-            elif category=="n":
-                fnonint.write(`snip[3]`+"\n")
-                nonintcount+=1
-            elif category=="b":
-                fboth.write(`snip[3]`+"\n")
-                bothcount+=1
-            else:
-                assert False, ("this should never happen: '"+category
-                               +"' is not a valid category")
-    fmrnas.close()
-    fintergenic.close()
-    flincs.close()
-    fnonint.close()
-    fboth.close()
-    logg=open(prefix+"_LOGFILE_for_categorizeSNPs.txt",'w')#logfile has counts
+    if summary:
+        files={}
+    else:
+        files={"m":open(prefix+"_mRNAonly.txt",'w',_OUTPUTBUFFER),
+               "i":open(prefix+"_intergenic.txt",'w',_OUTPUTBUFFER),
+               "l":open(prefix+"_linconly.txt",'w',_OUTPUTBUFFER),
+               "n":open(prefix+"_noninter.txt",'w',_OUTPUTBUFFER),
+               "b":open(prefix+"_both_linc+mRNA.txt",'w',_OUTPUTBUFFER)}
+    run={"prefix":prefix,"columns":columns,"files":files,
+         "counts":{"m":0,"i":0,"l":0,"n":0,"b":0},"overallcount":0}
+    if keeppvals:
+        run["categorypvals"]={"m":[],"i":[],"l":[],"n":[],"b":[]}
+    if summary:
+        run["summaries"]=dict((category,pvalsummary.CategorySummary(
+                               thresholds)) for category in "milnb")
+    return run
+
+def _readGWAScolumns(GWASpath):
+    """Return (simple GWAS name, columns) for the GWAS at <GWASpath>, where
+    columns are its SNPs grouped by chromosome (see loadGWAScolumns())."""
+    pathaslist=GWASpath.rsplit("/") #should the separator ever be "\\"
+    GWASfilename=pathaslist[-1] 
+    GWAS=GWASfilename[:-10] #WARNING: THIS ASSUMES THE FORMAT OF THE FILENAME
+    #IS <GWAS>_clean.txt
+    print "sorting GWAS SNPs by chrom"
+    #X and Y chromosomes (23 and 24) are loaded but never looked up
+    return GWAS,loadGWAScolumns(GWASpath)
+
+def _classifySNPs(chrarray,positions,pvals,run):
+    """Look up the category of each SNP of one chromosome, given by the numpy
+    arrays <positions> and <pvals> (see chromosomecolumns()), in <chrarray>,
+    write their p-values to the files of <run> (see _startpvalsrun()) and add
+    them to its counts."""
+    run["overallcount"]+=len(positions)
+    #look up classification of the relevant base. Have to subtract one
+    #because the snip's coordinate is one-based but Python arrays have a
+    #"zeroth" index
+    categories=chrarray.lookup(positions.astype(numpy.int64)-1)
+    invalid=~_VALIDCATEGORIES[categories]
+    if invalid.any():
+        assert False, ("this should never happen: '"
+            +chr(categories[numpy.argmax(invalid)])
+            +"' is not a valid category")
+    #Write to file (or add to the summary) based on category
+    for category in run["counts"]:
+        categorypvals=pvals[categories==ord(category)]
+        run["counts"][category]+=len(categorypvals)
+        if category in run["files"]:
+            _writepvals(run["files"][category],categorypvals)
+        if "summaries" in run:
+            run["summaries"][category].add(categorypvals)
+        if "categorypvals" in run:
+            run["categorypvals"][category].append(categorypvals)
+
+def _finishpvalsrun(run):
+    """Close the p-value files of <run> (see _startpvalsrun()), or save its
+    summaries, and write its logfile of counts."""
+    for category in run["files"]:
+        run["files"][category].close()
+    if "summaries" in run:
+        pvalsummary.savesummaries(run["prefix"]+"_summary.json",
+            run["summaries"],{"prefix":os.path.basename(run["prefix"]),
+                              "overallcount":run["overallcount"]})
+    counts=run["counts"]
+    overallcount=run["overallcount"]
+    logg=open(run["prefix"]+"_LOGFILE_for_categorizeSNPs.txt",'w')#logfile has
+    #counts
     logg.write("overallcount: "+`overallcount`+
-               "\nmRNA only: "+`mRcount`+
-               "\nlincRNA only: "+`lccount`+
-               "\nboth lincRNA and mRNA: "+`bothcount`+
-               "\nintergenic: "+`intcount`+
-               "\nnonintergenic: "+`nonintcount`)
-    subcountsum=mRcount+lccount+bothcount+intcount+nonintcount
+               "\nmRNA only: "+`counts["m"]`+
+               "\nlincRNA only: "+`counts["l"]`+
+               "\nboth lincRNA and mRNA: "+`counts["b"]`+
+               "\nintergenic: "+`counts["i"]`+
+               "\nnonintergenic: "+`counts["n"]`)
+    logg.close()
+    subcountsum=sum(counts.values())
     assert overallcount==subcountsum, ("Error: overallcount was "
             +`overallcount`+" but the sum of the subcounts was "+`subcountsum`)
 
+def makedistanceindex(columns,mrnaLocations,linkLocations,
+                      nonintLocations):
+    """Return a list of 22 dictionaries, one per autosome, describing the SNPs
+    in <columns> (see loadGWAScolumns()) with the keys "pvals" (a numpy
+    float array), "mRNAdistances" and "lincRNAdistances" (numpy int arrays of
+    the distance from each SNP to the nearest mRNA or lincRNA, see
+    chromoarray.nearestdistances()) and "innonlist" (a numpy bool array that
+    is True for SNPs in a nonintergenic region). The locations are the
+    cleaned-up lists returned by _loadlocations().
+    With this index the SNPs can be classified for any bases value with
+    distancecategories(), giving the same categories as the chromosome
+    arrays made with that bases value, without making those arrays."""
+    distanceindex=[]
+    for chrmdex in range(22):
+        positions,pvals=chromosomecolumns(columns,chrmdex+1)
+        positions=positions.astype(numpy.int64)
+        distanceindex.append({
+            "pvals":pvals,
+            "mRNAdistances":chromoarray.nearestdistances(
+                                mrnaLocations[chrmdex],positions),
+            "lincRNAdistances":chromoarray.nearestdistances(
+                                linkLocations[chrmdex],positions),
+            "innonlist":chromoarray.nearestdistances(
+                                nonintLocations[chrmdex],positions)==0})
+    return distanceindex
+
+def distancecategories(chromindex,bases):
+    """Return a numpy uint8 array of the category char codes of the SNPs of
+    one autosome, described by <chromindex> (one element of the output of
+    makedistanceindex()), when mRNAs and lincRNAs are expanded by <bases>."""
+    return chromoarray.categoriesfromdistances(chromindex["mRNAdistances"],
+                chromindex["lincRNAdistances"],chromindex["innonlist"],bases)
+
+def sweepbases(GWASpaths,lincpath,mrnapath,nonintpath,configpath,
+               baseslist,outputloc):
+    """Count how many SNPs of each GWAS in <GWASpaths> fall in each category
+    for every bases value in <baseslist> (ints, 0 <= bases <= 20000), using
+    one distance index per GWAS (see makedistanceindex()) instead of one set
+    of chromosome arrays per bases value. The locations are loaded once for
+    all of the GWASs. For each GWAS a tab-delimited file
+    "<GWAS>_<date>_sweep.txt" is saved in a dir called
+    "categorizeSNPsII_sweep_<date>_<GWAS>" in <outputloc>, with one line per
+    bases value giving the same counts as the logfile of outputpvals()."""
+    for bases in baseslist:
+        assert type(bases) is int and 0<=bases<=20000, ("Error:"
+            +" every bases value must be an int, and 0 <= bases <= 20000,"
+            +" not "+`bases`)
+    mrnaLocations,linkLocations,nonintLocations=_loadlocations(
+                                lincpath,mrnapath,nonintpath,configpath)
+    prettydate=(`time.localtime().tm_mon`+"-"+`time.localtime().tm_mday`
+                +"-"+`time.localtime().tm_year`)
+    for GWASpath in GWASpaths:
+        GWAS,columns=_readGWAScolumns(GWASpath)
+        print "making the distance index for "+GWAS
+        distanceindex=makedistanceindex(columns,mrnaLocations,
+                                        linkLocations,nonintLocations)
+        _ensure_dir(outputloc+"/categorizeSNPsII_sweep_"+prettydate+"_"+GWAS)
+        sweepfile=open(outputloc+"/categorizeSNPsII_sweep_"+prettydate+"_"
+                       +GWAS+"/"+GWAS+"_"+prettydate+"_sweep.txt",'w')
+        sweepfile.write("bases\toverallcount\tmRNA only\tlincRNA only\t"
+                        +"both lincRNA and mRNA\tintergenic\tnonintergenic\n")
+        for bases in baseslist:
+            counts=dict((category,0) for category in "mlbin")
+            for chromindex in distanceindex:
+                tally=numpy.bincount(distancecategories(chromindex,bases),
+                                     minlength=256)
+                for category in counts:
+                    counts[category]+=int(tally[ord(category)])
+            sweepfile.write("\t".join([`bases`,`sum(counts.values())`]
+                            +[`counts[category]` for category in "mlbin"])
+                            +"\n")
+        sweepfile.close()
+
+def _writepvals(outputfile,pvals):
+    """Write the p-values in the numpy float array <pvals> to <outputfile>,
+    one per line, in the same format as `pvalue`, and return how many were
+    written. The p-values are turned back into Python floats first so that
+    they are formatted exactly as before."""
+    if len(pvals)>0:
+        outputfile.write("\n".join([`pval` for pval in pvals.tolist()])+"\n")
+    return len(pvals)
+
+_OUTPUTBUFFER=1<<20 #buffer size in bytes for the p-value files
+_VALIDCATEGORIES=numpy.zeros(256,dtype=numpy.bool_) #True for "imlbn" codes
+for _category in "imlbn":
+    _VALIDCATEGORIES[ord(_category)]=True
+
 def _loadchrarray(chrmdex1,bases1,lincpath1,mrnapath1,nonintpath1,configpath1,
                   whether_to_use_real_sizes1):
-    """Return the chrarray called "chromosome<chrmdex1+1>_ext<bases1>_array.bin"
-    (for example, "chromosome1_ext0_array.bin").
+    """Return the chrarray called "chromosome<chrmdex1+1>_ext<bases1>_array.raw"
+    (for example, "chromosome1_ext0_array.raw") as a chromoarray.ChromArray,
+    which is memory-mapped rather than read into memory.
     The chrarray should be located in the same directory as the configuration file.
-    If the chrarray file already exists, it is loaded and returned.
-    If the chrarray file does not exist, it is created using
+    If the chrarray file already exists, it is opened and returned.
+    If only a cPickled chrarray from an earlier version of chromoarray.py
+    exists ("chromosome1_ext0_array.bin"), it is converted to the raw format.
+    If neither file exists, it is created using
     chromoarray.create_22chrom_arrays() for the
     correct chrmdex, and saved in the same directory as the configuration file.
     The creation of the chrarray file requires the nonintergenic regions to be
@@ -308,47 +637,128 @@ def _loadchrarray(chrmdex1,bases1,lincpath1,mrnapath1,nonintpath1,configpath1,
     not been defined, then they are defined before being used."""
     confFilepathaslist=configpath1.rsplit("/") #should separator ever be "\\"?)
     confFiledirpath="/".join(confFilepathaslist[:-1])
-    try:
-        chrarray=cPickle.load(open(confFiledirpath+"/chromosome"
-                +`chrmdex1+1`+"_ext"+`bases1`+"_array.bin",'rb'))
-                #load the pre-created array for the appropriate chromosome
-                #and bases1 parameter
-    except IOError as myerr:
-        if "No such file or directory" in myerr.strerror: #if you haven't
-            #created the chromosome arrays yet, make them now
-            lincRNAslist=cPickle.load(open(lincpath1,'rb'))
-            linkLocations=_collectlocations(lincRNAslist)
-            for chromzome in linkLocations:
-                _clean_up_locations(chromzome) #If you don't clean up the
-                #locations, then you have overlapping intervals, and it's just
-                #cleaner to NOT have overlapping intervals
-            mRNAslist=GTFparser_general.sortSmallFeatsbychrom(
-                RefGene_parserII.returnRefGenelist(mrnapath1,["NM"]))
-            mrnaLocations=_collectlocations(mRNAslist)
-            for chromzome2 in mrnaLocations:
-                _clean_up_locations(chromzome2)
-            try: #similar setup for the nonintLocations file: create it if it
-                #doesn't exist
-               nonintLocations=cPickle.load(open(nonintpath1,'rb'))
-            except IOError as myerr2:
-                if "No such file or directory" in myerr2.strerror:
-                    notintergenic(configpath1,nonintpath1)#name the file
-                    #whatever is specified
-                    #e.g. categorizeSNPs_NOTintergenic_locslist_<suffix>.bin
-                    nonintLocations=cPickle.load(open(nonintpath1,'rb'))
-                else:
-                    raise IOError
+    arrayprefix=confFiledirpath+"/chromosome"+`chrmdex1+1`
+    rawpath=chromoarray.chromarraypath(arrayprefix,bases1)
+    picklepath=arrayprefix+"_ext"+`bases1`+"_array.bin"
+    if not os.path.exists(rawpath) and os.path.exists(picklepath):
+        print "converting "+picklepath+" to "+rawpath
+        chromoarray.savechromarray(rawpath,
+                                   cPickle.load(open(picklepath,'rb')),
+                                   chrmdex1+1,bases1)
+    elif not os.path.exists(rawpath): #if you haven't
+        #created the chromosome arrays yet, make them now
+        mrnaLocations,linkLocations,nonintLocations=_loadlocations(
+                                lincpath1,mrnapath1,nonintpath1,configpath1)
+        chromoarray.create_22chrom_arrays(mrnaLocations,linkLocations,
+                            nonintLocations,bases1,[chrmdex1+1],
+                            whether_to_use_real_sizes1,
+                            dirtosavein=confFiledirpath)
+    chrarray=chromoarray.ChromArray(rawpath)
+    assert chrarray.lmbases==bases1, ("Error: "+rawpath+" was made with"
+            +" bases="+`chrarray.lmbases`+", not "+`bases1`)
+    return chrarray
+
+
+def buildchromarrays(bases,lincpath,mrnapath,nonintpath,configpath,
+                     whether_to_use_real_sizes,astracks=False,packed=False,
+                     workers=1,workermemory=0):
+    """Create every chromosome array that does not exist yet in the same
+    directory as the configuration file at <configpath>, and return a list of
+    the numbers of the chromosomes that were created.
+    The locations are loaded only once (see _loadlocations()) and all of the
+    missing chromosomes are created by one call to
+    chromoarray.create_22chrom_arrays(), which makes them in <workers>
+    processes limited to <workermemory> megabytes each (0 means no limit).
+    If <astracks> is True, CategoryTracks are created instead of arrays;
+    chromosomes that already have an array are left for _loadchrtrack() to
+    convert. <packed> is passed on to create_22chrom_arrays().
+    The other arguments are the same as for _loadchrarray()."""
+    confFilepathaslist=configpath.rsplit("/") #should separator ever be "\\"?)
+    confFiledirpath="/".join(confFilepathaslist[:-1])
+    missing=[]
+    for chromnumber in range(1,23):
+        arrayprefix=confFiledirpath+"/chromosome"+`chromnumber`
+        hasarray=(os.path.exists(chromoarray.chromarraypath(arrayprefix,bases))
+            or os.path.exists(arrayprefix+"_ext"+`bases`+"_array.bin"))
+        hastrack=os.path.exists(chromoarray.chromtrackpath(arrayprefix,bases))
+        if not hasarray and not (astracks and hastrack):
+            missing.append(chromnumber)
+    if missing!=[]:
+        print "creating chromosomes "+`missing`+" with "+`workers`+" workers"
+        mrnaLocations,linkLocations,nonintLocations=_loadlocations(
+                                lincpath,mrnapath,nonintpath,configpath)
+        chromoarray.create_22chrom_arrays(mrnaLocations,linkLocations,
+                                nonintLocations,bases,missing,
+                                whether_to_use_real_sizes,
+                                dirtosavein=confFiledirpath,astracks=astracks,
+                                packed=packed,workers=workers,
+                                workermemory=workermemory)
+    return missing
+
+def _loadchrtrack(chrmdex1,bases1,lincpath1,mrnapath1,nonintpath1,configpath1,
+                  whether_to_use_real_sizes1):
+    """Return the chromoarray.CategoryTrack saved as
+    "chromosome<chrmdex1+1>_ext<bases1>_track.rle" in the same directory as
+    the configuration file. If the track file does not exist, it is made by
+    run-length encoding the chromosome array if that exists (either format;
+    see _loadchrarray()), and otherwise it is created from the locations
+    with chromoarray.create_22chrom_arrays(astracks=True). The arguments are
+    the same as for _loadchrarray()."""
+    confFilepathaslist=configpath1.rsplit("/") #should separator ever be "\\"?)
+    confFiledirpath="/".join(confFilepathaslist[:-1])
+    arrayprefix=confFiledirpath+"/chromosome"+`chrmdex1+1`
+    trackpath=chromoarray.chromtrackpath(arrayprefix,bases1)
+    if not os.path.exists(trackpath):
+        if (os.path.exists(chromoarray.chromarraypath(arrayprefix,bases1))
+            or os.path.exists(arrayprefix+"_ext"+`bases1`+"_array.bin")):
+            print "run-length encoding the array for "+trackpath
+            chrarray=_loadchrarray(chrmdex1,bases1,lincpath1,mrnapath1,
+                    nonintpath1,configpath1,whether_to_use_real_sizes1)
+            chromoarray.savecategorytrack(trackpath,
+                    chromoarray.trackfromarray(chrarray),chrmdex1+1,bases1)
+            chrarray.close()
+        else:
+            mrnaLocations,linkLocations,nonintLocations=_loadlocations(
+                                lincpath1,mrnapath1,nonintpath1,configpath1)
             chromoarray.create_22chrom_arrays(mrnaLocations,linkLocations,
                                 nonintLocations,bases1,[chrmdex1+1],
                                 whether_to_use_real_sizes1,
-                                dirtosavein=confFiledirpath)
-            chrarray=cPickle.load(open(confFiledirpath+"/chromosome"
-                            +`chrmdex1+1`+"_ext"+`bases1`+"_array.bin",'rb'))
-        else:
-            raise IOError #any IOError BESIDES not having created the chromosome
-            #arrays will get reported
-    return chrarray
+                                dirtosavein=confFiledirpath,astracks=True)
+    chrtrack=chromoarray.loadcategorytrack(trackpath)
+    assert chrtrack.lmbases==bases1, ("Error: "+trackpath+" was made with"
+            +" bases="+`chrtrack.lmbases`+", not "+`bases1`)
+    return chrtrack
 
+def _loadlocations(lincpath1,mrnapath1,nonintpath1,configpath1):
+    """Return (mRNA locations, lincRNA locations, nonintergenic locations),
+    each in the format of the output of _collectlocations(), with overlapping
+    intervals merged. The lincRNAs are read from <lincpath1> and the mRNAs
+    from <mrnapath1>. The nonintergenic locations are loaded from
+    <nonintpath1>; if that file does not exist, it is first created with
+    notintergenic()."""
+    lincRNAslist=cPickle.load(open(lincpath1,'rb'))
+    linkLocations=_collectlocations(lincRNAslist)
+    for chromzome in linkLocations:
+        _clean_up_locations(chromzome) #If you don't clean up the
+        #locations, then you have overlapping intervals, and it's just
+        #cleaner to NOT have overlapping intervals
+    mRNAslist=GTFparser_general.sortSmallFeatsbychrom(
+        RefGene_parserII.returnRefGenelist(mrnapath1,["NM"]))
+    mrnaLocations=_collectlocations(mRNAslist)
+    for chromzome2 in mrnaLocations:
+        _clean_up_locations(chromzome2)
+    try: #similar setup for the nonintLocations file: create it if it
+        #doesn't exist
+       nonintLocations=cPickle.load(open(nonintpath1,'rb'))
+    except IOError as myerr2:
+        if "No such file or directory" in myerr2.strerror:
+            notintergenic(configpath1,nonintpath1)#name the file
+            #whatever is specified
+            #e.g. categorizeSNPs_NOTintergenic_locslist_<suffix>.bin
+            nonintLocations=cPickle.load(open(nonintpath1,'rb'))
+        else:
+            raise IOError
+    return mrnaLocations,linkLocations,nonintLocations
 
 def _ensure_dir(f):
     """Create directory <f> if it does not exist already.
@@ -384,7 +794,11 @@ def notintergenic(pathtoconfig,filename):
     everything in Gencode was used instead of just "genes"
     Note: "the default human gene set in the Ensembl browser is therefore also
     the current version of GENCODE." Which is why it's weird to me that
-    Hangauer mentions Gencode and Ensembl separately...?"""
+    Hangauer mentions Gencode and Ensembl separately...?
+    Note: each of the four sources is parsed only once; its intervals are
+    cached in a dir called "nonintergenic_cache" in the same directory as the
+    configuration file (see _cachednonintsets()), so when one source changes
+    (e.g. a newer Gencode release) only that source is parsed again."""
     confFile=open(pathtoconfig,'r')
     confFilepathaslist=pathtoconfig.rsplit("/") #should separator ever be "\\"?
     confFiledirpath="/".join(confFilepathaslist[:-1])
@@ -411,18 +825,113 @@ def notintergenic(pathtoconfig,filename):
             +" parsing the configuration file: \n\tmRNA path was "
             +`mRNApath`+"\n\tgencodepath was "+`gencodepath`
             +"\n\thang1path was "+`hang1path`+"\n\tpseudpath was "+`pseudpath`)
-    #Obtain all RefSeq NR and XR genes:
-    refseqz=RefGene_parserII.returnRefGenelist(mRNApath,["NR","XR"])
-    #Take everything from Gencode
-    gencodez=GTFparser_general.makeSmallfeatures_fromGTF(gencodepath,True,"ALL")
-    GTFparser_general.giveranger(gencodez)
-    #Use Hangauer's extended protein coding gene structures
     assert "19" in hang1path, ("Error: file name did not contain 19--"
                     +"use the Hangauer S1 file that's been converted to hg19!")
+    #Each source is parsed into a cached interval set (see
+    #_cachednonintsets()), so only sources that are new or have changed since
+    #the last time are parsed again
+    cachedir=os.path.join(confFiledirpath,"nonintergenic_cache")
+    _ensure_dir(cachedir)
+    #TO DO add in Ensembl
+    sourcesets=[
+        #RefSeq NR and XR genes
+        _cachednonintsets("refseqNRXR",mRNApath,cachedir,lambda:
+            RefGene_parserII.returnRefGenelist(mRNApath,["NR","XR"])),
+        #everything from Gencode
+        _cachednonintsets("gencode",gencodepath,cachedir,lambda:
+            _gencodefeatures(gencodepath)),
+        #Hangauer's extended protein coding gene structures
+        _cachednonintsets("hangauerS1",hang1path,cachedir,lambda:
+            _hangauerfeatures(hang1path,confFiledirpath
+                +"/h1fails_from_notintergenic_in_categorizeSNPs.txt")),
+        #Yale pseudogenes
+        _cachednonintsets("pseudogenes",pseudpath,cachedir,lambda:
+            PseudogeneParser.return_pseudogenes(pseudpath))]
+    #Now make simplest possible list of positions for each chromosome that
+    #covers all the necessary bases, from the cached sets of every source
+    locilist=[]
+    for chrmdex in range(24):
+        print "cleaning up the locations for chromosome "+`chrmdex+1`
+        locilist.append(intervalset.tolist(*intervalset.union(
+            numpy.concatenate([sets[chrmdex][0] for sets in sourcesets]),
+            numpy.concatenate([sets[chrmdex][1] for sets in sourcesets]))))
+    print "pickling the cleaned locations list"
+    cPickle.dump(locilist,open(filename,'wb'),2)
+    print "All Done :D"
+
+#Bump this whenever the way a nonintergenic source is turned into intervals
+#changes, so that the cached interval sets are made again
+_NONINTCACHE_VERSION=1
+
+def _cachednonintsets(sourcename,sourcepath,cachedir,featurefunction):
+    """Return a list of 24 clean interval sets (see intervalset.py), one per
+    chromosome, of the rangers of the SmallFeature objects returned by
+    <featurefunction>() for the nonintergenic source <sourcename> read from
+    <sourcepath>.
+    NOTES: the sets are saved in <cachedir> in a file named after
+    <sourcename> and the SHA-1 hash of the contents of <sourcepath>, and are
+    loaded from there instead of calling <featurefunction>() when the file
+    exists. The hash of each source file is stored in the index
+    "nonintergenic_cache_index.bin" in <cachedir> together with the file's
+    size and modification time, and is only calculated again when the size
+    or modification time have changed."""
+    indexpath=cachedir+"/nonintergenic_cache_index.bin"
+    if os.path.exists(indexpath):
+        index=cPickle.load(open(indexpath,'rb'))
+    else:
+        index={}
+    sourcestat=os.stat(sourcepath)
+    sourcekey=(sourcename,os.path.abspath(sourcepath))
+    if index.get(sourcekey,(None,None,None))[:2]==(sourcestat.st_size,
+                                                   sourcestat.st_mtime):
+        sourcehash=index[sourcekey][2]
+    else:
+        print "hashing "+sourcepath
+        sourcehash=_hashfile(sourcepath)
+        index[sourcekey]=(sourcestat.st_size,sourcestat.st_mtime,sourcehash)
+        cPickle.dump(index,open(indexpath+".tmp",'wb'),2)
+        os.rename(indexpath+".tmp",indexpath)
+    cachepath=(cachedir+"/"+sourcename+"_v"+`_NONINTCACHE_VERSION`+"_"
+               +sourcehash+".ivs")
+    if os.path.exists(cachepath):
+        print "using the cached "+sourcename+" intervals in "+cachepath
+        return intervalset.loadintervalsets(cachepath)
+    print "parsing "+sourcename+" from "+sourcepath
+    locilist=[[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],
+        [],[],[]]
+    for feat in featurefunction():
+        locilist[(feat.chromosome)-1].append(feat.ranger)
+    sets=[intervalset.union(*intervalset.fromlist(chromo))
+          for chromo in locilist]
+    intervalset.saveintervalsets(cachepath,sets)
+    return sets
+
+def _hashfile(path):
+    """Return the hex SHA-1 hash of the contents of the file at <path>."""
+    hasher=hashlib.sha1()
+    infile=open(path,'rb')
+    while True:
+        chunk=infile.read(1<<20)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    infile.close()
+    return hasher.hexdigest()
+
+def _gencodefeatures(gencodepath):
+    """Return a list of SmallFeature objects with rangers for everything in
+    the Gencode GTF at <gencodepath>."""
+    gencodez=GTFparser_general.makeSmallfeatures_fromGTF(gencodepath,True,"ALL")
+    GTFparser_general.giveranger(gencodez)
+    return gencodez
+
+def _hangauerfeatures(hang1path,h1failspath):
+    """Return a list of SmallFeature objects for the regions in the Hangauer
+    S1 file at <hang1path>. Lines that can't be parsed are written to the
+    file <h1failspath>."""
     h1file=open(hang1path,'r')
     h1list=[]
-    h1fails=open(confFiledirpath
-                 +"/h1fails_from_notintergenic_in_categorizeSNPs.txt",'w')
+    h1fails=open(h1failspath,'w')
     for line in h1file:
         try:
             lineaslist=line.rsplit("\t")
@@ -436,24 +945,8 @@ def notintergenic(pathtoconfig,filename):
             #casting to an int would fail, so the line would not contribute to
             #the "nonintergenic" regions and would get written to h1fails file
     h1fails.close()
-    #Get Yale pseudogenes
-    pseuds=PseudogeneParser.return_pseudogenes(pseudpath)
-    #Extract the locations from all, and make unified location list by chrom
-    allfeats=refseqz+gencodez+h1list+pseuds #TO DO add in Ensembl
-    locilist=[[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],
-        [],[],[]]
-    for feat in allfeats:
-        locilist[(feat.chromosome)-1].append(feat.ranger)
-    #Now make simplest possible list of positions for each chromosome that
-    #covers all the necessary bases
-    chrcounter=1
-    for chromo in locilist:
-        print "cleaning up the locations for chromosome "+`chrcounter`
-        _clean_up_locations(chromo)
-        chrcounter+=1
-    print "pickling the cleaned locations list"
-    cPickle.dump(locilist,open(filename,'wb'),2)
-    print "All Done :D"
+    h1file.close()
+    return h1list
 
 def stripnewlineEnd(word):
     """Strip away annoying newlines to help in parsing the configuration file"""
@@ -470,57 +963,21 @@ def _clean_up_locations(localist):
     locations that cover exactly the same regions of the genome.
     localist is a two-dimensional list e.g. [[12,34],[45,62],30,70]] where each
     sub-list has two members, a start and a stop position.
-    A function called _clean_up_locus_locations() in definelincs.py has exactly
-    the same logic as this function and passed testing by
-    definelincs_test.test9()"""
-    pos1=0
-    pos2=1
-    while pos1<len(localist)-1 and pos2<len(localist):
-        locusA=localist[pos1]
-        locusB=localist[pos2]
-        startA=locusA[0]; stopA=locusA[1]
-        startB=locusB[0]; stopB=locusB[1]
-        if startA <= startB <= stopA:
-            if stopB >= stopA: #loci offset from each other
-                locusB[0]=startA
-                localist.remove(locusA)
-                pos2=pos1+1
-            else: #locusB is "engulfed by" locusA
-                assert stopB <= stopA
-                locusB[0]=startA
-                locusB[1]=stopA
-                localist.remove(locusA)
-                pos2=pos1+1
-        elif startB <= startA <= stopB:
-            if stopB >= stopA: #locusA is "engulfed by" locusB
-                localist.remove(locusA)
-                pos2=pos1+1
-            else: #loci offset from each other
-                assert stopB <=stopA
-                locusB[1]=locusA[1]
-                localist.remove(locusA)
-                pos2=pos1+1
-        else:#They don't overlap and were not combined
-            #ChangePositionAfterNoCombo
-            length=len(localist)
-            if pos2 < length-1 and pos1 < length-2:
-                pos2=pos2+1
-            elif pos2==length-1 and pos1<length-2:
-                pos1=pos1+1
-                pos2=pos1+1
-            else:
-                assert pos2==length-1 and pos1==length-2, ("ERROR: "
-                        +"pos2 is actually "+`pos2`+" and pos1 is "+`pos1`)
-                pos1=length #stop the while loop
-    localist.sort(key=lambda x: x[0]) #sort the loci by start position
+    The merge is done by intervalset.union(), which is also used by
+    _clean_up_exon_locations() in definelincs.py."""
+    localist[:]=intervalset.tolist(*intervalset.union(
+                                        *intervalset.fromlist(localist)))
     #Note: this function does not return the localist; it modifies the
-    #localist in place
+    #localist in place. The loci come out sorted by start position
 
 if __name__=='__main__':
     confpath=sys.argv[1]
     conffile=open(confpath,'r')
     myGWASstudies=[]; mylincpath=""; mymrnapath=""; mybases=-1
     mynonintpath=""; myuserealsizes=""; myoutputlocation=""
+    mybackend="array"; myworkers=1; myworkermemory=0; mypacked=False
+    mybatch=False; mysweep=[]; mypermutations=0; myseed=0
+    mysummary=False; mythresholds=pvalsummary.SUMMARY_THRESHOLDS
     for line in conffile:
         if line[0]!="#":
             lineaslist=line.rsplit(" ")
@@ -544,6 +1001,28 @@ if __name__=='__main__':
                     raise stupiderror(Exception)
             elif lineaslist[0]=="outputlocation:":
                 myoutputlocation=stripnewlineEnd(lineaslist[1])
+            elif lineaslist[0]=="backend:":
+                mybackend=stripnewlineEnd(lineaslist[1])
+            elif lineaslist[0]=="workers:":
+                myworkers=int(stripnewlineEnd(lineaslist[1]))
+            elif lineaslist[0]=="workermemory:":
+                myworkermemory=int(stripnewlineEnd(lineaslist[1]))
+            elif lineaslist[0]=="packed:":
+                mypacked=(stripnewlineEnd(lineaslist[1])=="True")
+            elif lineaslist[0]=="batch:":
+                mybatch=(stripnewlineEnd(lineaslist[1])=="True")
+            elif lineaslist[0]=="sweep:":
+                mysweep=[int(x) for x
+                         in stripnewlineEnd(lineaslist[1]).split(",")]
+            elif lineaslist[0]=="permutations:":
+                mypermutations=int(stripnewlineEnd(lineaslist[1]))
+            elif lineaslist[0]=="seed:":
+                myseed=int(stripnewlineEnd(lineaslist[1]))
+            elif lineaslist[0]=="summary:":
+                mysummary=(stripnewlineEnd(lineaslist[1])=="True")
+            elif lineaslist[0]=="summarythresholds:":
+                mythresholds=[float(x) for x
+                              in stripnewlineEnd(lineaslist[1]).split(",")]
             else:
                 pass
     if (myGWASstudies==[] or mylincpath=="" or mymrnapath=="" or mybases==-1 or
@@ -559,9 +1038,32 @@ if __name__=='__main__':
     assert type(mybases) is int and 0<=mybases<=20000, ("Error:"
             +" mybases must be an int, and 0 <= mybases <= 20000. "
             +"You chose mybases="+`mybases`)
+    if mysweep!=[]:
+        print "counting categories for bases "+`mysweep`
+        sweepbases(myGWASstudies,mylincpath,mymrnapath,mynonintpath,confpath,
+                   mysweep,myoutputlocation)
+        print "done counting categories"
+        sys.exit(0)
+    if mybackend in ["array","track"] or "--build" in sys.argv[2:]:
+        buildchromarrays(mybases,mylincpath,mymrnapath,mynonintpath,confpath,
+                         myuserealsizes,mybackend=="track",mypacked,
+                         myworkers,myworkermemory)
+    if "--build" in sys.argv[2:]:
+        print "done creating chromosome arrays"
+        sys.exit(0)
+    if mybatch:
+        print ("running outputpvals_batch for "+`len(myGWASstudies)`
+               +" GWASs with extbases "+`mybases`)
+        outputpvals_batch(myGWASstudies,mylincpath,mymrnapath,mynonintpath,
+                          mybases,confpath,myuserealsizes,myoutputlocation,
+                          mybackend,mypermutations,myseed,myworkers,
+                          mysummary,mythresholds)
+        print "done running outputpvals_batch"
+        sys.exit(0)
     for myGWASpath in myGWASstudies:
         print "running outputpvals for "+myGWASpath+" with extbases "+`mybases`
         outputpvals(myGWASpath,mylincpath,mymrnapath,mynonintpath,mybases,
-                    confpath,myuserealsizes,myoutputlocation)
+                    confpath,myuserealsizes,myoutputlocation,mybackend,
+                    mypermutations,myseed,myworkers,mysummary,mythresholds)
         print "done running outputpvals"
 
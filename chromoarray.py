@@ -13,15 +13,52 @@ All coordinates that are dealt with in this module are one-based inclusive
 start, one-based inclusive stop. See document
 "11-18-13_figuring_out_coordinate_systems.docx" for more information.
 The module uses arrays only, which takes less memory than an implementation
-that uses lists as intermediates."""
+that uses lists as intermediates. While an array is being built it is a numpy
+array of uint8 character codes, so that each interval can be classified with
+one slice operation instead of one dictionary lookup per base.
+Each finished array is saved as a raw file: a fixed-size header (see
+CHROMARRAY_HEADER) followed by one char per base. The files are read with
+ChromArray, which memory-maps them, so looking up a base only reads the page
+it is on and several processes can share one cached copy of the file.
+A chromosome can also be saved as a run-length-encoded track file (see
+CategoryTrack and CHROMTRACK_HEADER), which only stores where the category
+changes and is a few hundred times smaller than the array."""
 
-import cPickle
 import array
+import bisect
+import mmap
+import multiprocessing
+import os
+import resource
+import struct
+
+import numpy
+
+#Header of a saved chromosome array: magic string, encoding version,
+#chromosome number, chromosome size in bases, lmbases, and a reserved field.
+#Encoding version 1 is one char per base, the chars being those listed in
+#the module docstring. Encoding version 2 is three bits per base (see
+#packcodes()), the value of each base being the index of its char in
+#CATEGORY_CHARS.
+CHROMARRAY_MAGIC="CHRARRAY"
+CHROMARRAY_HEADER="<8sIIQII"
+CHROMARRAY_ENCODING=1
+CHROMARRAY_PACKED=2
+CATEGORY_CHARS="imlbn"
+
+#Header of a saved CategoryTrack: magic string, encoding version, chromosome
+#number, chromosome size in bases, lmbases, a reserved field, and the number
+#of runs. It is followed by the run starts as little-endian uint32 and then
+#by the run category chars.
+CHROMTRACK_MAGIC="CHRTRACK"
+CHROMTRACK_HEADER="<8sIIQIIQ"
+CHROMTRACK_ENCODING=1
 
 def create_22chrom_arrays(mRNAlocslist,linclocslist,nonintlocslist,lmbases,
                           whichchroms=[1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,
                                        17,18,19,20,21,22],
-                          userealsizes=True,dirtosavein=""):
+                          userealsizes=True,dirtosavein="",astracks=False,
+                          packed=False,workers=1,workermemory=0):
     """Create an array for each autosome specifying the classification of each
     base in that chromosome.
     
@@ -55,12 +92,87 @@ def create_22chrom_arrays(mRNAlocslist,linclocslist,nonintlocslist,lmbases,
     <dirtosavein> is a string specifying which directory to save in. It will
         be attached to the beginning of the file name so that the chromosome
         arrays will be saved inside that dir.
+    <astracks> is a bool. If True, a CategoryTrack is saved for each
+        chromosome instead of an array (see makechromtrack()).
+    <packed> is a bool. If True, the arrays are saved with three bits per
+        base instead of one char per base (see packcodes()).
+    <workers> is an int >= 1, the number of processes that make chromosomes
+        at the same time. If it is more than 1, the chromosomes are made in a
+        multiprocessing Pool, largest first.
+    <workermemory> is an int >= 0. If it is more than 0, the address space
+        of each worker process is limited to <workermemory> megabytes, so
+        that a worker that would need more fails with a MemoryError instead
+        of pushing the machine into swap. A worker starts as a copy of this
+        process, so the limit must also cover the interval lists and about
+        70 megabytes for Python and numpy. The array for chr1 takes about 250
+        megabytes, so making chr1 needs a limit of about 350 megabytes, or
+        about 550 if <packed> is True (the packed copy and the blocks used to
+        make it are held at the same time as the array).
+    
+    Every file is written under a temporary name and then renamed, so a file
+    that is interrupted part-way is never mistaken for a finished one.
     
     Output: The array for each chromosome will be saved under the filename
-    'chromosome#_ext<lmbases>_array.bin'
+    'chromosome#_ext<lmbases>_array.raw' (see chromarraypath()), or the track
+    under the filename 'chromosome#_ext<lmbases>_track.rle' (see
+    chromtrackpath())
     """
     assert type(whichchroms) is list, ("Error: "
                     +"whichchroms must be a list, not "+`type(whichchroms)`)
+    chrsizedict=chromsizes(userealsizes)
+    assert type(workers) is int and workers>=1, ("Error: "
+                    +"workers must be an int >= 1, not "+`workers`)
+    if dirtosavein != "":
+        dirtosavein=dirtosavein+"/"
+    jobs=[]
+    for number in whichchroms:
+        chromdex=number-1
+        jobs.append((astracks,dirtosavein+"chromosome"+`number`,
+                     chrsizedict["chr"+`number`],mRNAlocslist[chromdex],
+                     linclocslist[chromdex],nonintlocslist[chromdex],lmbases,
+                     number,packed))
+    if workers==1 or len(jobs)<2:
+        for job in jobs:
+            _makechromjob(job)
+    else:
+        jobs.sort(key=lambda job: -job[2]) #largest chromosomes first
+        pool=multiprocessing.Pool(min(workers,len(jobs)),_limitmemory,
+                                  (workermemory,))
+        try:
+            pool.map(_makechromjob,jobs,1)
+        finally:
+            pool.close()
+            pool.join()
+
+def _makechromjob(job):
+    """Make one chromosome for create_22chrom_arrays(). <job> is a tuple:
+    (astracks, arraynameprefix, chromsize, mRNAlist, lincRNAlist, nonlist,
+    lmbases, chromnumber, packed)"""
+    (astracks,prefix,chromsize,mRNAlist,lincRNAlist,nonlist,lmbases,
+     chromnumber,packed)=job
+    if astracks:
+        makechromtrack(prefix,chromsize,mRNAlist,lincRNAlist,nonlist,lmbases,
+                       chromnumber)
+    else:
+        makechromarray(prefix,chromsize,mRNAlist,lincRNAlist,nonlist,lmbases,
+                       chromnumber,packed)
+
+def _limitmemory(megabytes):
+    """Limit the address space of the current process to <megabytes>
+    megabytes, or do nothing if <megabytes> is 0. This is the initializer
+    of the worker processes in create_22chrom_arrays()."""
+    if megabytes>0:
+        soft,hard=resource.getrlimit(resource.RLIMIT_AS)
+        limit=megabytes*1024*1024
+        if hard!=resource.RLIM_INFINITY:
+            limit=min(limit,hard)
+        resource.setrlimit(resource.RLIMIT_AS,(limit,hard))
+
+def chromsizes(userealsizes=True):
+    """Return a dictionary with keys "chr1" to "chr22" and values that are the
+    sizes of the autosomes in bases. If <userealsizes> is False, fake
+    chromosome sizes of 300 are used (this is for testing purposes.) See
+    create_22chrom_arrays()"""
     if userealsizes:
         chrsizedict={"chr1":249250621,"chr2":243199373,"chr3":198022430,
                 "chr4":191154276,"chr5":180915260,"chr6":171115067,
@@ -77,25 +189,15 @@ def create_22chrom_arrays(mRNAlocslist,linclocslist,nonintlocslist,lmbases,
                      "chr13":300,"chr14":300,"chr15":300,"chr16":300,
                      "chr17":300,"chr18":300,"chr19":300,"chr20":300,
                      "chr21":300,"chr22":300}
-    whichchromdexes=[]
-    for number in whichchroms:
-        whichchromdexes.append(number-1)
-    for chromdex in whichchromdexes: #CHANGE THIS TO "IN RANGE 1" FOR TESTING
-        chromnumber=chromdex+1 #add one since the output of range() starts at 0
-        chromosize=chrsizedict["chr"+`chromnumber`]
-        if dirtosavein != "":
-            dirtosavein=dirtosavein+"/"
-        makechromarray(dirtosavein+"chromosome"+`chromnumber`,chromosize,
-                       mRNAlocslist[chromdex],linclocslist[chromdex],
-                       nonintlocslist[chromdex],lmbases)
+    return chrsizedict
 
 
 def makechromarray(arraynameprefix,chromsize,mRNAlist,lincRNAlist,nonlist,
-                   lmbases):
-    """Save an array of chars for the specified chromosome using cPickle.
-    First create a list of chars. Then modify element of the list appropriately
-    to correctly classify the base. Finally an array is created from the list
-    and saved using cPickle.
+                   lmbases,chromnumber=0,packed=False):
+    """Save an array of chars for the specified chromosome as a raw file.
+    First create a numpy array of char codes, all "i". Then modify the codes
+    appropriately to correctly classify each base. Finally the codes are
+    saved with savechromarray().
     
     Preconditions:
     <arraynameprefix> is a string that will become the beginning of the filename
@@ -110,9 +212,13 @@ def makechromarray(arraynameprefix,chromsize,mRNAlist,lincRNAlist,nonlist,
         See NOTE_74356 for info about the "both" classification
     <lmbases> is an int >= 0 that specifies the number of bases by which you
         want to expand lincRNAs and mRNAs in either direction.
+    <chromnumber> is the number of the chromosome, which is recorded in the
+        header of the file. It is 0 if not given.
+    <packed> is a bool. If True, the array is saved with three bits per base
+        (see packcodes()).
     
     Output: The array of chars will be saved under the file name
-    '<arraynameprefix>_ext<lmbases>_array.bin'"""
+    '<arraynameprefix>_ext<lmbases>_array.raw'"""
     #Checks before doing stuff:
     assert type(arraynameprefix) is str,("Error: "
         +"arraynameprefix must be a string, not "+str(type(arraynameprefix)))
@@ -130,10 +236,8 @@ def makechromarray(arraynameprefix,chromsize,mRNAlist,lincRNAlist,nonlist,
         if not(interval[0]):
             raise MyZeroStartError
     #Doing stuff:
-    chromarray=array.array('c','') #initialize empty array
-    for number in xrange(chromsize): #if you use range instead of xrange you
-        #consume immense amounts of memory.
-        chromarray.append("i")
+    chromarray=numpy.empty(chromsize,dtype=numpy.uint8)
+    chromarray.fill(ord("i"))
     assignletter(chromarray,mRNAlist,{"i":"m","m":"m"},lmbases) #NOTE_2309
     assignletter(chromarray,lincRNAlist,{"i":"l","m":"b","l":"l","b":"b"},lmbases)
     assignletter(chromarray,nonlist,{"i":"n","m":"m","b":"b","l":"l","n":"n"},0)
@@ -141,7 +245,8 @@ def makechromarray(arraynameprefix,chromsize,mRNAlist,lincRNAlist,nonlist,
     #(lincs stay linc, mRNAs stay mRNA, etc., because
     #lincs and mRNAs are actually subsets of "nonintergenic" and we don't
     #want to classify everything as nonintergenic)
-    cPickle.dump(chromarray,open(arraynameprefix+"_ext"+`lmbases`+"_array.bin",'wb'),2)
+    savechromarray(chromarraypath(arraynameprefix,lmbases),chromarray,
+                   chromnumber,lmbases,packed)
     print "Done with makechromarray() for "+arraynameprefix
 
 
@@ -150,7 +255,7 @@ def assignletter(bigarray,intervallist,letterdict,basez):
     appropriate intervals in <bigarray>.
     This is a helper function for makechromarray()
     Arguments:
-    <bigarray> is an array of chars
+    <bigarray> is an array of chars, or a numpy uint8 array of char codes
     <intervallist> is a two-dimensional list of intervals as described in
     makechromarray() above The intervallist must not specify any interval
     endpoint that is greater than the length of bigarray.
@@ -168,22 +273,491 @@ def assignletter(bigarray,intervallist,letterdict,basez):
     <basez> is an int >= 0, the number of bases by which the intervals in the
     intervallist will be expanded in each direction (<basez> will be subtracted
     from the start of the interval and will be added to the end of the
-    interval.)"""
+    interval.)
+    Each interval is changed with one slice operation through a 256-entry
+    translation table made from <letterdict>. If an expanded interval goes
+    past the end of <bigarray>, the part inside <bigarray> is changed and
+    the remaining intervals are skipped (NOTE_5565); with <basez> equal to 0
+    an IndexError is raised instead. A KeyError is raised if a char in an
+    interval is not a key of <letterdict>."""
     #THIS IS TRICKY YOU HAVE TO PRETEND THAT LISTS ARE NUMBERED STARTING AT ONE!
     #SO THE ZEROTH POSITION OF THE BIGARRAY IS SPECIFIED BY THE NUMBER 1
     #IN AN INTERVAL
-    assert type(bigarray) is array.array and len(bigarray)>0, ("Error:"
+    assert (type(bigarray) in [array.array,numpy.ndarray]
+            and len(bigarray)>0), ("Error:"
                                 +" bigarray must be an array of length > 0")
     assert type(basez) is int and basez >= 0, ("Error: "
         +"basez must be an int >= 0, not "+`basez`)
+    if type(bigarray) is array.array:
+        codes=numpy.frombuffer(bigarray,dtype=numpy.uint8) #shares memory
+    else:
+        codes=bigarray
+    table,valid=_translationtable(letterdict)
     for interval in intervallist:
-        for index in xrange(interval[1]-interval[0]+1+(2*basez)): #NOTE_5563
-            pos=max(interval[0]+index-1-basez,0) #NOTE_5564
-            if basez>0 and pos > len(bigarray)-1: #NOTE_5565
+        low=interval[0]-1-basez #NOTE_5563
+        high=interval[1]-1+basez
+        if low<0: #NOTE_5564: every position before the start of bigarray
+            #counts as position 0, so position 0 is changed once for each
+            for repeat in xrange(-low):
+                _translate(codes,0,0,table,valid)
+            low=0
+        if high > len(codes)-1: #NOTE_5565
+            _translate(codes,low,len(codes)-1,table,valid)
+            if basez>0:
                 return
-            charr=bigarray[pos]
-            #modify bigarray according to letterdict:
-            bigarray[pos]=letterdict[charr] 
+            raise IndexError, "array index out of range"
+        #modify bigarray according to letterdict:
+        _translate(codes,low,high,table,valid)
+
+def _translationtable(letterdict):
+    """Return (table,valid) for the dictionary of chars <letterdict>, where
+    table is a numpy array of 256 char codes such that table[ord(key)] is
+    ord(letterdict[key]) and valid is a numpy array of 256 bools that are
+    True for the codes of the keys. Codes that are not keys map to themselves
+    in table."""
+    table=numpy.arange(256,dtype=numpy.uint8)
+    valid=numpy.zeros(256,dtype=numpy.bool_)
+    for key in letterdict:
+        table[ord(key)]=ord(letterdict[key])
+        valid[ord(key)]=True
+    return table,valid
+
+def _translate(codes,low,high,table,valid):
+    """Replace each code in codes[low:high+1] (zero-based, inclusive) with its
+    value in <table>. See _translationtable()"""
+    if low > high:
+        return
+    segment=codes[low:high+1]
+    if not valid[segment].all():
+        raise KeyError, chr(segment[numpy.argmin(valid[segment])])
+    codes[low:high+1]=table[segment]
+
+def chromarraypath(arraynameprefix,lmbases):
+    """Return the path of the raw file for the array with <arraynameprefix>
+    (e.g. "chromosome14") and <lmbases>."""
+    return arraynameprefix+"_ext"+`lmbases`+"_array.raw"
+
+def savechromarray(path,chromarray,chromnumber,lmbases,packed=False):
+    """Save <chromarray> to a raw file at <path>: the header described by
+    CHROMARRAY_HEADER followed by the chars of <chromarray>, or by the chars
+    packed into three bits each with packcodes() if <packed> is True.
+    <chromarray> is an array of chars or a numpy uint8 array of char codes,
+    e.g. an array made by makechromarray() or the contents of one of the
+    cPickled 'chromosome#_ext<lmbases>_array.bin' files made by earlier
+    versions of this module. The file is written under a temporary name and
+    then renamed, so a partly written file is never left at <path>."""
+    if type(chromarray) is array.array:
+        codes=numpy.frombuffer(chromarray,dtype=numpy.uint8)
+    else:
+        codes=numpy.asarray(chromarray,dtype=numpy.uint8)
+    if packed:
+        encoding=CHROMARRAY_PACKED
+        data=packcodes(codes)
+    else:
+        encoding=CHROMARRAY_ENCODING
+        data=codes
+    outfile=open(path+".tmp",'wb')
+    outfile.write(struct.pack(CHROMARRAY_HEADER,CHROMARRAY_MAGIC,
+                  encoding,chromnumber,len(codes),lmbases,0))
+    outfile.flush()
+    data.tofile(outfile) #written straight from the array, without a copy
+    outfile.close()
+    os.rename(path+".tmp",path)
+
+def packcodes(codes):
+    """Return a numpy uint8 array with the char codes in the numpy uint8
+    array <codes> packed into three bits each, most significant bit first, so
+    that every eight bases take three bytes. The value of a base is the index
+    of its char in CATEGORY_CHARS. A ValueError is raised for a char that is
+    not in CATEGORY_CHARS. The work is done in blocks of _PACKBLOCK bases to
+    limit the memory used for the bits."""
+    packed=numpy.zeros((3*len(codes)+7)//8,dtype=numpy.uint8)
+    for low in xrange(0,len(codes),_PACKBLOCK):
+        values=_CHARVALUES[codes[low:low+_PACKBLOCK]]
+        if (values>7).any():
+            raise ValueError, ("Error: "+`chr(codes[low+numpy.argmax(values)])`
+                               +" is not one of "+`CATEGORY_CHARS`)
+        bits=numpy.unpackbits(values.reshape(-1,1),axis=1)[:,5:].ravel()
+        packedbytes=numpy.packbits(bits)
+        packed[low*3//8:low*3//8+len(packedbytes)]=packedbytes
+    return packed
+
+def unpackcodes(packed,size):
+    """Return a numpy uint8 array of the <size> char codes packed by
+    packcodes() into the numpy uint8 array <packed>."""
+    codes=numpy.empty(size,dtype=numpy.uint8)
+    for low in xrange(0,size,_PACKBLOCK):
+        high=min(size,low+_PACKBLOCK)
+        bits=numpy.unpackbits(packed[low*3//8:(high*3+7)//8])
+        bits=bits[:3*(high-low)].reshape(-1,3)
+        codes[low:high]=_VALUECHARS[(bits[:,0]<<2)|(bits[:,1]<<1)|bits[:,2]]
+    return codes
+
+_PACKBLOCK=1<<23 #a multiple of 8, so that each block starts on a byte
+_CHARVALUES=numpy.empty(256,dtype=numpy.uint8) #char code -> 3-bit value
+_CHARVALUES.fill(255)
+_VALUECHARS=numpy.zeros(8,dtype=numpy.uint8) #3-bit value -> char code
+for _value in xrange(len(CATEGORY_CHARS)):
+    _CHARVALUES[ord(CATEGORY_CHARS[_value])]=_value
+    _VALUECHARS[_value]=ord(CATEGORY_CHARS[_value])
+
+#===============================================================================
+#----------ChromArray CLASS-----------------------------------------------------
+#===============================================================================
+class ChromArray(object):
+    """A ChromArray is a read-only, memory-mapped chromosome array saved by
+    savechromarray(). Indexing it works like indexing the array of chars:
+    chromarray[pos-1] is the category char of base <pos>.
+    The header fields are available as the attributes chromosome, size,
+    lmbases and encoding. Both encodings (one char per base, or three bits
+    per base) are read."""
+    
+    def __init__(self,path):
+        self.path=path
+        self._file=open(path,'rb')
+        self._map=mmap.mmap(self._file.fileno(),0,access=mmap.ACCESS_READ)
+        self._offset=struct.calcsize(CHROMARRAY_HEADER)
+        (magic,self.encoding,self.chromosome,self.size,self.lmbases,
+         reserved)=struct.unpack(CHROMARRAY_HEADER,self._map[:self._offset])
+        assert magic==CHROMARRAY_MAGIC, ("Error: "+path
+                                         +" is not a chromosome array file")
+        assert self.encoding in [CHROMARRAY_ENCODING,CHROMARRAY_PACKED], (
+                    "Error: "+path+" has unknown encoding version "
+                    +`self.encoding`)
+        if self.encoding==CHROMARRAY_PACKED:
+            self._datasize=(3*self.size+7)//8
+        else:
+            self._datasize=self.size
+        assert len(self._map)==self._offset+self._datasize, ("Error: "+path
+                    +" should hold "+`self._datasize`+" bytes of bases but"
+                    +" holds "+`len(self._map)-self._offset`)
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self,index):
+        if index<0: #negative indices count from the end, as for an array
+            index+=self.size
+        if not 0<=index<self.size:
+            raise IndexError, "array index out of range"
+        if self.encoding==CHROMARRAY_ENCODING:
+            return self._map[self._offset+index]
+        bit=3*index
+        byte=self._offset+(bit>>3)
+        twobytes=ord(self._map[byte])<<8
+        if byte+1<len(self._map):
+            twobytes|=ord(self._map[byte+1])
+        return CATEGORY_CHARS[(twobytes>>(13-(bit&7)))&7]
+    
+    def get(self,pos):
+        """Return the category char of the base at one-based position <pos>,
+        i.e. self[pos-1]."""
+        return self[pos-1]
+    
+    def lookup(self,indices):
+        """Return a numpy uint8 array of the char codes at the zero-based
+        <indices> (a numpy integer array), i.e. ord(self[index]) for each
+        index, with the same handling of negative and out-of-range indices
+        as indexing."""
+        indices=_checkindices(indices,self.size)
+        data=numpy.frombuffer(self._map,dtype=numpy.uint8,
+                              count=self._datasize,offset=self._offset)
+        if self.encoding==CHROMARRAY_ENCODING:
+            return data[indices]
+        bits=3*indices
+        bytedexes=bits>>3
+        twobytes=data[bytedexes].astype(numpy.uint16)<<8
+        twobytes|=data[numpy.minimum(bytedexes+1,self._datasize-1)]
+        return _VALUECHARS[(twobytes>>(13-(bits&7)))&7]
+    
+    def codes(self):
+        """Return a read-only numpy uint8 array of the char codes. For one
+        char per base it shares memory with the file; for three bits per base
+        it is unpacked into memory."""
+        data=numpy.frombuffer(self._map,dtype=numpy.uint8,
+                              count=self._datasize,offset=self._offset)
+        if self.encoding==CHROMARRAY_PACKED:
+            return unpackcodes(data,self.size)
+        return data
+    
+    def tostring(self):
+        """Return all of the chars as one string."""
+        if self.encoding==CHROMARRAY_PACKED:
+            return self.codes().tostring()
+        return self._map[self._offset:]
+    
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+#===============================================================================
+#----------CategoryTrack CLASS--------------------------------------------------
+#===============================================================================
+class CategoryTrack(object):
+    """A CategoryTrack gives the same category char for each base as a
+    chromosome array, but stores only the places where the category changes:
+    <starts> is an array of the zero-based positions where each run of one
+    category begins (starts[0] is 0) and <codes> is an array of chars with the
+    category of each run. <size> is the size of the chromosome in bases.
+    Indexing it works like indexing the array of chars: track[pos-1] is the
+    category char of base <pos>, found by bisecting <starts>."""
+    
+    def __init__(self,starts,codes,size):
+        assert len(starts)==len(codes) and len(starts)>0 and starts[0]==0, (
+            "Error: starts and codes must have the same length > 0 and"
+            +" starts must begin with 0")
+        self.starts=starts
+        self.codes=codes
+        self.size=size
+        self.chromosome=0 #the following are set by loadcategorytrack()
+        self.lmbases=0
+        self.encoding=CHROMTRACK_ENCODING
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self,index):
+        if index<0: #negative indices count from the end, as for an array
+            index+=self.size
+        if not 0<=index<self.size:
+            raise IndexError, "array index out of range"
+        return self.codes[bisect.bisect_right(self.starts,index)-1]
+    
+    def lookup(self,indices):
+        """Return a numpy uint8 array of the char codes at the zero-based
+        <indices> (a numpy integer array), as for ChromArray.lookup()."""
+        indices=_checkindices(indices,self.size)
+        runs=numpy.searchsorted(numpy.asarray(self.starts),indices,
+                                side='right')-1
+        return numpy.frombuffer(self.codes.tostring(),dtype=numpy.uint8)[runs]
+    
+    def tostring(self):
+        """Return the chars of every base as one string, i.e. the contents
+        of the equivalent chromosome array."""
+        ends=list(self.starts[1:])+[self.size]
+        return "".join(self.codes[run]*(ends[run]-self.starts[run])
+                       for run in xrange(len(self.starts)))
+
+def _checkindices(indices,size):
+    """Return the numpy integer array <indices> with negative indices
+    counted from the end of an array of <size> elements, raising an
+    IndexError if any index is out of range (as indexing an array would)."""
+    indices=numpy.asarray(indices,dtype=numpy.int64)
+    if len(indices)>0 and (indices.min()<-size or indices.max()>=size):
+        raise IndexError, "array index out of range"
+    return numpy.where(indices<0,indices+size,indices)
+
+def makecategorytrack(chromsize,mRNAlist,lincRNAlist,nonlist,lmbases):
+    """Return a CategoryTrack that classifies the bases of a chromosome
+    exactly as the array made by makechromarray() with the same arguments
+    would, without making a char for each base.
+    The arguments are as for makechromarray(). Each of the three interval
+    lists is turned into sorted, merged runs of covered bases (see
+    _coveredruns()), and then the runs are swept together: a base is "b" if
+    it is covered by mRNA and lincRNA runs, "m" or "l" if it is covered by
+    only one of them, "n" if it is covered only by nonintergenic runs, and
+    "i" otherwise. This is what the three assignletter() calls in
+    makechromarray() do, since every letterdict there gives the same result
+    when it is applied more than once."""
+    assert type(chromsize) is int and chromsize>0, ("Error:"
+        +" chromsize must be an int>0, not "+str(chromsize))
+    for intervallist in [mRNAlist,lincRNAlist,nonlist]:
+        for interval in intervallist:
+            if not(interval[0]):
+                raise MyZeroStartError
+    covers=[_coveredruns(mRNAlist,lmbases,chromsize),
+            _coveredruns(lincRNAlist,lmbases,chromsize),
+            _coveredruns(nonlist,0,chromsize)]
+    points=set([0])
+    for cover in covers:
+        for run in cover:
+            points.add(run[0])
+            if run[1]<chromsize:
+                points.add(run[1])
+    starts=array.array('l')
+    codes=array.array('c')
+    nexts=[0,0,0] #index of the next run in each cover that may contain a point
+    for point in sorted(points):
+        inside=[]
+        for which in xrange(3):
+            cover=covers[which]
+            while nexts[which]<len(cover) and cover[nexts[which]][1]<=point:
+                nexts[which]+=1
+            inside.append(nexts[which]<len(cover)
+                          and cover[nexts[which]][0]<=point)
+        if inside[0] and inside[1]:
+            code="b"
+        elif inside[0]:
+            code="m"
+        elif inside[1]:
+            code="l"
+        elif inside[2]:
+            code="n"
+        else:
+            code="i"
+        if len(codes)==0 or codes[-1]!=code:
+            starts.append(point)
+            codes.append(code)
+    return CategoryTrack(starts,codes,chromsize)
+
+def makechromtrack(arraynameprefix,chromsize,mRNAlist,lincRNAlist,nonlist,
+                   lmbases,chromnumber=0):
+    """Save a CategoryTrack for the specified chromosome, made with
+    makecategorytrack(), under the file name
+    '<arraynameprefix>_ext<lmbases>_track.rle'. The arguments are the same
+    as for makechromarray()."""
+    track=makecategorytrack(chromsize,mRNAlist,lincRNAlist,nonlist,lmbases)
+    savecategorytrack(chromtrackpath(arraynameprefix,lmbases),track,
+                      chromnumber,lmbases)
+    print "Done with makechromtrack() for "+arraynameprefix
+
+def trackfromarray(chromarray):
+    """Return a CategoryTrack with the same category for every base as
+    <chromarray>, which is a ChromArray, an array of chars, or a numpy uint8
+    array of char codes (e.g. to convert arrays that were already made)."""
+    if type(chromarray) is ChromArray:
+        codes=chromarray.codes()
+    elif type(chromarray) is array.array:
+        codes=numpy.frombuffer(chromarray,dtype=numpy.uint8)
+    else:
+        codes=chromarray
+    changes=numpy.flatnonzero(codes[1:]!=codes[:-1])+1
+    starts=array.array('l',[0])
+    starts.extend(changes.tolist())
+    runcodes=array.array('c',codes[starts].tostring())
+    return CategoryTrack(starts,runcodes,len(codes))
+
+def chromtrackpath(arraynameprefix,lmbases):
+    """Return the path of the track file for the chromosome with
+    <arraynameprefix> (e.g. "chromosome14") and <lmbases>."""
+    return arraynameprefix+"_ext"+`lmbases`+"_track.rle"
+
+def savecategorytrack(path,track,chromnumber,lmbases):
+    """Save the CategoryTrack <track> to a file at <path>: the header
+    described by CHROMTRACK_HEADER followed by the run starts and the run
+    codes. The file is written under a temporary name and then renamed."""
+    outfile=open(path+".tmp",'wb')
+    outfile.write(struct.pack(CHROMTRACK_HEADER,CHROMTRACK_MAGIC,
+                  CHROMTRACK_ENCODING,chromnumber,track.size,lmbases,0,
+                  len(track.starts)))
+    outfile.write(numpy.asarray(track.starts,dtype='<u4').tostring())
+    outfile.write(track.codes.tostring())
+    outfile.close()
+    os.rename(path+".tmp",path)
+
+def loadcategorytrack(path):
+    """Return the CategoryTrack saved at <path> by savecategorytrack(). The
+    header fields are set as the attributes chromosome, lmbases and encoding
+    of the returned track, as for a ChromArray."""
+    infile=open(path,'rb')
+    data=infile.read()
+    infile.close()
+    offset=struct.calcsize(CHROMTRACK_HEADER)
+    (magic,encoding,chromosome,size,lmbases,reserved,
+     nruns)=struct.unpack(CHROMTRACK_HEADER,data[:offset])
+    assert magic==CHROMTRACK_MAGIC, ("Error: "+path
+                                     +" is not a chromosome track file")
+    assert encoding==CHROMTRACK_ENCODING, ("Error: "+path
+                +" has encoding version "+`encoding`+", not "
+                +`CHROMTRACK_ENCODING`)
+    assert len(data)==offset+5*nruns, ("Error: "+path+" should hold "
+                +`nruns`+" runs but has "+`len(data)-offset`+" bytes of runs")
+    starts=array.array('l',numpy.frombuffer(data,dtype='<u4',count=nruns,
+                                            offset=offset).tolist())
+    codes=array.array('c',data[offset+4*nruns:])
+    track=CategoryTrack(starts,codes,size)
+    track.chromosome=chromosome
+    track.lmbases=lmbases
+    track.encoding=encoding
+    return track
+
+def _coveredruns(intervallist,basez,chromsize):
+    """Return a sorted list of non-overlapping [start,stop) runs of zero-based
+    positions that assignletter() would change for <intervallist> and
+    <basez> on a chromosome of <chromsize> bases. Like assignletter(), if an
+    expanded interval goes past the end of the chromosome the part inside the
+    chromosome is covered and the remaining intervals are ignored when
+    <basez> > 0, and an IndexError is raised when <basez> is 0."""
+    runs=[]
+    for interval in intervallist:
+        if interval[1]-interval[0]+1+(2*basez) <= 0:
+            continue #assignletter() changes nothing for this interval
+        low=max(interval[0]-1-basez,0) #NOTE_5564
+        high=interval[1]+basez
+        if high > chromsize: #NOTE_5565
+            if basez==0:
+                raise IndexError, "array index out of range"
+            if low < chromsize:
+                runs.append([low,chromsize])
+            break
+        runs.append([low,high])
+    runs.sort()
+    merged=[]
+    for run in runs:
+        if merged and run[0]<=merged[-1][1]:
+            merged[-1][1]=max(merged[-1][1],run[1])
+        else:
+            merged.append(run)
+    return merged
+
+#===============================================================================
+#----------Distances to features------------------------------------------------
+#===============================================================================
+#Expanding mRNAs and lincRNAs by lmbases (NOTE_8213) only matters through the
+#distance from a base to the nearest mRNA and the nearest lincRNA: a base is
+#covered by an expanded mRNA exactly when its distance to the nearest mRNA is
+#<= lmbases. So given those two distances for a set of positions, their
+#categories can be worked out for any lmbases without making a new array.
+#This gives the same categories as the arrays when the interval lists do not
+#overlap and are sorted, as the cleaned-up location lists in
+#categorizeSNPsII are (assignletter() skips the intervals after one that
+#reaches past the end of the chromosome, see NOTE_5565).
+NODISTANCE=2**31-1 #distance reported when there are no intervals at all
+
+def nearestdistances(intervallist,positions):
+    """Return a numpy int64 array with the distance in bases from each
+    one-based position in the numpy integer array <positions> to the nearest
+    interval in <intervallist> (one-based inclusive [start,stop] intervals,
+    as for makechromarray()): 0 if the position is inside an interval, or
+    NODISTANCE if <intervallist> is empty."""
+    positions=numpy.asarray(positions,dtype=numpy.int64)
+    distances=numpy.empty(len(positions),dtype=numpy.int64)
+    distances.fill(NODISTANCE)
+    if len(intervallist)==0 or len(positions)==0:
+        return distances
+    ordered=sorted(intervallist)
+    starts=numpy.array([interval[0] for interval in ordered],dtype=numpy.int64)
+    stops=numpy.maximum.accumulate(numpy.array([interval[1] for interval
+                                   in ordered],dtype=numpy.int64))
+    #left is the last interval starting at or before each position; since
+    #stops is a running maximum, stops[left] is the furthest any of the
+    #intervals up to it reaches
+    left=numpy.searchsorted(starts,positions,side='right')-1
+    hasleft=left>=0
+    leftdistance=positions[hasleft]-stops[left[hasleft]]
+    distances[hasleft]=numpy.maximum(leftdistance,0)
+    hasright=left+1<len(starts)
+    rightdistance=starts[left[hasright]+1]-positions[hasright]
+    distances[hasright]=numpy.minimum(distances[hasright],rightdistance)
+    return distances
+
+def categoriesfromdistances(mRNAdistances,lincRNAdistances,innonlist,
+                            lmbases):
+    """Return a numpy uint8 array of category char codes for positions whose
+    distances to the nearest mRNA and lincRNA are <mRNAdistances> and
+    <lincRNAdistances> (see nearestdistances()) and which are or are not in
+    a nonintergenic interval according to the numpy bool array <innonlist>,
+    with mRNAs and lincRNAs expanded by <lmbases>. See makecategorytrack()
+    for how the categories are decided."""
+    inmRNA=mRNAdistances<=lmbases
+    inlincRNA=lincRNAdistances<=lmbases
+    codes=numpy.empty(len(inmRNA),dtype=numpy.uint8)
+    codes.fill(ord("i"))
+    codes[innonlist]=ord("n")
+    codes[inmRNA]=ord("m")
+    codes[inlincRNA]=ord("l")
+    codes[inmRNA&inlincRNA]=ord("b")
+    return codes
 
 #----------TESTING--------------------------------------------------------------
 def _test_assignletter():
@@ -306,19 +880,51 @@ def _test_makechromarray():
     print "ALL TESTING COMPLETE"
 
 
+def _test_packcodes():
+    """Test packcodes(), unpackcodes() and reading a packed ChromArray, for
+    random arrays of several lengths including more than one _PACKBLOCK."""
+    import random
+    random.seed(5563)
+    for size in [1,2,7,8,9,15,16,17,100,1001,_PACKBLOCK+13]:
+        codes=numpy.array([ord(random.choice(CATEGORY_CHARS))
+                           for x in xrange(min(size,5000))],dtype=numpy.uint8)
+        codes=numpy.resize(codes,size)
+        packed=packcodes(codes)
+        assert len(packed)==(3*size+7)//8
+        assert (unpackcodes(packed,size)==codes).all(), ("Error: round trip"
+                                            +" failed for size "+`size`)
+        savechromarray("chromtest_packed_ext0_array.raw",codes,1,0,True)
+        chromarray=ChromArray("chromtest_packed_ext0_array.raw")
+        assert chromarray.tostring()==codes.tostring()
+        for index in range(-1,min(size,2000))+range(max(0,size-50),size):
+            assert chromarray[index]==chr(codes[index]), ("Error: wrong"
+                +" char at index "+`index`+" for size "+`size`)
+        indices=numpy.array(range(-1,size,max(1,size//3000)))
+        assert (chromarray.lookup(indices)==codes[indices]).all()
+        assert chromarray.get(1)==chr(codes[0])
+        chromarray.close()
+    try:
+        packcodes(numpy.array([ord("i"),ord("x")],dtype=numpy.uint8))
+        raise MyErrorNotCaughtError
+    except ValueError:
+        print "ValueError was caught for a char that is not a category. Good."
+    print "Testing complete: packcodes() and unpackcodes() work properly"
+
 def _is_makechromarray_right(chrnm,chrsiz,mRNAL,lincL,nonL,expectedoutput,
                              lmbayses):
     """Return True if the actual output (based on the specified parameters)
     matches the expected output"""
     makechromarray(chrnm,chrsiz,mRNAL,lincL,nonL,lmbayses)
-    result=cPickle.load(open(chrnm+"_ext"+`lmbayses`+"_array.bin",'rb'))
-    #print "result was "+`result`+" and the expected output was "+
+    result=ChromArray(chromarraypath(chrnm,lmbayses))
+    #print "result was "+`result.tostring()`+" and the expected output was "+
     #`array.array('c',expectedoutputlist)`
-    return result==expectedoutput
+    return (result.tostring()==expectedoutput.tostring()
+            and "".join(result[x] for x in xrange(len(result)))
+                ==expectedoutput.tostring())
 
 def _test_create_22chrom_arrays():
     """Test the function create_22chrom_arrays().
-    NOTE: you must make one temporary change to create_22chrom_arrays() before
+    NOTE: you must make one temporary change to chromsizes() before
     running this test: Comment out chrsizedict and replace it with this line:
     chrsizedict={"chr1":10,"chr2":11,"chr3":12,"chr4":9}
     """
@@ -332,18 +938,124 @@ def _test_create_22chrom_arrays():
         [],[],[],[],[],[],[],[],[],[],[],[]]
     create_22chrom_arrays(mRNAlklist,linclklist,nonintlklist,0,
                           whichchroms=[1,2,3,4])
-    assert cPickle.load(
-        open("chromosome1_ext0_array.bin",'rb'))==array.array('c','immbblnnmi')
-    assert cPickle.load(
-        open("chromosome2_ext0_array.bin",'rb'))==array.array('c','mbliliinnmm')
-    assert cPickle.load(
-        open("chromosome3_ext0_array.bin",'rb'))==array.array('c','minnmmnnilll')
-    assert cPickle.load(
-        open("chromosome4_ext0_array.bin",'rb'))==array.array('c','bbbbbbbbb')
+    assert ChromArray("chromosome1_ext0_array.raw").tostring()=='immbblnnmi'
+    assert ChromArray("chromosome2_ext0_array.raw").tostring()=='mbliliinnmm'
+    assert ChromArray("chromosome3_ext0_array.raw").tostring()=='minnmmnnilll'
+    assert ChromArray("chromosome4_ext0_array.raw").tostring()=='bbbbbbbbb'
+    assert ChromArray("chromosome3_ext0_array.raw").chromosome==3
     print ("PASSED TESTING"
         +" -- don't forget to reverse the changes you made "
         +"before running this function!!!")
 
+def _test_create_22chrom_arrays_pool():
+    """Test that create_22chrom_arrays() makes the same files with several
+    worker processes and a workermemory limit as it does with one process,
+    and that the workers' address space is limited."""
+    mRNAlklist=[[[2,5],[9,9]],[[1,2],[10,11]],[[1,1],[5,5],[6,6]],[[1,9]]]
+    linclklist=[[[4,6]],[[2,3],[5,5]],[[10,12]],[[1,9]]]
+    nonintlklist=[[[7,7],[8,8]],[[8,10]],[[3,4],[7,8]],[[1,9]]]
+    for lists in [mRNAlklist,linclklist,nonintlklist]:
+        lists.extend([[] for chromdex in xrange(18)])
+    for packed in [False,True]:
+        for workers in [1,3]:
+            os.mkdir("_test_pool"+`workers`)
+            create_22chrom_arrays(mRNAlklist,linclklist,nonintlklist,2,
+                                  whichchroms=[1,2,3,4],userealsizes=False,
+                                  dirtosavein="_test_pool"+`workers`,
+                                  packed=packed,workers=workers,
+                                  workermemory=400*(workers-1))
+        for number in [1,2,3,4]:
+            paths=[chromarraypath("_test_pool"+`workers`+"/chromosome"
+                                  +`number`,2) for workers in [1,3]]
+            serial=ChromArray(paths[0])
+            pooled=ChromArray(paths[1])
+            assert pooled.tostring()==serial.tostring(), ("Error: chromosome"
+                +`number`+" differs when made by a Pool, packed="+`packed`)
+            assert pooled.chromosome==number, ("Error: chromosome number was "
+                +`pooled.chromosome`+" instead of "+`number`)
+            for path in paths:
+                os.remove(path)
+        os.rmdir("_test_pool1")
+        os.rmdir("_test_pool3")
+    pool=multiprocessing.Pool(2,_limitmemory,(400,))
+    try:
+        limits=pool.map(resource.getrlimit,[resource.RLIMIT_AS]*2)
+    finally:
+        pool.close()
+        pool.join()
+    assert all(limit[0]<=400*1024*1024 for limit in limits), ("Error: the"
+        +" workers' address space was not limited: "+`limits`)
+    print "Testing complete: create_22chrom_arrays() works with a Pool"
+
+def _test_makecategorytrack():
+    """Test the function makecategorytrack() by comparing its CategoryTracks
+    with the arrays made by makechromarray() for the same random intervals,
+    for several lmbases."""
+    import random
+    random.seed(8213)
+    def randomintervals(chromsize):
+        intervals=[]
+        for number in xrange(random.randint(0,6)):
+            start=random.randint(1,chromsize)
+            intervals.append([start,min(chromsize,
+                                        start+random.randint(0,30))])
+        return intervals
+    for test in xrange(300):
+        chromsize=random.randint(1,200)
+        lmbases=random.choice([0,1,3,10,50])
+        lists=[randomintervals(chromsize) for which in xrange(3)]
+        makechromarray("chromtest_track",chromsize,lists[0],lists[1],lists[2],
+                       lmbases)
+        expected=ChromArray(chromarraypath("chromtest_track",lmbases))
+        track=makecategorytrack(chromsize,lists[0],lists[1],lists[2],lmbases)
+        assert track.tostring()==expected.tostring(), ("Error: test "+`test`
+            +" failed for "+`lists`+" with lmbases "+`lmbases`)
+        for index in xrange(-1,chromsize):
+            assert track[index]==expected[index], ("Error: test "+`test`
+                +" failed at index "+`index`)
+        indices=numpy.arange(-1,chromsize)
+        assert (track.lookup(indices)==expected.lookup(indices)).all()
+        assert trackfromarray(expected).tostring()==expected.tostring()
+        makechromtrack("chromtest_track",chromsize,lists[0],lists[1],
+                       lists[2],lmbases,7)
+        loaded=loadcategorytrack(chromtrackpath("chromtest_track",lmbases))
+        assert (loaded.tostring()==expected.tostring()
+                and loaded.chromosome==7 and loaded.lmbases==lmbases), (
+            "Error: test "+`test`+" failed for the saved track")
+        expected.close()
+    print "Testing complete: makecategorytrack() works properly"
+
+def _test_nearestdistances():
+    """Test nearestdistances() and categoriesfromdistances() by comparing
+    the categories they give for every base with makecategorytrack(), for
+    random sorted, non-overlapping interval lists and several lmbases."""
+    import random
+    random.seed(74356)
+    def randomlocations(chromsize):
+        intervals=[]
+        for number in xrange(random.randint(0,8)):
+            start=random.randint(1,chromsize)
+            intervals.append([start,min(chromsize,
+                                        start+random.randint(0,30))])
+        #merge them like _clean_up_locations() in categorizeSNPsII
+        return [[run[0]+1,run[1]] for run
+                in _coveredruns(intervals,0,chromsize)]
+    for test in xrange(300):
+        chromsize=random.randint(1,300)
+        lists=[randomlocations(chromsize) for which in xrange(3)]
+        positions=numpy.arange(1,chromsize+1)
+        mRNAdistances=nearestdistances(lists[0],positions)
+        lincRNAdistances=nearestdistances(lists[1],positions)
+        innonlist=nearestdistances(lists[2],positions)==0
+        for lmbases in [0,1,2,5,17,100,500]:
+            expected=makecategorytrack(chromsize,lists[0],lists[1],lists[2],
+                                       lmbases).lookup(positions-1)
+            actual=categoriesfromdistances(mRNAdistances,lincRNAdistances,
+                                           innonlist,lmbases)
+            assert (actual==expected).all(), ("Error: test "+`test`
+                +" failed for "+`lists`+" with lmbases "+`lmbases`)
+    print "Testing complete: nearestdistances() works properly"
+
 #----------Custom Error Classes-------------------------------------------------
 class MyZeroStartError(Exception):
     pass
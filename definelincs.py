@@ -27,14 +27,16 @@ pipeline will be run on only the datasets indicated in the "use:" field."""
 
 import time
 import cPickle
-import copy
 import sys
 import os.path
 
+import numpy
+
 import GTFparser_general
 import RefGene_parserII
 import BEDparser
 import FeatureClass_Small
+import intervalset
 
 #===============================================================================
 #----------FUNCTIONS------------------------------------------------------------
@@ -211,6 +213,9 @@ def removeproteinoverlap(lincsbychrom,outputpath,datasetdict):
             one base
         TRANSCRIPTS WITHOUT STRAND INFO are removed if:
             They are within 1 kb of RefSeq NM genes on either strand
+        The pseudogenes and NM genes of each chromosome are indexed (by strand
+        for the NM genes) as sorted interval sets, so that each lincRNA is
+        checked with a binary search (see intervalset.overlapsany()).
     
     OUTPUT: This function adds to the pipeline log file and modifies the
     <lincsbychrom> list in place. There is no explicit return value."""
@@ -233,14 +238,18 @@ def removeproteinoverlap(lincsbychrom,outputpath,datasetdict):
     pseudogenesbychrom=GTFparser_general.sortSmallFeatsbychrom(pseudogenes)
     removed_bcz_pseudoverlap=0
     for chromosome in range(0,22): #ignores sex chroms; those are empty anyway
-        for lincrna in lincsbychrom[chromosome]:
-            for psgene in pseudogenesbychrom[chromosome]:
-                if _is_overlap(lincrna.ranger[0],lincrna.ranger[1],
-                               psgene.ranger[0],psgene.ranger[1]):
-                #if the lincrna and psgene overlap by one or more bases, then:
-                    if lincrna.misc:
-                        lincrna.misc=False
-                        removed_bcz_pseudoverlap=removed_bcz_pseudoverlap+1
+        #index the pseudogenes of the chromosome as one clean interval set, so
+        #each lincRNA is a binary search instead of a pass over every one
+        psstarts,psstops=_rangerset(pseudogenesbychrom[chromosome])
+        lincstarts,lincstops=intervalset.fromlist(
+            [lincrna.ranger for lincrna in lincsbychrom[chromosome]])
+        overlaps=intervalset.overlapsany(psstarts,psstops,lincstarts,
+                                         lincstops)
+        #if the lincrna and a psgene overlap by one or more bases, then:
+        for lincrna,overlap in zip(lincsbychrom[chromosome],overlaps):
+            if overlap and lincrna.misc:
+                lincrna.misc=False
+                removed_bcz_pseudoverlap=removed_bcz_pseudoverlap+1
     #SECOND: mark for removal any lincs that are near/overlap an NM gene
     mrnaslist=RefGene_parserII.returnRefGenelist(datasetdict["refgene"],["NM"])
     GTFparser_general.giveranger(mrnaslist)
@@ -248,48 +257,53 @@ def removeproteinoverlap(lincsbychrom,outputpath,datasetdict):
     removed_bcz_mrnaoverlap=0
     for chromosome in range(0,22):
         print "chromosome "+`chromosome+1`+" is being worked on."
-        for lincrna in lincsbychrom[chromosome]:
-            for mrna in mrnasbychrom[chromosome]:
-                if (("+" in mrna.strand and "+" in lincrna.strand) or
-                    ("-" in mrna.strand and "-" in lincrna.strand) or
-                    ("+" not in lincrna.strand and "-" not in lincrna.strand)):
-                    #if mrna/lincrna on same strand, or linc has no strand info
-                    if _is_overlap(lincrna.ranger[0],lincrna.ranger[1],
-                                   mrna.ranger[0],mrna.ranger[1],500):
-                    #Note: make it 500 instead of 1000 because each feature
-                    #is expanded by <distance> bases; and 500+500=1000
-                    #if the lincRNA and mRNA overlap by at least one base when
-                    #the lincRNA is extended by 1000 bp in either direction,then
-                        if lincrna.misc:
-                            lincrna.misc=False #if it hasn't been set to False
-                                #by pseudogene overlap,set lincrna.misc to False
-                            removed_bcz_mrnaoverlap+=1
-                            break #this is VERY important;
-                            #you don't want to check one linc over and over
-                            #if you already know it overlaps one mrna
-                elif (("+" in mrna.strand and "-" in lincrna.strand)
-                    or ("-" in mrna.strand and "+" in lincrna.strand)):
-                    #mrna/lincrna are on opposite strands
-                    if _is_overlap(lincrna.ranger[0],lincrna.ranger[1],
-                                   mrna.ranger[0],mrna.ranger[1]):
-                    #if the lincRNA and mRNA overlap by at least one base
-                        if lincrna.misc:
-                            lincrna.misc=False
-                            removed_bcz_mrnaoverlap+=1
-                            break
-                else: #you should never go in this else
-                    assert False, "ERROR in removeproteinoverlap"
+        #index the mRNAs of the chromosome by strand
+        mrnas=mrnasbychrom[chromosome]
+        plus=_rangerset([mrna for mrna in mrnas if "+" in mrna.strand])
+        minus=_rangerset([mrna for mrna in mrnas if "-" in mrna.strand])
+        plusonly=_rangerset([mrna for mrna in mrnas if "+" in mrna.strand
+                             and "-" not in mrna.strand])
+        minusonly=_rangerset([mrna for mrna in mrnas if "-" in mrna.strand
+                              and "+" not in mrna.strand])
+        stranded=_rangerset([mrna for mrna in mrnas if "+" in mrna.strand
+                             or "-" in mrna.strand])
+        everymrna=_rangerset(mrnas)
+        nostrandmrnas=[mrna for mrna in mrnas if "+" not in mrna.strand
+                       and "-" not in mrna.strand]
+        lincs=[lincrna for lincrna in lincsbychrom[chromosome] if lincrna.misc]
+        lincstarts,lincstops=intervalset.fromlist(
+            [lincrna.ranger for lincrna in lincs])
+        #Same strand, or the linc has no strand info: remove the lincRNA if it
+        #overlaps the mRNA by at least one base when the lincRNA is extended
+        #by 1000 bp in either direction (the same as extending both by 500).
+        #Opposite strands: remove the lincRNA if it overlaps the mRNA by at
+        #least one base
+        def near(mrnaset,distance):
+            return intervalset.overlapsany(mrnaset[0],mrnaset[1],lincstarts,
+                                           lincstops,distance)
+        lincplus=numpy.array(["+" in lincrna.strand for lincrna in lincs],
+                             dtype=bool)
+        lincminus=numpy.array(["-" in lincrna.strand for lincrna in lincs],
+                              dtype=bool)
+        if nostrandmrnas:
+            #an mRNA with no strand info can't be compared with a stranded
+            #lincRNA; you should never get here
+            assert not (lincplus|lincminus).any(), (
+                "ERROR in removeproteinoverlap")
+        overlaps=numpy.where(lincplus&lincminus,near(stranded,1000),
+                 numpy.where(lincplus,near(plus,1000)|near(minusonly,0),
+                 numpy.where(lincminus,near(minus,1000)|near(plusonly,0),
+                             near(everymrna,1000))))
+        for lincrna,overlap in zip(lincs,overlaps):
+            if overlap:
+                lincrna.misc=False
+                removed_bcz_mrnaoverlap+=1
     #THIRD: actually remove lincRNAs that need to be removed
     delkntr=0
     for chromosome in range(0,22):
-        poz=0
-        while poz < len(lincsbychrom[chromosome]):
-            lincrna=lincsbychrom[chromosome][poz]
-            if not(lincrna.misc): #if lincrna.misc has been changed to False
-                lincsbychrom[chromosome].remove(lincrna)
-                delkntr+=1
-            else:
-                poz+=1 #only increment the pos if you didn't just delete a linc
+        keep=[lincrna for lincrna in lincsbychrom[chromosome] if lincrna.misc]
+        delkntr+=len(lincsbychrom[chromosome])-len(keep)
+        lincsbychrom[chromosome][:]=keep
     logfile.write("\n\tlincRNAs removed due to overlap with pseudogene: "
                   +`removed_bcz_pseudoverlap`)
     logfile.write("\n\tlincRNAs removed due to overlapping"
@@ -308,6 +322,12 @@ def removeproteinoverlap(lincsbychrom,outputpath,datasetdict):
     assert lincsleft==kntr-delkntr, "Error: Counts are not summing properly"
     #Note: you don't need to return anything. This function modifies the list.
 
+def _rangerset(features):
+    """Return (starts,stops), the clean interval set (see intervalset.py)
+    covering the rangers of the SmallFeature objects in <features>."""
+    return intervalset.union(*intervalset.fromlist(
+        [feature.ranger for feature in features]))
+
 def _return_pseudogenes(pseudogenepath):
     """Return a list of SmallFeature objects read out of Human_Pseudogene.txt.
     These SmallFeatures contain chromosome, start, and stop information."""
@@ -530,57 +550,25 @@ def calculate_genomecoverage(lincsbychrom,datasetdict,outputpath):
     NOTES: calculate_genomecoverage() does not consider exon
     information--it merely uses the ranger (the overall start and overall
     end position) of each lincRNA to see how many bases of the genome are
-    covered. calculate_genomecoverage() makes a deep copy of <lincsbychrom>
-    so that it can collapse everything according to general overlap without
-    affecting the actual <lincsbychrom> list. The reason to collapse by general
+    covered. calculate_genomecoverage() collapses the rangers according to
+    general overlap with intervalset.coverage(), which does not affect the
+    actual <lincsbychrom> list. The reason to collapse by general
     overlap is so in the case of lincRNAs that are separate (due to no exon
     overlap) but actually lie in a similar location (general overlap) the same
     region of genome will not be counted twice towards the total coverage.
-    A lot of this function was copied right out of the body of
-    collapseifexonoverlap(). Since the coordinate system I use is closed
-    (the endpoints are included in the interval) I need to add one when I
-    calculate length from endpoint subtraction.
+    Since the coordinate system I use is closed (the endpoints are included
+    in the interval) one is added when length is calculated from endpoint
+    subtraction.
     
     OUTPUT: This function writes the genome coverage result to the pipeline
     log file. There is no explicit return value."""
     print "Calculating genome coverage"
-    modylist=copy.deepcopy(lincsbychrom)
-    #First collapse everything by general overlap
-    genoverlapcnt=0
-    for chromosome in range(0,22): #ignores sex chrs, which are empty anyway
-        position1=0
-        position2=1
-        while (position1 < len(modylist[chromosome])-1
-               and position2 < len(modylist[chromosome])):
-            linc1=modylist[chromosome][position1]
-            linc2=modylist[chromosome][position2]
-            if _is_overlap(linc1.ranger[0],linc1.ranger[1],linc2.ranger[0],
-                           linc2.ranger[1]):
-                genoverlapcnt+=1
-                _mergelincs(linc1,linc2)
-                modylist[chromosome].remove(linc1)
-                position2=position1+1
-            else: #linc1 and linc2 should not be combined;
-                #increment positions accordingly
-                #ChangePositionAfterNoCombo:
-                length=len(modylist[chromosome])
-                if position2 < length-1 and position1 < length-2:
-                    position2=position2+1
-                elif position2==length-1 and position1<length-2:
-                    position1=position1+1
-                    position2=position1+1
-                else:
-                    assert (position2==length-1
-                            and position1==length-2), ("ERROR:"
-                                +" pos2 is actually "+`position2`
-                                +" and pos1 is "+`position1`)
-                    position1=length #stop the while loop
-    #Then calculate the coverage of the genome
+    #Collapse everything by general overlap, so that the same region of genome
+    #is not counted twice, then add up the bases covered
     coverage=0
-    for chromo in modylist:
-        for linc in chromo:
-            coverage=coverage+(linc.ranger[1]-linc.ranger[0])+1
-            #add one since my coordinate system has the endpoints included
+    for chromo in lincsbychrom:
+        starts,stops=intervalset.fromlist([linc.ranger for linc in chromo])
+        coverage=coverage+intervalset.coverage(starts,stops)
     if "nowrite" in datasetdict:
         logfile=open(os.path.join(outputpath,"delthis.txt"),'w')
     else:
@@ -875,70 +863,18 @@ def _clean_up_exon_locations(linc):
     
     OUTPUT: This function modifies <linc> in place. There is no explicit
     return value."""
-    #Make the list of all exons, as Exon objects
-    listofExonObjects=[]
-    for position in range(len(linc.exons)):
-        exonbeginning=linc.start[position]
-        exonend=linc.stop[position]
-        listofExonObjects.append(Exon(exonbeginning,exonend))
-    #Collapse the exon list
-    pos1=0
-    pos2=1
-    while pos1<len(listofExonObjects)-1 and pos2<len(listofExonObjects):
-        exonA=listofExonObjects[pos1]
-        exonB=listofExonObjects[pos2]
-        startA=exonA.exonSTART; stopA=exonA.exonSTOP
-        startB=exonB.exonSTART; stopB=exonB.exonSTOP
-        if startA <= startB <= stopA:
-            if stopB >= stopA: #exons offset from each other
-                exonB.exonSTART=startA
-                listofExonObjects.remove(exonA)
-                pos2=pos1+1
-            else: #exonB is "engulfed by" exonA
-                assert stopB <= stopA
-                exonB.exonSTART=startA
-                exonB.exonSTOP=stopA
-                listofExonObjects.remove(exonA)
-                pos2=pos1+1
-        elif startB <= startA <= stopB:
-            if stopB >= stopA: #exonA is "engulfed by" exonB
-                listofExonObjects.remove(exonA)
-                pos2=pos1+1
-            else: #exons offset from each other
-                assert stopB <=stopA
-                exonB.exonSTOP=exonA.exonSTOP
-                listofExonObjects.remove(exonA)
-                pos2=pos1+1
-        else:#They don't overlap and were not combined
-            #ChangePositionAfterNoCombo
-            length=len(listofExonObjects)
-            if pos2 < length-1 and pos1 < length-2:
-                pos2=pos2+1
-            elif pos2==length-1 and pos1<length-2:
-                pos1=pos1+1
-                pos2=pos1+1
-            else:
-                assert pos2==length-1 and pos1==length-2, ("ERROR:"
-                        +" pos2 is actually "+`pos2`+" and pos1 is "+`pos1`)
-                pos1=length #stop the while loop
-    #Update the linc's start, stop, and exon properties to reflect
-    #the collapsed exon list
-    newlincstart=[]
-    newlincstop=[]
-    newlincexons=[]
-    exoncount=1
-    listofExonObjects.sort(key=lambda x: x.exonSTART) #sort the exons by start
-    #if you don't sort them by start position, then the Genome Browser can't
+    #Collapse the exon list; the exons come out sorted by start position.
+    #If you don't sort them by start position, then the Genome Browser can't
     #open your BED file because the Genome Browser assumes your
     #exons are provided in order :P
-    for ekzon in listofExonObjects:
-        newlincstart.append(ekzon.exonSTART)
-        newlincstop.append(ekzon.exonSTOP)
-        newlincexons.append(exoncount)
-        exoncount+=1
-    linc.start=newlincstart
-    linc.stop=newlincstop
-    linc.exons=newlincexons
+    exoncount=len(linc.exons)
+    newlincstart,newlincstop=intervalset.union(linc.start[:exoncount],
+                                               linc.stop[:exoncount])
+    #Update the linc's start, stop, and exon properties to reflect
+    #the collapsed exon list
+    linc.start=newlincstart.tolist()
+    linc.stop=newlincstop.tolist()
+    linc.exons=range(1,len(linc.start)+1)
 
 def makeSmallfeatures_fromSIGOVA(sigovafilename):
     """Return a list of SmallFeature objects based on the Sigova data file.
@@ -995,18 +931,6 @@ def makeSmallfeatures_fromSIGOVA(sigovafilename):
         featslistsigova.append(newfeature)
     return featslistsigova
 
-#===============================================================================
-#----------CLASS----------------------------------------------------------------
-#===============================================================================
-class Exon(object):
-    exonSTART=0
-    exonSTOP=0
-    def __init__(self,exonSTARTpos,exonSTOPpos):
-        self.exonSTART=exonSTARTpos
-        self.exonSTOP=exonSTOPpos
-    def __str__(self):
-        return "Exon "+`self.exonSTART`+"-"+`self.exonSTOP`
-
 #===============================================================================
 #----------EXECUTION------------------------------------------------------------
 #===============================================================================
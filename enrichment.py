@@ -0,0 +1,309 @@
+#Rachel Ballantyne
+#enrichment.py
+
+"""Test whether the GWAS p-values of the SNPs in each category made by
+categorizeSNPsII.py (lincRNA only, mRNA only, both, intergenic and
+nonintergenic) are smaller than expected, by permutation testing.
+
+enrichment.py is called as follows:
+    python enrichment.py <prefix> <permutations> [<seed> [<workers>]]
+where <prefix> is the start of the paths of the five p-value files made by
+categorizeSNPsII.outputpvals(), e.g.
+    /home/raba/enrich/categorizeSNPsII_outputpvals_11-26-2013_CardiogramGWAS/
+    CardiogramGWAS_11-26-2013_ext0
+<permutations> is the number of permutations done for each category, <seed>
+is the seed of the random numbers (default 0) and <workers> is the number of
+processes the permutations are split across (default 1). The results are
+saved in the tab-delimited file <prefix>_enrichment.txt (see
+writeenrichment()).
+
+----------Method----------
+The null hypothesis for a category with k SNPs is that its SNPs are a random
+sample of k of all N classified SNPs, i.e. that the category labels could be
+permuted among the SNPs. The statistics tested are the mean -log10(p) of the
+category and the number of its SNPs with p at or below each of THRESHOLDS.
+Both only depend on how many of the category's SNPs fall in each bin of
+-log10(p), so the SNPs are put into bins (quantiles of -log10(p), plus a
+bin edge at each threshold; see scorebins()) and the mean -log10(p) is worked
+out from the mean of each bin. This binned mean is only used to compare the
+category with its permutations; the observed mean that is reported is the
+exact one. Permuting the labels then amounts to drawing
+k SNPs from the bins without replacement, which is a multivariate
+hypergeometric draw. That is done for a whole block of permutations at once
+with one numpy hypergeometric call per bin (see _permutationblock()), so the
+time taken depends on the number of bins and permutations but not on N, and
+10^5 to 10^6 permutations of a 2.5 million SNP GWAS are practical.
+Every block has its own random number generator, seeded with (<seed>,
+category, block), so the results are the same for any number of workers."""
+
+import multiprocessing
+import sys
+
+import numpy
+
+CATEGORY_FILES={"l":"_linconly.txt","m":"_mRNAonly.txt",
+                "b":"_both_linc+mRNA.txt","n":"_noninter.txt",
+                "i":"_intergenic.txt"}
+CATEGORY_NAMES={"l":"lincRNA only","m":"mRNA only","b":"both lincRNA and mRNA",
+                "n":"nonintergenic","i":"intergenic"}
+THRESHOLDS=[5e-8,1e-5,1e-3,0.05]
+SCOREBINS=256 #number of quantile bins of -log10(p)
+PERMUTATIONBLOCK=10000 #number of permutations drawn at once
+
+def readcategoryfiles(prefix):
+    """Return a dictionary of numpy float64 arrays of the p-values in the
+    five category files made by categorizeSNPsII.outputpvals() with the
+    paths beginning with <prefix>, keyed by category char."""
+    pvalsbycategory={}
+    for category in CATEGORY_FILES:
+        pvalfile=open(prefix+CATEGORY_FILES[category],'r')
+        pvalsbycategory[category]=numpy.array(pvalfile.read().split(),
+                                              dtype=numpy.float64)
+        pvalfile.close()
+    return pvalsbycategory
+
+def scores(pvals):
+    """Return a numpy array of -log10(<pvals>). p-values of 0 are treated
+    as the smallest positive float."""
+    return -numpy.log10(numpy.maximum(pvals,numpy.finfo(numpy.float64).tiny))
+
+def scorebins(pvalsbycategory,thresholds=THRESHOLDS,nbins=SCOREBINS):
+    """Return (bincounts, binvalues, statisticnames) for the p-values in
+    <pvalsbycategory> (a dictionary of numpy arrays keyed by category char).
+    bincounts is a dictionary of numpy int64 arrays giving how many SNPs of
+    each category are in each bin. binvalues is a numpy float64 array with
+    one row per statistic and one column per bin: a category's statistics
+    are bincounts[category].dot(binvalues.T), divided by the category's size
+    for the first one, the mean -log10(p)."""
+    allscores=scores(numpy.concatenate([pvalsbycategory[category] for
+                                        category in sorted(pvalsbycategory)]))
+    thresholdscores=scores(numpy.array(thresholds,dtype=numpy.float64))
+    #Quantile edges put the same number of SNPs in each bin, and evenly
+    #spaced edges keep the few SNPs with very small p-values apart
+    if len(allscores)>0:
+        quantiles=numpy.percentile(allscores,numpy.linspace(0,100,nbins+1))
+        evenedges=numpy.linspace(allscores.min(),allscores.max(),nbins+1)
+    else:
+        quantiles=evenedges=numpy.array([],dtype=numpy.float64)
+    #a SNP with score s is in bin searchsorted(edges,s,'right'), so SNPs
+    #with scores at or above a threshold's score are never in the same bin
+    #as SNPs below it
+    edges=numpy.unique(numpy.concatenate((quantiles[1:-1],evenedges[1:-1],
+                                          thresholdscores)))
+    nbins=len(edges)+1
+    bincounts={}
+    for category in pvalsbycategory:
+        bincounts[category]=numpy.bincount(numpy.searchsorted(edges,
+                            scores(pvalsbycategory[category]),side='right'),
+                            minlength=nbins).astype(numpy.int64)
+    allbins=numpy.searchsorted(edges,allscores,side='right')
+    binsums=numpy.bincount(allbins,weights=allscores,minlength=nbins)
+    binsizes=numpy.bincount(allbins,minlength=nbins)
+    binvalues=numpy.zeros((len(thresholds)+1,nbins),dtype=numpy.float64)
+    binvalues[0]=binsums/numpy.maximum(binsizes,1)
+    binlowest=numpy.append(-numpy.inf,edges) #lowest score in each bin
+    for row in range(len(thresholds)):
+        binvalues[row+1]=binlowest>=thresholdscores[row]
+    statisticnames=(["mean -log10(p)"]
+                    +["p<="+`threshold` for threshold in thresholds])
+    return bincounts,binvalues,statisticnames
+
+def permutationtest(pvalsbycategory,permutations,seed=0,workers=1,
+                    thresholds=THRESHOLDS,nbins=SCOREBINS):
+    """Return the results of <permutations> permutations of the category
+    labels of the p-values in <pvalsbycategory> (a dictionary of numpy
+    arrays keyed by category char, e.g. the output of readcategoryfiles()).
+
+    PARAMETERS:
+    <permutations> is an int >= 1, the number of permutations for each
+        category.
+    <seed> is an int >= 0 that determines all of the random numbers.
+    <workers> is an int >= 1, the number of processes the blocks of
+        permutations are split across.
+    <thresholds> and <nbins> are as for scorebins().
+
+    OUTPUT: a dictionary keyed by category char. Each value is a dictionary
+    with the keys "count" (the number of SNPs in the category),
+    "statistics" (the names of the statistics, see scorebins()), and
+    "observed", "expected" (the mean over the permutations), "exceed" (the
+    number of permutations with a statistic at least as big as observed,
+    where the mean -log10(p) is compared in its binned form) and
+    "pvalues" (the one-sided empirical p-values (exceed+1)/(permutations+1)),
+    which are numpy arrays with one member per statistic. For a category with
+    no SNPs, observed, expected and pvalues are nan."""
+    assert type(permutations) is int and permutations>=1, ("Error: "
+                    +"permutations must be an int >= 1, not "+`permutations`)
+    assert type(workers) is int and workers>=1, ("Error: "
+                    +"workers must be an int >= 1, not "+`workers`)
+    bincounts,binvalues,statisticnames=scorebins(pvalsbycategory,thresholds,
+                                                 nbins)
+    poolcounts=sum(bincounts.values())
+    categories=sorted(pvalsbycategory)
+    results={}
+    jobs=[]
+    for categorydex in range(len(categories)):
+        category=categories[categorydex]
+        count=int(bincounts[category].sum())
+        #the permuted statistics are compared with the binned ones
+        binnedobserved=binvalues.dot(bincounts[category]).astype(
+            numpy.float64)
+        observed=binnedobserved.copy()
+        if count>0:
+            binnedobserved[0]=binnedobserved[0]/count
+            observed[0]=scores(pvalsbycategory[category]).mean()
+        results[category]={"count":count,"statistics":statisticnames,
+                           "observed":observed,
+                           "exceed":numpy.zeros(len(observed),
+                                                dtype=numpy.int64),
+                           "sums":numpy.zeros(len(observed))}
+        if count==0:
+            continue
+        for block in range(0,permutations,PERMUTATIONBLOCK):
+            jobs.append((category,poolcounts,count,binvalues,binnedobserved,
+                         min(PERMUTATIONBLOCK,permutations-block),
+                         [seed,categorydex,block//PERMUTATIONBLOCK]))
+    if workers==1 or len(jobs)<2:
+        blockresults=map(_permutationblock,jobs)
+    else:
+        pool=multiprocessing.Pool(min(workers,len(jobs)))
+        try:
+            blockresults=pool.map(_permutationblock,jobs,1)
+        finally:
+            pool.close()
+            pool.join()
+    for job,(exceed,sums) in zip(jobs,blockresults):
+        results[job[0]]["exceed"]+=exceed
+        results[job[0]]["sums"]+=sums
+    for category in categories:
+        result=results[category]
+        sums=result.pop("sums")
+        if result["count"]==0:
+            result["observed"][:]=numpy.nan
+            result["expected"]=numpy.nan*sums
+            result["pvalues"]=numpy.nan*sums
+        else:
+            result["expected"]=sums/permutations
+            result["pvalues"]=(result["exceed"]+1.0)/(permutations+1.0)
+    return results
+
+def _permutationblock(job):
+    """Draw one block of permutations for permutationtest(). <job> is a
+    tuple: (category, poolcounts, count, binvalues, observed, permutations,
+    seed), where poolcounts is the number of SNPs of all categories in each
+    bin, count is the category's size and observed holds the category's
+    statistics worked out from the bins. Return (exceed, sums): numpy
+    arrays of the number of permutations whose statistics were at least the
+    <observed> ones and of the sums of the permuted statistics."""
+    category,poolcounts,count,binvalues,observed,permutations,seed=job
+    randomstate=numpy.random.RandomState(seed)
+    #Draw <count> SNPs without replacement one bin at a time: given how
+    #many are still to be drawn, the number drawn from a bin is
+    #hypergeometric in the SNPs of that bin against those of the later bins
+    draws=numpy.zeros((permutations,len(poolcounts)),dtype=numpy.int64)
+    left=numpy.empty(permutations,dtype=numpy.int64)
+    left.fill(count)
+    later=int(poolcounts.sum())
+    for binnumber in range(len(poolcounts)-1):
+        later-=int(poolcounts[binnumber])
+        drawing=left>0
+        if poolcounts[binnumber]>0 and drawing.any():
+            #numpy needs a sample size of at least 1
+            draws[drawing,binnumber]=randomstate.hypergeometric(
+                poolcounts[binnumber],later,left[drawing])
+            left-=draws[:,binnumber]
+    draws[:,-1]=left
+    statistics=draws.dot(binvalues.T)
+    statistics[:,0]=statistics[:,0]/count
+    #allow for rounding differences between the sums of the bin values
+    tolerance=1e-9*numpy.maximum(numpy.abs(observed),1)
+    exceed=(statistics>=observed-tolerance).sum(axis=0)
+    return exceed.astype(numpy.int64),statistics.sum(axis=0)
+
+def writeenrichment(results,outputpath,permutations,seed):
+    """Save the <results> of permutationtest() to the tab-delimited file
+    <outputpath>, with one line per category and statistic."""
+    outputfile=open(outputpath,'w')
+    outputfile.write("#permutations: "+`permutations`+"\tseed: "+`seed`+"\n")
+    outputfile.write("category\tcount\tstatistic\tobserved\texpected\t"
+                     +"exceed\tpvalue\n")
+    for category in "lmbni":
+        if category not in results:
+            continue
+        result=results[category]
+        for row in range(len(result["statistics"])):
+            outputfile.write("\t".join([CATEGORY_NAMES[category],
+                `result["count"]`,result["statistics"][row],
+                repr(float(result["observed"][row])),
+                repr(float(result["expected"][row])),
+                `int(result["exceed"][row])`,
+                repr(float(result["pvalues"][row]))])+"\n")
+    outputfile.close()
+
+#----------TESTING--------------------------------------------------------------
+def _test_permutationtest():
+    """Compare the statistics of permutationtest() with their exact means
+    under permutation of the labels of a small set of p-values, and check
+    that it is reproducible and does not depend on the number of workers."""
+    randomstate=numpy.random.RandomState(4)
+    pvals=numpy.concatenate((randomstate.uniform(size=1500),
+                             randomstate.uniform(size=60)**4,
+                             numpy.array([1e-9,3e-6,0.0,1.0])))
+    labels=randomstate.permutation(numpy.array(list("i"*700+"n"*500+"m"*300
+                                                    +"l"*60+"b"*4)))
+    pvalsbycategory=dict((category,pvals[labels==category])
+                         for category in "imnlb")
+    permutations=10000
+    results=permutationtest(pvalsbycategory,permutations,seed=11)
+    again=permutationtest(pvalsbycategory,permutations,seed=11,workers=3)
+    allscores=scores(pvals)
+    total=len(pvals)
+    for category in "imnlb":
+        assert (results[category]["exceed"]==again[category]["exceed"]).all(), (
+            "Error: the results depend on the number of workers")
+        count=results[category]["count"]
+        assert count==(labels==category).sum(), "Error: wrong count"
+        #the threshold counts are exact
+        for row in range(len(THRESHOLDS)):
+            assert (results[category]["observed"][row+1]
+                    ==(pvalsbycategory[category]<=THRESHOLDS[row]).sum()), (
+                "Error: wrong observed count for "+category)
+        realmean=scores(pvalsbycategory[category]).mean()
+        assert abs(results[category]["observed"][0]-realmean)<=1e-12*realmean, (
+            "Error: observed mean -log10(p) was "
+            +`results[category]["observed"][0]`+" instead of "+`realmean`)
+        #Under permutation the mean -log10(p) has mean allscores.mean() and
+        #each threshold count is hypergeometric
+        finite=(total-count)/(total-1.0)
+        expected=[allscores.mean()]
+        variances=[allscores.var()/count*finite]
+        for threshold in THRESHOLDS:
+            fraction=(pvals<=threshold).mean()
+            expected.append(count*fraction)
+            variances.append(count*fraction*(1-fraction)*finite)
+        tolerance=5*numpy.sqrt(numpy.array(variances)/permutations)+1e-9
+        assert (numpy.abs(results[category]["expected"]-expected)
+                <=tolerance).all(), ("Error: expected statistics for "
+            +category+" were "+`results[category]["expected"]`+" not about "
+            +`expected`)
+    pvalsbycategory["b"]=numpy.array([],dtype=numpy.float64)
+    results=permutationtest(pvalsbycategory,100)
+    assert (results["b"]["count"]==0 and results["b"]["exceed"].sum()==0
+            and numpy.isnan(results["b"]["pvalues"]).all()), (
+        "Error: a category with no SNPs should have nan p-values")
+    print "Passed _test_permutationtest()"
+
+if __name__=='__main__':
+    myprefix=sys.argv[1]
+    mypermutations=int(sys.argv[2])
+    myseed=0; myworkers=1
+    if len(sys.argv)>3:
+        myseed=int(sys.argv[3])
+    if len(sys.argv)>4:
+        myworkers=int(sys.argv[4])
+    print "reading the p-values of "+myprefix
+    mypvals=readcategoryfiles(myprefix)
+    print "running "+`mypermutations`+" permutations per category"
+    myresults=permutationtest(mypvals,mypermutations,myseed,myworkers)
+    writeenrichment(myresults,myprefix+"_enrichment.txt",mypermutations,
+                    myseed)
+    print "done running enrichment"
@@ -0,0 +1,270 @@
+#Rachel Ballantyne
+#2013
+
+"""This module does set operations on lists of genomic intervals: union,
+intersection, subtraction, complement against the size of a chromosome,
+total coverage and expanding each interval by some number of bases.
+All coordinates that are dealt with in this module are one-based inclusive
+start, one-based inclusive stop, like those in chromoarray.py.
+An interval set is given as two numpy int64 arrays, starts and stops, where
+interval i is [starts[i],stops[i]]. The functions return sets that are
+"clean": sorted by start, with no two intervals sharing a base. Every
+operation sorts the intervals once and then sweeps through them with numpy,
+so it takes O(n log n) time for n intervals. (The old two-pointer merges used
+list.remove(), which made them O(n^2) or worse on large lists like the
+Gencode records.)
+union() only merges intervals that overlap by one or more bases, like the
+old merge helpers, so [1,5] and [6,9] stay separate. The results of
+intersection(), subtract() and complement() are maximal runs of covered
+bases, so touching intervals are joined. Either way the same bases are
+covered.
+Use fromlist() and tolist() to convert to and from the two-dimensional lists
+(e.g. [[12,34],[45,62],[30,70]]) used in the rest of the pipeline.
+A list of interval sets, one per chromosome, can be saved to a binary file
+with saveintervalsets() (see INTERVALSETS_HEADER) and read back with
+loadintervalsets()."""
+
+import os
+import struct
+
+import numpy
+
+#Header of a saved list of interval sets: magic string, encoding version,
+#number of sets and a reserved field. It is followed by number of sets + 1
+#little-endian uint64 offsets (set i is intervals offsets[i]:offsets[i+1]),
+#then by all the starts and then all the stops as little-endian int64.
+INTERVALSETS_MAGIC="INTVSETS"
+INTERVALSETS_HEADER="<8sIIQ"
+INTERVALSETS_ENCODING=1
+
+def fromlist(intervallist):
+    """Return (starts,stops) numpy int64 arrays for <intervallist>, a list
+    of [start,stop] pairs."""
+    starts=numpy.fromiter((interval[0] for interval in intervallist),
+                          dtype=numpy.int64,count=len(intervallist))
+    stops=numpy.fromiter((interval[1] for interval in intervallist),
+                         dtype=numpy.int64,count=len(intervallist))
+    return starts,stops
+
+def tolist(starts,stops):
+    """Return the interval set <starts>,<stops> as a list of [start,stop]
+    lists of Python ints."""
+    return [list(interval) for interval in zip(starts.tolist(),stops.tolist())]
+
+def union(starts,stops):
+    """Return (starts,stops) of the clean interval set covering the same
+    bases as <starts>,<stops>, which may overlap and be in any order.
+    Intervals that overlap by one or more bases are merged."""
+    starts=numpy.asarray(starts,dtype=numpy.int64)
+    stops=numpy.asarray(stops,dtype=numpy.int64)
+    if len(starts)==0:
+        return starts.copy(),stops.copy()
+    order=numpy.argsort(starts,kind='mergesort')
+    starts=starts[order]
+    stops=stops[order]
+    #reach[i] is the furthest any of intervals 0..i reaches; interval i+1
+    #starts a new merged interval if it begins after that
+    reach=numpy.maximum.accumulate(stops)
+    newinterval=numpy.empty(len(starts),dtype=bool)
+    newinterval[0]=True
+    newinterval[1:]=starts[1:]>reach[:-1]
+    firsts=numpy.flatnonzero(newinterval)
+    lasts=numpy.append(firsts[1:]-1,len(starts)-1)
+    return starts[firsts],reach[lasts]
+
+def intersection(startsA,stopsA,startsB,stopsB):
+    """Return (starts,stops) of the bases covered by both interval set A and
+    interval set B."""
+    return _combine(startsA,stopsA,startsB,stopsB,numpy.logical_and)
+
+def subtract(startsA,stopsA,startsB,stopsB):
+    """Return (starts,stops) of the bases covered by interval set A but not
+    by interval set B."""
+    return _combine(startsA,stopsA,startsB,stopsB,
+                    lambda inA,inB: inA&~inB)
+
+def complement(starts,stops,chromsize):
+    """Return (starts,stops) of the bases from 1 to <chromsize> that are not
+    covered by <starts>,<stops>. Intervals reaching past the end of the
+    chromosome are cut off there."""
+    starts,stops=union(starts,stops)
+    gapstarts=numpy.append(numpy.array([1],dtype=numpy.int64),stops+1)
+    gapstops=numpy.append(starts-1,numpy.array([chromsize],dtype=numpy.int64))
+    gapstops=numpy.minimum(gapstops,chromsize)
+    keep=gapstarts<=gapstops
+    return gapstarts[keep],gapstops[keep]
+
+def coverage(starts,stops):
+    """Return the number of bases covered by <starts>,<stops>, counting
+    each base once however many intervals cover it."""
+    starts,stops=union(starts,stops)
+    #add one since the coordinate system has the endpoints included
+    return int((stops-starts+1).sum())
+
+def expand(starts,stops,bases,chromsize=None):
+    """Return (starts,stops) of the clean interval set made by extending
+    each interval of <starts>,<stops> by <bases> in both directions. Starts
+    are not moved below 1, and if <chromsize> is given stops are not moved
+    past it."""
+    starts=numpy.maximum(numpy.asarray(starts,dtype=numpy.int64)-bases,1)
+    stops=numpy.asarray(stops,dtype=numpy.int64)+bases
+    if chromsize is not None:
+        stops=numpy.minimum(stops,chromsize)
+    return union(starts,stops)
+
+def overlapsany(starts,stops,querystarts,querystops,distance=0):
+    """Return a numpy bool array saying for each query interval
+    [querystarts[i],querystops[i]] whether it comes within <distance> bases
+    of the clean interval set <starts>,<stops> (e.g. the output of union()),
+    i.e. whether it overlaps the set by one or more bases once the query is
+    extended by <distance> bases in both directions."""
+    querystarts=numpy.asarray(querystarts,dtype=numpy.int64)-distance
+    querystops=numpy.asarray(querystops,dtype=numpy.int64)+distance
+    #the stops of a clean set are sorted too, so nearest is the first
+    #interval that does not end before the query starts
+    nearest=numpy.searchsorted(stops,querystarts,side='left')
+    found=nearest<len(starts)
+    found[found]=starts[nearest[found]]<=querystops[found]
+    return found
+
+def saveintervalsets(path,intervalsets):
+    """Save <intervalsets>, a list of (starts,stops) interval sets (e.g. one
+    per chromosome), to a binary file at <path>. The file is written under a
+    temporary name and then renamed, so a partly written file is never left
+    at <path>."""
+    offsets=numpy.zeros(len(intervalsets)+1,dtype='<u8')
+    offsets[1:]=numpy.cumsum([len(starts) for starts,stops in intervalsets])
+    outfile=open(path+".tmp",'wb')
+    outfile.write(struct.pack(INTERVALSETS_HEADER,INTERVALSETS_MAGIC,
+                  INTERVALSETS_ENCODING,len(intervalsets),0))
+    outfile.write(offsets.tostring())
+    for which in [0,1]:
+        for intervalset in intervalsets:
+            outfile.write(numpy.asarray(intervalset[which],
+                                        dtype='<i8').tostring())
+    outfile.close()
+    os.rename(path+".tmp",path)
+
+def loadintervalsets(path):
+    """Return the list of (starts,stops) interval sets saved at <path> by
+    saveintervalsets()."""
+    infile=open(path,'rb')
+    data=infile.read()
+    infile.close()
+    offset=struct.calcsize(INTERVALSETS_HEADER)
+    magic,encoding,nsets,reserved=struct.unpack(INTERVALSETS_HEADER,
+                                                data[:offset])
+    assert magic==INTERVALSETS_MAGIC, ("Error: "+path
+                                       +" is not an interval sets file")
+    assert encoding==INTERVALSETS_ENCODING, ("Error: "+path
+                +" has encoding version "+`encoding`+", not "
+                +`INTERVALSETS_ENCODING`)
+    offsets=numpy.frombuffer(data,dtype='<u8',count=nsets+1,offset=offset)
+    total=int(offsets[-1])
+    offset+=8*(nsets+1)
+    assert len(data)==offset+16*total, ("Error: "+path+" should hold "
+                +`total`+" intervals but has "+`len(data)-offset`+" bytes")
+    starts=numpy.frombuffer(data,dtype='<i8',count=total,
+                            offset=offset).astype(numpy.int64)
+    stops=numpy.frombuffer(data,dtype='<i8',count=total,
+                           offset=offset+8*total).astype(numpy.int64)
+    return [(starts[offsets[which]:offsets[which+1]],
+             stops[offsets[which]:offsets[which+1]])
+            for which in xrange(nsets)]
+
+def _combine(startsA,stopsA,startsB,stopsB,keepfunction):
+    """Return (starts,stops) of the maximal runs of bases for which
+    <keepfunction>(inA,inB) is True, where inA and inB are numpy bool arrays
+    saying whether the bases are covered by interval set A and B."""
+    startsA,stopsA=union(startsA,stopsA)
+    startsB,stopsB=union(startsB,stopsB)
+    #Every base between two neighbouring boundaries is covered the same way,
+    #so it is enough to look at the first base after each boundary
+    boundaries=numpy.unique(numpy.concatenate((startsA,stopsA+1,
+                                               startsB,stopsB+1)))
+    if len(boundaries)==0:
+        return boundaries.copy(),boundaries.copy()
+    keep=keepfunction(_covers(startsA,stopsA,boundaries),
+                      _covers(startsB,stopsB,boundaries))
+    #the last boundary is past every interval, so keep[-1] is always False
+    change=numpy.diff(keep.astype(numpy.int8))
+    runstarts=boundaries[numpy.flatnonzero(change==1)+1]
+    runstops=boundaries[numpy.flatnonzero(change==-1)+1]-1
+    if keep[0]:
+        runstarts=numpy.append(boundaries[:1],runstarts)
+    return runstarts,runstops
+
+def _covers(starts,stops,positions):
+    """Return a numpy bool array saying whether each of <positions> is in
+    the clean interval set <starts>,<stops>."""
+    last=numpy.searchsorted(starts,positions,side='right')-1
+    covered=last>=0
+    covered[covered]=positions[covered]<=stops[last[covered]]
+    return covered
+
+#----------TESTING--------------------------------------------------------------
+def _test_intervalset():
+    """Test every operation against sets of bases, for random interval
+    lists, and check that union() keeps touching intervals apart."""
+    import random
+    random.seed(5521)
+    def randomintervals(chromsize):
+        intervals=[]
+        for number in xrange(random.randint(0,10)):
+            start=random.randint(1,chromsize)
+            intervals.append([start,start+random.randint(0,25)])
+        return intervals
+    def basesof(starts,stops):
+        bases=set()
+        for start,stop in zip(starts.tolist(),stops.tolist()):
+            bases.update(xrange(start,stop+1))
+        return bases
+    def isclean(starts,stops,touchingallowed):
+        gap=1 if touchingallowed else 2
+        return ((starts<=stops).all()
+                and (starts[1:]>=stops[:-1]+gap).all())
+    for test in xrange(500):
+        chromsize=random.randint(1,200)
+        setA=fromlist(randomintervals(chromsize))
+        setB=fromlist(randomintervals(chromsize))
+        basesA=basesof(*setA)
+        basesB=basesof(*setB)
+        unionA=union(*setA)
+        assert isclean(unionA[0],unionA[1],True), ("Error: test "+`test`
+            +" union() gave "+`tolist(*unionA)`)
+        assert basesof(*unionA)==basesA, "Error: test "+`test`+" union()"
+        for name,result,expected in [
+            ("intersection",intersection(setA[0],setA[1],*setB),
+             basesA&basesB),
+            ("subtract",subtract(setA[0],setA[1],*setB),basesA-basesB),
+            ("complement",complement(setA[0],setA[1],chromsize),
+             set(xrange(1,chromsize+1))-basesA),
+            ("expand",expand(setA[0],setA[1],3,chromsize),
+             set(base for base in xrange(1,chromsize+1)
+                 if any(abs(base-other)<=3 for other in basesA)))]:
+            assert isclean(result[0],result[1],name=="expand"), ("Error: test "
+                +`test`+" "+name+"() gave "+`tolist(*result)`)
+            assert basesof(*result)==expected, ("Error: test "+`test`+" "
+                +name+"() gave "+`tolist(*result)`)
+        assert coverage(*setA)==len(basesA), "Error: test "+`test`+" coverage()"
+    assert tolist(*union(*fromlist([[6,9],[1,5],[3,4]])))==[[1,5],[6,9]], (
+        "Error: union() merged touching intervals")
+    assert tolist(*union(*fromlist([])))==[], "Error: union() of nothing"
+    for test in xrange(300):
+        cleanset=union(*fromlist(randomintervals(200)))
+        bases=basesof(*cleanset)
+        queries=fromlist(randomintervals(200))
+        for distance in [0,1,7]:
+            expected=[any(base in bases for base in xrange(start-distance,
+                                                          stop+distance+1))
+                      for start,stop in zip(*queries)]
+            assert overlapsany(cleanset[0],cleanset[1],queries[0],queries[1],
+                               distance).tolist()==expected, ("Error: test "
+                +`test`+" overlapsany() with distance "+`distance`)
+    sets=[union(*fromlist(randomintervals(50))) for which in xrange(24)]
+    saveintervalsets("_test_intervalset.ivs",sets)
+    loaded=loadintervalsets("_test_intervalset.ivs")
+    os.remove("_test_intervalset.ivs")
+    assert [tolist(*pair) for pair in loaded]==[tolist(*pair) for pair
+            in sets], "Error: loadintervalsets() gave different sets"
+    print "Passed _test_intervalset()"
@@ -0,0 +1,244 @@
+#Rachel Ballantyne
+#pvalsummary.py
+
+"""Summarize the GWAS p-values of the SNPs in each category made by
+categorizeSNPsII.py without keeping the p-values themselves.
+
+A CategorySummary is updated with the p-values of a category a chunk at a
+time (e.g. one chromosome at a time) and holds:
+    count: the number of p-values
+    histogram: the number of p-values in each bin of -log10(p), the bins
+        being HISTOGRAM_BINWIDTH wide from 0 up to HISTOGRAM_MAXSCORE, plus a
+        last bin for everything above that (including p-values of 0)
+    thresholdcounts: the number of p-values at or below each of the
+        thresholds
+    sketch: a QuantileSketch, from which any quantile of the p-values can be
+        read to within a relative error of SKETCH_ACCURACY (enough for QQ
+        plots of -log10(p))
+Two summaries with the same settings can be merged, e.g. to combine the
+summaries of separate runs or chromosomes, and the result is the same as if
+all of the p-values had been added to one summary.
+The summaries of all five categories of a GWAS are saved together in one
+JSON file with savesummaries() and read back with loadsummaries()."""
+
+import json
+import math
+
+import numpy
+
+HISTOGRAM_BINWIDTH=0.1
+HISTOGRAM_MAXSCORE=50.0
+SKETCH_ACCURACY=0.01
+SUMMARY_THRESHOLDS=[5e-8,1e-5,1e-3,0.05]
+
+class QuantileSketch(object):
+    """A mergeable sketch of a set of p-values (floats in [0,1]) that gives
+    each quantile to within a relative error of <accuracy>.
+    Each positive value v is counted in bin ceil(log(v)/log(gamma)), where
+    gamma is (1+accuracy)/(1-accuracy), and zeros are counted separately.
+    Every value in a bin is within a relative error of <accuracy> of the
+    bin's middle value, so the sketch only needs one count per bin that is
+    used: a few thousand bins for p-values down to 1e-300. Sketches are
+    merged by adding their counts."""
+    def __init__(self,accuracy=SKETCH_ACCURACY):
+        assert 0<accuracy<1, ("Error: accuracy must be between 0 and 1,"
+                              +" not "+`accuracy`)
+        self.accuracy=accuracy
+        self.gamma=(1+accuracy)/(1-accuracy)
+        self.zeros=0
+        self.bincounts={}
+
+    def add(self,pvals):
+        """Add the numpy array of p-values <pvals> to the sketch."""
+        pvals=numpy.asarray(pvals,dtype=numpy.float64)
+        positive=pvals[pvals>0]
+        self.zeros+=len(pvals)-len(positive)
+        if len(positive)==0:
+            return
+        indices=numpy.ceil(numpy.log(positive)
+                           /math.log(self.gamma)).astype(numpy.int64)
+        binindices,counts=numpy.unique(indices,return_counts=True)
+        for binindex,count in zip(binindices.tolist(),counts.tolist()):
+            self.bincounts[binindex]=self.bincounts.get(binindex,0)+count
+
+    def merge(self,other):
+        """Add the counts of the QuantileSketch <other> to this one."""
+        assert other.accuracy==self.accuracy, ("Error: can't merge sketches"
+                +" with accuracy "+`other.accuracy`+" and "+`self.accuracy`)
+        self.zeros+=other.zeros
+        for binindex in other.bincounts:
+            self.bincounts[binindex]=(self.bincounts.get(binindex,0)
+                                      +other.bincounts[binindex])
+
+    def count(self):
+        """Return the number of p-values added to the sketch."""
+        return self.zeros+sum(self.bincounts.values())
+
+    def quantile(self,q):
+        """Return the <q> quantile (0 <= q <= 1) of the p-values: the middle
+        of the bin holding the value of rank round(q*(count-1)) in sorted
+        order, or None if the sketch is empty."""
+        assert 0<=q<=1, "Error: q must be between 0 and 1, not "+`q`
+        total=self.count()
+        if total==0:
+            return None
+        rank=int(round(q*(total-1)))
+        if rank<self.zeros:
+            return 0.0
+        seen=self.zeros
+        for binindex in sorted(self.bincounts):
+            seen+=self.bincounts[binindex]
+            if seen>rank:
+                return 2*self.gamma**binindex/(self.gamma+1)
+
+    def todict(self):
+        """Return the sketch as a dictionary that can be saved as JSON."""
+        binindices=sorted(self.bincounts)
+        return {"accuracy":self.accuracy,"zeros":self.zeros,
+                "bins":binindices,
+                "counts":[self.bincounts[binindex] for binindex in binindices]}
+
+    @staticmethod
+    def fromdict(sketchdict):
+        """Return the QuantileSketch described by <sketchdict> (the output of
+        todict())."""
+        sketch=QuantileSketch(sketchdict["accuracy"])
+        sketch.zeros=sketchdict["zeros"]
+        sketch.bincounts=dict(zip(sketchdict["bins"],sketchdict["counts"]))
+        return sketch
+
+class CategorySummary(object):
+    """The count, -log10(p) histogram, threshold counts and QuantileSketch of
+    the p-values of one category (see the module docstring)."""
+    def __init__(self,thresholds=SUMMARY_THRESHOLDS,
+                 binwidth=HISTOGRAM_BINWIDTH,maxscore=HISTOGRAM_MAXSCORE,
+                 accuracy=SKETCH_ACCURACY):
+        self.thresholds=list(thresholds)
+        self.binwidth=binwidth
+        self.maxscore=maxscore
+        self.count=0
+        #the last bin is for everything above maxscore
+        self.histogram=numpy.zeros(int(round(maxscore/binwidth))+1,
+                                   dtype=numpy.int64)
+        self.thresholdcounts=numpy.zeros(len(self.thresholds),
+                                         dtype=numpy.int64)
+        self.sketch=QuantileSketch(accuracy)
+
+    def add(self,pvals):
+        """Add the numpy array of p-values <pvals> to the summary."""
+        pvals=numpy.asarray(pvals,dtype=numpy.float64)
+        self.count+=len(pvals)
+        if len(pvals)==0:
+            return
+        scores=-numpy.log10(numpy.maximum(pvals,
+                                          numpy.finfo(numpy.float64).tiny))
+        bins=numpy.minimum(numpy.maximum(scores,0)/self.binwidth,
+                           len(self.histogram)-1).astype(numpy.int64)
+        self.histogram+=numpy.bincount(bins,minlength=len(self.histogram))
+        sortedpvals=numpy.sort(pvals)
+        self.thresholdcounts+=numpy.searchsorted(sortedpvals,self.thresholds,
+                                                 side='right')
+        self.sketch.add(pvals)
+
+    def merge(self,other):
+        """Add the contents of the CategorySummary <other>, which must have
+        the same settings, to this one."""
+        assert (other.thresholds==self.thresholds
+                and other.binwidth==self.binwidth
+                and other.maxscore==self.maxscore), ("Error: can't merge"
+                +" summaries with different thresholds or histogram bins")
+        self.count+=other.count
+        self.histogram+=other.histogram
+        self.thresholdcounts+=other.thresholdcounts
+        self.sketch.merge(other.sketch)
+
+    def todict(self):
+        """Return the summary as a dictionary that can be saved as JSON."""
+        return {"count":self.count,"thresholds":self.thresholds,
+                "thresholdcounts":self.thresholdcounts.tolist(),
+                "binwidth":self.binwidth,"maxscore":self.maxscore,
+                "histogram":self.histogram.tolist(),
+                "sketch":self.sketch.todict()}
+
+    @staticmethod
+    def fromdict(summarydict):
+        """Return the CategorySummary described by <summarydict> (the output
+        of todict())."""
+        summary=CategorySummary(summarydict["thresholds"],
+                                summarydict["binwidth"],
+                                summarydict["maxscore"],
+                                summarydict["sketch"]["accuracy"])
+        summary.count=summarydict["count"]
+        summary.histogram=numpy.array(summarydict["histogram"],
+                                      dtype=numpy.int64)
+        summary.thresholdcounts=numpy.array(summarydict["thresholdcounts"],
+                                            dtype=numpy.int64)
+        summary.sketch=QuantileSketch.fromdict(summarydict["sketch"])
+        return summary
+
+def savesummaries(path,summaries,details={}):
+    """Save <summaries>, a dictionary of CategorySummary objects keyed by
+    category char, to the JSON file <path>. The dictionary <details> (e.g.
+    the GWAS and the bases value) is saved with them."""
+    outputfile=open(path,'w')
+    json.dump({"details":details,
+               "categories":dict((category,summaries[category].todict())
+                                 for category in summaries)},
+              outputfile,sort_keys=True)
+    outputfile.close()
+
+def loadsummaries(path):
+    """Return (summaries, details) from the JSON file saved at <path> by
+    savesummaries()."""
+    inputfile=open(path,'r')
+    saved=json.load(inputfile)
+    inputfile.close()
+    summaries=dict((str(category),CategorySummary.fromdict(
+                    saved["categories"][category]))
+                   for category in saved["categories"])
+    return summaries,saved["details"]
+
+#----------TESTING--------------------------------------------------------------
+def _test_categorysummary():
+    """Compare a CategorySummary built from chunks of random p-values, and
+    merged, saved and loaded, with the p-values themselves."""
+    import os
+    randomstate=numpy.random.RandomState(8)
+    pvals=numpy.concatenate((randomstate.uniform(size=20000),
+                             randomstate.uniform(size=500)**40,
+                             numpy.array([0.0,0.0,1.0,5e-8,1e-300])))
+    randomstate.shuffle(pvals)
+    first=CategorySummary()
+    second=CategorySummary()
+    for chunk in numpy.array_split(pvals,7)[:4]:
+        first.add(chunk)
+    for chunk in numpy.array_split(pvals,7)[4:]:
+        second.add(chunk)
+    second.add(numpy.array([],dtype=numpy.float64))
+    first.merge(second)
+    savesummaries("_test_categorysummary.json",{"l":first},{"GWAS":"test"})
+    loaded,details=loadsummaries("_test_categorysummary.json")
+    os.remove("_test_categorysummary.json")
+    assert details=={"GWAS":"test"}, "Error: details were "+`details`
+    summary=loaded["l"]
+    assert summary.count==len(pvals), "Error: count was "+`summary.count`
+    for which in range(len(SUMMARY_THRESHOLDS)):
+        expected=(pvals<=SUMMARY_THRESHOLDS[which]).sum()
+        assert summary.thresholdcounts[which]==expected, ("Error: "
+            +`summary.thresholdcounts[which]`+" p-values at or below "
+            +`SUMMARY_THRESHOLDS[which]`+", not "+`expected`)
+    assert summary.histogram.sum()==len(pvals), "Error: histogram total"
+    expected=(pvals<10**-HISTOGRAM_MAXSCORE).sum()
+    assert summary.histogram[-1]==expected, ("Error: "
+        +`summary.histogram[-1]`+" p-values in the overflow bin, not "
+        +`expected`)
+    assert summary.histogram[0]==(pvals>10**-HISTOGRAM_BINWIDTH).sum(), (
+        "Error: wrong number of p-values in the first bin")
+    sortedpvals=numpy.sort(pvals)
+    for q in [0,0.0001,0.001,0.01,0.1,0.25,0.5,0.9,1]:
+        expected=sortedpvals[int(round(q*(len(pvals)-1)))]
+        actual=summary.sketch.quantile(q)
+        assert abs(actual-expected)<=SKETCH_ACCURACY*expected*1.000001, (
+            "Error: quantile "+`q`+" was "+`actual`+", not about "
+            +`expected`)
+    print "Passed _test_categorysummary()"